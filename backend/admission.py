@@ -0,0 +1,212 @@
+"""
+Admission control: bounded per-stage concurrency and per-client rate limits.
+
+Each limited stage admits `concurrency` callers at a time and lets at most
+`queue_size` more wait for a slot. Anything beyond that is refused at once
+with Overloaded, so a traffic spike is shed with 503 + Retry-After instead of
+piling up uploads in memory, oversubscribing the ONNX threads or flooding the
+LLM provider. Clients are also held to a token-bucket request rate (429).
+
+Limiters are used from the event loop only and need no locking.
+
+    UPLOAD_CONCURRENCY=64     UPLOAD_QUEUE_SIZE=256
+    INFERENCE_CONCURRENCY=16  INFERENCE_QUEUE_SIZE=128
+    LLM_CONCURRENCY=32        LLM_QUEUE_SIZE=128
+    RATE_LIMIT_PER_SECOND=10  RATE_LIMIT_BURST=30
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional
+
+
+class Overloaded(Exception):
+    """Raised when a stage's queue is full or a queued caller waited too long for a slot"""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"{stage} stage is at capacity")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    def __init__(self, name: str, concurrency: int, queue_size: int, queue_timeout: float = 10.0):
+        self.name = name
+        # 0 disables the limit
+        self.concurrency = max(0, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = deque()
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self._hold_seconds = 0.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def saturated(self) -> bool:
+        """True when the next caller would be refused"""
+        return self.concurrency > 0 and self.active >= self.concurrency and self.waiting >= self.queue_size
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead of a new caller has likely drained"""
+        if self.concurrency == 0:
+            return 1
+        return max(1, math.ceil(self._hold_seconds * (self.waiting + 1) / self.concurrency))
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the time it was granted, to pass to release()"""
+        if self.concurrency == 0 or (self.active < self.concurrency and not self._waiters):
+            self.active += 1
+            self.admitted += 1
+            return time.monotonic()
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise Overloaded(self.name, self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        expiry = loop.call_later(self.queue_timeout, self._expire, waiter)
+        try:
+            granted = await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                self._discard(waiter)
+            elif waiter.result():
+                # The slot was handed over just as the caller went away
+                self.release()
+            raise
+        finally:
+            expiry.cancel()
+        if not granted:
+            self.timed_out += 1
+            raise Overloaded(self.name, self.retry_after())
+        self.admitted += 1
+        return time.monotonic()
+
+    def release(self, acquired_at: Optional[float] = None):
+        if acquired_at is not None:
+            self._hold_seconds += 0.1 * ((time.monotonic() - acquired_at) - self._hold_seconds)
+        # Hand the slot straight to the next waiter, so it cannot be taken by a newcomer
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def _expire(self, waiter):
+        if not waiter.done():
+            self._discard(waiter)
+            waiter.set_result(False)
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    @asynccontextmanager
+    async def slot(self):
+        acquired_at = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(acquired_at)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency or None,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "saturated": self.saturated,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_hold_ms": self._hold_seconds * 1000,
+        }
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+
+class ClientRateLimiter:
+    """Token bucket per client address; the least recently seen clients are forgotten first"""
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        # A rate of 0 disables rate limiting
+        self.rate = max(0.0, rate)
+        self.burst = max(1, burst)
+        self.max_clients = max(1, max_clients)
+        self._clock = clock
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, client: str) -> float:
+        """Take a token for the client; returns 0 if allowed, else seconds until a token is available"""
+        if not self.enabled:
+            return 0.0
+        now = self._clock()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.burst, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            self.allowed += 1
+            return 0.0
+        self.limited += 1
+        return (1 - bucket.tokens) / self.rate
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "rate_per_second": self.rate or None,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT_SECONDS', '10'))
+
+upload_limiter = StageLimiter(
+    "upload", int(os.getenv('UPLOAD_CONCURRENCY', '64')), int(os.getenv('UPLOAD_QUEUE_SIZE', '256')), _QUEUE_TIMEOUT)
+inference_limiter = StageLimiter(
+    "inference", int(os.getenv('INFERENCE_CONCURRENCY', '16')), int(os.getenv('INFERENCE_QUEUE_SIZE', '128')), _QUEUE_TIMEOUT)
+llm_limiter = StageLimiter(
+    "llm", int(os.getenv('LLM_CONCURRENCY', '32')), int(os.getenv('LLM_QUEUE_SIZE', '128')), _QUEUE_TIMEOUT)
+rate_limiter = ClientRateLimiter(
+    float(os.getenv('RATE_LIMIT_PER_SECOND', '10')), int(os.getenv('RATE_LIMIT_BURST', '30')),
+    int(os.getenv('RATE_LIMIT_MAX_CLIENTS', '10000')))
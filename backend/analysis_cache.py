@@ -0,0 +1,189 @@
+"""
+Cache for OpenAI detailed analyses.
+
+The prompt only depends on the condition, the confidence and the condition's
+treatments, so analyses are cached per (LLM model, condition, confidence
+bucket). Concurrent misses for the same key share one in-flight call.
+A precomputed file produced by warm_analysis_cache.py can be loaded so the
+server answers without any network call.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from schemas import DetailedAnalysis
+from structured_logging import get_logger
+
+logger = get_logger("analysis_cache")
+
+DEFAULT_BUCKET_WIDTH = 0.1
+
+SECTIONS = tuple(DetailedAnalysis.model_fields)
+
+
+def is_valid_analysis(value: Any) -> bool:
+    """Whether value has every DetailedAnalysis section as a string, so it is safe to cache"""
+    return isinstance(value, dict) and all(isinstance(value.get(section), str) for section in SECTIONS)
+
+
+class AnalysisCache:
+    def __init__(self, bucket_width: float = DEFAULT_BUCKET_WIDTH, max_entries: int = 1024,
+                 precomputed_path: Optional[str] = None):
+        if not 0 < bucket_width <= 1:
+            raise ValueError("Confidence bucket width must be in (0, 1]")
+        self.bucket_width = bucket_width
+        self.bucket_count = int(round(1 / bucket_width))
+        self.max_entries = max(0, max_entries)
+        self.precomputed_path = precomputed_path
+
+        self._entries: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._precomputed: Dict[str, Dict[str, str]] = {}
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._precomputed_hits = 0
+        self._misses = 0
+        self._coalesced = 0
+
+        if precomputed_path and os.path.exists(precomputed_path):
+            self.load_precomputed(precomputed_path)
+
+    def bucket(self, confidence: float) -> int:
+        """Index of the confidence band a probability falls into"""
+        return min(max(int(confidence / self.bucket_width), 0), self.bucket_count - 1)
+
+    def bucket_confidence(self, confidence: float) -> float:
+        """Representative confidence (band midpoint) used when generating a cached analysis"""
+        return round((self.bucket(confidence) + 0.5) * self.bucket_width, 4)
+
+    def make_key(self, condition: str, confidence: float, model: str) -> str:
+        return f"{model}|{condition.strip().lower()}|{self.bucket(confidence)}"
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            return self._get_locked(key)
+
+    def _get_locked(self, key: str) -> Optional[Dict[str, str]]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+        value = self._precomputed.get(key)
+        if value is not None:
+            self._precomputed_hits += 1
+        return value
+
+    def put(self, key: str, value: Dict[str, str]):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def claim(self, key: str):
+        """
+        Return (cached value, in-flight future, is_leader) for a key. The leader computes the
+        value and must pass it to settle(), None included; everyone else waits on the future.
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                return value, None, False
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return None, future, False
+            self._misses += 1
+            future = Future()
+            self._in_flight[key] = future
+            return None, future, True
+
+    def settle(self, key: str, future: Future, value: Optional[Dict[str, str]]):
+        # None means the call failed; waiters get None too and nothing is cached
+        if value is not None:
+            self.put(key, value)
+        with self._lock:
+            self._in_flight.pop(key, None)
+        future.set_result(value)
+
+    def _fail(self, key: str, future: Future, error: BaseException):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        future.set_exception(error)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Optional[Dict[str, str]]]) -> Optional[Dict[str, str]]:
+        """Return the cached analysis, or run compute once for all concurrent callers of this key"""
+        value, future, is_leader = self.claim(key)
+        if value is not None:
+            return value
+        if not is_leader:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self.settle(key, future, value)
+        return value
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[Optional[Dict[str, str]]]]) -> Optional[Dict[str, str]]:
+        """Async counterpart of get_or_compute; shares in-flight calls with sync callers"""
+        value, future, is_leader = self.claim(key)
+        if value is not None:
+            return value
+        if not is_leader:
+            return await asyncio.wrap_future(future)
+        try:
+            value = await compute()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self.settle(key, future, value)
+        return value
+
+    def load_precomputed(self, path: str) -> int:
+        """Load analyses generated offline; returns the number of entries loaded"""
+        with open(path, 'r') as file:
+            data = json.load(file)
+        if abs(float(data.get('bucket_width', self.bucket_width)) - self.bucket_width) > 1e-9:
+            logger.warning(f"Ignoring precomputed analyses in {path}: bucket width {data.get('bucket_width')} "
+                           f"does not match {self.bucket_width}")
+            return 0
+        entries = {key: value for key, value in data.get('entries', {}).items() if is_valid_analysis(value)}
+        skipped = len(data.get('entries', {})) - len(entries)
+        if skipped:
+            logger.warning(f"Skipped {skipped} malformed precomputed analyses in {path}")
+        with self._lock:
+            self._precomputed.update(entries)
+        logger.info(f"Loaded {len(entries)} precomputed analyses from {path}")
+        return len(entries)
+
+    @staticmethod
+    def save_precomputed(path: str, entries: Dict[str, Dict[str, str]], bucket_width: float, model: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump({"model": model, "bucket_width": bucket_width, "entries": entries}, file, indent=2)
+        os.replace(tmp_path, path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "precomputed_entries": len(self._precomputed),
+                "bucket_width": self.bucket_width,
+                "hits": self._hits,
+                "precomputed_hits": self._precomputed_hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._in_flight),
+            }
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Stage-level micro-benchmarks for the detection pipeline.
+
+Times each stage of an /analyze request on its own: image decode, resize
+and cast into the float32 batch buffer, ONNX model.run, catalog lookup, the
+OpenAI call against a local stub server, and pydantic response building.
+Decode and resize run for several image sizes, model.run for several batch
+sizes.
+
+Results are written as a JSON baseline. With --compare, the run is checked
+against an earlier baseline and exits non-zero when any stage got slower by
+more than --threshold.
+
+When VIT23n_quantmodel.onnx is not present a tiny generated model with the
+same input and output signature is used instead, so the suite runs anywhere
+(model.run numbers are then only comparable with other tiny-model runs).
+
+Usage:
+    python benchmark_pipeline.py [--output baseline.json] [--compare baseline.json] [--threshold 0.2]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import onnxruntime as ort
+
+from benchmark_preprocessing import make_jpeg
+from preprocessing import INPUT_SIZE, load_rgb, preprocess_image
+from schemas import APIOutput, DetailedAnalysis, DetectionResponse
+from skin_detection_model import MODEL_PATH, result_from_prediction
+from stub_llm_server import StubLLMServer
+
+DEFAULT_SIZES = ["640x480", "1280x960", "4000x3000"]
+DEFAULT_BATCH_SIZES = [1, 4, 8]
+NUM_CLASSES = 22
+
+
+# Minimal protobuf encoding of an ONNX ModelProto, so the tiny model needs no `onnx` package
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, value):
+    if isinstance(value, int):
+        return _varint(number << 3) + _varint(value)
+    if isinstance(value, str):
+        value = value.encode()
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _tensor_type(elem_type, dims):
+    shape = b''.join(
+        _field(1, _field(2, dim) if isinstance(dim, str) else _field(1, dim)) for dim in dims
+    )
+    return _field(1, _field(1, elem_type) + _field(2, shape))
+
+
+def _value_info(name, dims):
+    return _field(1, name) + _field(2, _tensor_type(1, dims))
+
+
+def _node(op_type, inputs, outputs, attributes=b''):
+    return b''.join(_field(1, name) for name in inputs) + b''.join(_field(2, name) for name in outputs) \
+        + _field(4, op_type) + attributes
+
+
+def build_tiny_model(path, num_classes=NUM_CLASSES, seed=0):
+    """
+    Write a small ONNX model with the real model's signature:
+    input_1 (N, 256, 256, 3) float32 -> dense (N, num_classes) softmax
+    """
+    weights = (np.random.RandomState(seed).randn(3, num_classes) / 50).astype(np.float32)
+    initializer = _field(1, 3) + _field(1, num_classes) + _field(2, 1) + _field(8, 'W') + _field(9, weights.tobytes())
+
+    axes = _field(5, _field(1, 'axes') + _field(8, 1) + _field(8, 2) + _field(20, 7))
+    keepdims = _field(5, _field(1, 'keepdims') + _field(3, 0) + _field(20, 2))
+    softmax_axis = _field(5, _field(1, 'axis') + _field(3, 1) + _field(20, 2))
+    graph = b''.join([
+        _field(1, _node('ReduceMean', ['input_1'], ['mean'], axes + keepdims)),
+        _field(1, _node('MatMul', ['mean', 'W'], ['logits'])),
+        _field(1, _node('Softmax', ['logits'], ['dense'], softmax_axis)),
+        _field(2, 'tiny'),
+        _field(5, initializer),
+        _field(11, _value_info('input_1', ['N', INPUT_SIZE, INPUT_SIZE, 3])),
+        _field(12, _value_info('dense', ['N', num_classes])),
+    ])
+    model = _field(1, 8) + _field(7, graph) + _field(8, _field(1, '') + _field(2, 13))
+    with open(path, 'wb') as file:
+        file.write(model)
+    return path
+
+
+def time_stage(fn, runs, warmup=2):
+    """Median and p95 wall time of fn() in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter_ns()
+        fn()
+        timings.append((time.perf_counter_ns() - started) / 1e6)
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings), 4),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+        "runs": runs,
+    }
+
+
+def run_benchmarks(model_path, sizes, batch_sizes, runs):
+    results = {}
+    batch_buffer = np.empty((max(batch_sizes), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+
+    # Decode and resize/cast per image size
+    for size in sizes:
+        width, height = (int(value) for value in size.lower().split('x'))
+        image_bytes = make_jpeg(width, height)
+        decoded = load_rgb(image_bytes)
+        results[f"decode/{size}"] = time_stage(lambda: load_rgb(image_bytes), runs)
+
+        def resize():
+            np.copyto(batch_buffer[0], preprocess_image(decoded), casting='unsafe')
+        results[f"resize/{size}"] = time_stage(resize, runs)
+
+    # model.run per batch size
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+    batch_buffer[:] = np.random.RandomState(0).randint(0, 256, batch_buffer.shape)
+    for batch_size in batch_sizes:
+        inputs = batch_buffer[:batch_size]
+        stats = time_stage(lambda: session.run(['dense'], {'input_1': inputs}), runs)
+        stats["per_image_ms"] = round(stats["median_ms"] / batch_size, 4)
+        results[f"model_run/batch{batch_size}"] = stats
+    prediction = session.run(['dense'], {'input_1': batch_buffer[:1]})[0][0]
+
+    # Catalog lookup: prediction row -> disease information
+    results["catalog_lookup"] = time_stage(lambda: result_from_prediction(prediction), runs * 10)
+    result = result_from_prediction(prediction, 0.01)
+    basic_advice = ', '.join(result['treatments'])
+
+    # OpenAI call against a local stub: client overhead, HTTP round trip and parsing only
+    from openai_service import OpenAIService
+    with StubLLMServer(delay=0) as stub:
+        service = OpenAIService()
+        service.api_key = "benchmark-key"
+        service.base_url = stub.base_url
+        service.client_mode = "sync"
+        analysis = service._request_analysis(result['disease'], result['probability'], basic_advice)
+        results["llm_stub"] = time_stage(
+            lambda: service._request_analysis(result['disease'], result['probability'], basic_advice), runs)
+
+    # Response model building and JSON serialization
+    def build_response():
+        output = APIOutput(**result, detailed_analysis=DetailedAnalysis(**analysis))
+        return DetectionResponse(success=True, result=output).model_dump_json()
+    results["response_build"] = time_stage(build_response, runs * 10)
+
+    return results
+
+
+def compare(current, baseline, threshold, min_delta_ms):
+    """Stages whose median got slower than the baseline by more than threshold"""
+    regressions = []
+    print(f"{'stage':<28} {'baseline ms':>12} {'current ms':>11} {'change':>8}")
+    for stage, stats in current.items():
+        previous = baseline.get(stage)
+        if previous is None:
+            print(f"{stage:<28} {'-':>12} {stats['median_ms']:>11.3f} {'new':>8}")
+            continue
+        before, after = previous['median_ms'], stats['median_ms']
+        change = (after - before) / before if before else 0.0
+        regressed = change > threshold and after - before > min_delta_ms
+        marker = "  ❌ regression" if regressed else ""
+        print(f"{stage:<28} {before:>12.3f} {after:>11.3f} {change:>+7.0%}{marker}")
+        if regressed:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the detection pipeline")
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help="Image sizes as WIDTHxHEIGHT")
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=DEFAULT_BATCH_SIZES, help="Batch sizes for model.run")
+    parser.add_argument('--runs', type=int, default=30, help="Timed iterations per stage")
+    parser.add_argument('--model', default=None, help="ONNX model (default: VIT23n_quantmodel.onnx, else a generated tiny model)")
+    parser.add_argument('--output', default=None, help="Write results to this JSON file")
+    parser.add_argument('--compare', default=None, help="Baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown before a stage counts as regressed (0.2 = 20%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = args.model or MODEL_PATH
+        if not os.path.exists(model_path):
+            model_path = build_tiny_model(os.path.join(directory, 'tiny.onnx'))
+            model_name = "tiny-generated"
+            print("⚠️  Local model not found, using a generated tiny model")
+        else:
+            model_name = os.path.basename(model_path)
+        results = run_benchmarks(model_path, args.sizes, args.batch_sizes, args.runs)
+
+    report = {
+        "meta": {
+            "model": model_name,
+            "python": platform.python_version(),
+            "onnxruntime": ort.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"✅ Baseline written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        if baseline.get("meta", {}).get("model") != model_name:
+            print(f"⚠️  Baseline was recorded with {baseline.get('meta', {}).get('model')}, this run uses {model_name}")
+        regressions = compare(results, baseline.get("results", {}), args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"❌ {len(regressions)} stage(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("✅ No regressions")
+    elif not args.output:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
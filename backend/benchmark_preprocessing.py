@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the image decode/preprocessing stage.
+
+Compares the original pipeline (full PIL decode, np.array copy, cv2.resize,
+np.float32 copy, np.expand_dims) with preprocessing.decode_image plus a copy
+into a reused float32 batch buffer, for synthetic JPEGs of several sizes.
+
+Latency is the median over --runs iterations. Peak memory is the growth in
+the process's maximum RSS while decoding one image, measured in a fresh
+subprocess per case so earlier cases do not mask later ones.
+
+Usage:
+    python benchmark_preprocessing.py [--sizes 640x480 4000x3000] [--runs 20]
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from preprocessing import INPUT_SIZE, decode_image
+
+DEFAULT_SIZES = ["640x480", "1280x960", "2048x1536", "4000x3000"]
+
+
+def make_jpeg(width, height, quality=90):
+    """Smooth synthetic photo-like image (noise would make JPEG sizes unrealistic)"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = np.stack([
+        127 + 100 * np.sin(x / 37.0),
+        127 + 100 * np.cos(y / 53.0),
+        127 + 100 * np.sin((x + y) / 71.0),
+    ], axis=-1).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def original_pipeline(image_bytes, batch_buffer=None):
+    pil_image = Image.open(BytesIO(image_bytes))
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    img_array = np.array(pil_image)
+    test_image = cv2.resize(img_array, (INPUT_SIZE, INPUT_SIZE))
+    im = np.float32(test_image)
+    return np.expand_dims(im, axis=0)
+
+
+def optimized_pipeline(image_bytes, batch_buffer):
+    np.copyto(batch_buffer[0], decode_image(image_bytes, use_draft=True), casting='unsafe')
+    return batch_buffer[:1]
+
+
+PIPELINES = {"original": original_pipeline, "optimized": optimized_pipeline}
+
+
+def peak_rss_kb():
+    """High-water mark of the process's resident set size in KB"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure_peak_rss(pipeline_name, image_path):
+    """Peak RSS growth (KB) for one decode, measured in a fresh interpreter"""
+    code = (
+        "import sys, json\n"
+        f"sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\n"
+        "import numpy as np\n"
+        "import benchmark_preprocessing as bench\n"
+        f"data = open({image_path!r}, 'rb').read()\n"
+        "buffer = np.empty((1, bench.INPUT_SIZE, bench.INPUT_SIZE, 3), dtype=np.float32)\n"
+        "before = bench.peak_rss_kb()\n"
+        f"bench.PIPELINES[{pipeline_name!r}](data, buffer)\n"
+        "after = bench.peak_rss_kb()\n"
+        "print(json.dumps(after - before))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return int(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image decode/preprocessing")
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help="Image sizes as WIDTHxHEIGHT")
+    parser.add_argument('--runs', type=int, default=20, help="Iterations per case for latency")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    batch_buffer = np.empty((1, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            width, height = (int(value) for value in size.lower().split('x'))
+            image_bytes = make_jpeg(width, height)
+            image_path = os.path.join(directory, f"{size}.jpg")
+            with open(image_path, 'wb') as file:
+                file.write(image_bytes)
+
+            row = {"size": size, "jpeg_kb": round(len(image_bytes) / 1024, 1)}
+            for name, pipeline in PIPELINES.items():
+                pipeline(image_bytes, batch_buffer)  # warm-up
+                timings = []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    pipeline(image_bytes, batch_buffer)
+                    timings.append((time.perf_counter() - started) * 1000)
+                row[f"{name}_ms"] = round(statistics.median(timings), 2)
+                row[f"{name}_peak_rss_kb"] = measure_peak_rss(name, image_path)
+            results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'size':>10} {'jpeg KB':>8} | {'original ms':>11} {'optimized ms':>12} {'speedup':>7} | "
+          f"{'original RSS KB':>15} {'optimized RSS KB':>16}")
+    for row in results:
+        speedup = row["original_ms"] / row["optimized_ms"] if row["optimized_ms"] else float('inf')
+        print(f"{row['size']:>10} {row['jpeg_kb']:>8} | {row['original_ms']:>11} {row['optimized_ms']:>12} "
+              f"{speedup:>6.1f}x | {row['original_peak_rss_kb']:>15} {row['optimized_peak_rss_kb']:>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Per-worker memory and throughput of the gunicorn launch mode.
+
+Starts `gunicorn -c gunicorn_conf.py main:app` on a free local port, sends
+/analyze requests from concurrent clients for a fixed time and reports each
+worker's RSS, PSS and private memory and the CPU time it used, together with
+overall requests per second and latency. Every upload gets a unique suffix so
+the result cache never answers. The OpenAI call is disabled (fallback
+analysis) so only the local pipeline is measured.
+
+--compare runs a second time with GUNICORN_SHARED_MODEL=false, where every
+worker loads its own model copy, to show what preloading saves.
+
+Usage:
+    python benchmark_workers.py [--workers 4] [--clients 16] [--duration 20] [--compare] [--output report.json]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+from benchmark_preprocessing import make_jpeg
+from process_stats import child_pids, cpu_seconds, memory_usage
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers, shared_model, extra_env=None):
+    env = dict(
+        os.environ,
+        HOST="127.0.0.1",
+        PORT=str(port),
+        WEB_CONCURRENCY=str(workers),
+        GUNICORN_SHARED_MODEL="true" if shared_model else "false",
+        OPENAI_API_KEY="",
+        RATE_LIMIT_PER_SECOND="0",
+        LOG_LEVEL="WARNING",
+        **(extra_env or {}),
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_ready(base_url, server, workers, timeout=120):
+    """Wait until every worker has started and warmed up its model"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        pids = child_pids(server.pid)
+        try:
+            if len(pids) == workers and all(_worker_ready(base_url) for _ in range(workers * 4)):
+                return pids
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"workers not ready after {timeout}s")
+
+
+def _worker_ready(base_url):
+    # A new connection each time, so the check reaches different workers
+    return requests.get(f"{base_url}/ready", timeout=5).status_code == 200
+
+
+def run_load(base_url, clients, duration, image):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(10 ** 9))
+    stop_at = time.time() + duration
+
+    def client():
+        nonlocal errors
+        session = requests.Session()
+        while time.time() < stop_at:
+            # Bytes after the JPEG end marker change the digest but not the decoded image
+            with lock:
+                upload = image + next(counter).to_bytes(8, "big")
+            started = time.perf_counter()
+            try:
+                ok = session.post(f"{base_url}/analyze", files={"image": ("bench.jpg", upload, "image/jpeg")},
+                                  timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.time() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / wall,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else None,
+    }
+
+
+def benchmark(workers, clients, duration, shared_model, image):
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(port, workers, shared_model)
+    try:
+        pids = wait_until_ready(base_url, server, workers)
+        cpu_before = {pid: cpu_seconds(pid) or 0.0 for pid in pids}
+        load = run_load(base_url, clients, duration, image)
+        worker_stats = [
+            {"pid": pid, **(memory_usage(pid) or {}), "cpu_seconds": (cpu_seconds(pid) or 0.0) - cpu_before[pid]}
+            for pid in pids
+        ]
+        master = memory_usage(server.pid) or {}
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return {
+        "shared_model": shared_model,
+        "workers": worker_stats,
+        "master": master,
+        "total_pss_mb": sum(worker.get("pss_mb", 0.0) for worker in worker_stats) + master.get("pss_mb", 0.0),
+        **load,
+    }
+
+
+def print_report(result):
+    print(f"\nShared model: {'yes' if result['shared_model'] else 'no'}")
+    print(f"{'worker':>8} {'RSS MB':>8} {'PSS MB':>8} {'private MB':>11} {'CPU s':>7}")
+    for worker in result["workers"]:
+        print(f"{worker['pid']:>8} {worker.get('rss_mb', 0):>8.1f} {worker.get('pss_mb', 0):>8.1f} "
+              f"{worker.get('private_mb', 0):>11.1f} {worker['cpu_seconds']:>7.2f}")
+    print(f"{'master':>8} {result['master'].get('rss_mb', 0):>8.1f} {result['master'].get('pss_mb', 0):>8.1f} "
+          f"{result['master'].get('private_mb', 0):>11.1f}")
+    print(f"Total PSS: {result['total_pss_mb']:.1f} MB")
+    print(f"Throughput: {result['requests_per_second']:.1f} req/s ({result['requests']} ok, {result['errors']} errors), "
+          f"p50 {result['p50_ms'] or 0:.1f} ms, p95 {result['p95_ms'] or 0:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-worker memory and throughput under gunicorn")
+    parser.add_argument('--workers', type=int, default=2, help="Gunicorn workers")
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent clients")
+    parser.add_argument('--duration', type=float, default=15, help="Seconds of load per run")
+    parser.add_argument('--image-size', default="1280x960", help="Upload size as WIDTHxHEIGHT")
+    parser.add_argument('--compare', action='store_true', help="Also run with GUNICORN_SHARED_MODEL=false")
+    parser.add_argument('--output', default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if not hasattr(os, "sched_getaffinity") or memory_usage() is None:
+        print("❌ Per-process memory is read from /proc; this benchmark needs Linux")
+        sys.exit(1)
+
+    width, height = (int(value) for value in args.image_size.lower().split('x'))
+    image = make_jpeg(width, height)
+    results = []
+    for shared_model in ([True, False] if args.compare else [True]):
+        result = benchmark(args.workers, args.clients, args.duration, shared_model, image)
+        print_report(result)
+        results.append(result)
+
+    if args.compare:
+        saved = results[1]["total_pss_mb"] - results[0]["total_pss_mb"]
+        print(f"\nPreloading the shared model saves {saved:.1f} MB of PSS across {args.workers} workers")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
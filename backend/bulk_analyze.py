@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Offline bulk analysis of image directories.
+
+Walks a directory tree, decodes and preprocesses images in a process pool,
+runs batched ONNX inference in this process and writes one result per image
+to JSONL, CSV or Parquet. Uses the same decode_image preprocessing and
+disease catalog mapping as the API, so offline and online results match.
+
+Already-scored files (same relative path, size, mtime and model version) are
+skipped, so an interrupted run can simply be started again. Files that failed
+are skipped too unless --retry-errors is given; the retry's row is appended
+after the failed one, so the last row for a path is the current one.
+
+Parquet output is a directory of part files: each run streams its rows into
+one new part through a ParquetWriter, and the part is renamed into place
+when the run ends (also on Ctrl-C). A part left unfinished by a crash is
+removed on the next run and its files are scored again.
+
+Usage:
+    python bulk_analyze.py uploads --output scores.jsonl [--skip-llm] [--workers 4] [--batch-size 16]
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from preprocessing import decode_image
+from inference_scheduler import InferenceScheduler
+from skin_detection_model import load_model, get_model_version, result_from_prediction
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+LIST_FIELDS = ('symptoms', 'causes', 'treatments')
+CSV_FIELDS = ['path', 'size', 'mtime_ns', 'digest', 'model_version', 'disease', 'probability',
+              'overview', 'symptoms', 'causes', 'treatments', 'detailed_analysis', 'error']
+
+
+def parquet_schema():
+    """Fixed column types, so parts whose first rows are all errors still match the others"""
+    import pyarrow as pa
+    types = {'size': pa.int64(), 'mtime_ns': pa.int64(), 'probability': pa.float64()}
+    types.update({field: pa.list_(pa.string()) for field in LIST_FIELDS})
+    return pa.schema([(field, types.get(field, pa.string())) for field in CSV_FIELDS])
+
+
+def find_images(root, all_files=False):
+    """Image files under root, in a stable order. Extension-less files (like backend/uploads) are included."""
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            extension = os.path.splitext(filename)[1].lower()
+            if all_files or extension in IMAGE_EXTENSIONS or extension == '':
+                yield os.path.join(directory, filename)
+
+
+def load_and_preprocess(path):
+    """Process-pool worker: read, hash and decode one file"""
+    try:
+        with open(path, 'rb') as file:
+            image_bytes = file.read()
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return path, digest, decode_image(image_bytes), None
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}"
+
+
+class ResultWriter:
+    """Appends result rows to the output file and knows which files were already scored"""
+
+    def __init__(self, path, output_format):
+        self.path = path
+        self.format = output_format
+        self._parquet = None  # this run's ParquetWriter
+        self._part_path = None
+        if output_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                print("❌ Parquet output needs pyarrow: pip install pyarrow")
+                sys.exit(1)
+
+    def load_existing(self):
+        if not os.path.exists(self.path):
+            return []
+        if self.format == 'jsonl':
+            with open(self.path, 'r') as file:
+                rows = [json.loads(line) for line in file if line.strip()]
+        elif self.format == 'csv':
+            with open(self.path, 'r', newline='') as file:
+                rows = list(csv.DictReader(file))
+        else:
+            rows = self._load_parquet_parts()
+        return rows
+
+    def _load_parquet_parts(self):
+        import pyarrow.parquet as pq
+        if os.path.isfile(self.path):
+            # Output of an earlier version: a single file, which becomes the first part
+            legacy_path = self.path + '.legacy'
+            os.replace(self.path, legacy_path)
+            os.makedirs(self.path)
+            os.replace(legacy_path, os.path.join(self.path, 'part-0.parquet'))
+        rows = []
+        for name in sorted(os.listdir(self.path)):
+            part_path = os.path.join(self.path, name)
+            if name.endswith('.tmp'):
+                # Left by a run that crashed before writing the footer; unreadable
+                os.remove(part_path)
+            elif name.endswith('.parquet'):
+                rows.extend(pq.read_table(part_path).to_pylist())
+        return rows
+
+    def write(self, rows):
+        if self.format == 'jsonl':
+            with open(self.path, 'a') as file:
+                for row in rows:
+                    file.write(json.dumps(row) + "\n")
+        elif self.format == 'csv':
+            is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, 'a', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+                if is_new:
+                    writer.writeheader()
+                for row in rows:
+                    flat = dict(row)
+                    for field in LIST_FIELDS:
+                        if isinstance(flat.get(field), list):
+                            flat[field] = '; '.join(flat[field])
+                    if flat.get('detailed_analysis') is not None:
+                        flat['detailed_analysis'] = json.dumps(flat['detailed_analysis'])
+                    writer.writerow(flat)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._parquet is None:
+                os.makedirs(self.path, exist_ok=True)
+                self._part_path = os.path.join(self.path, f"part-{time.time_ns()}.parquet")
+                self._parquet = pq.ParquetWriter(self._part_path + '.tmp', parquet_schema())
+            # Only this chunk is converted and written; earlier row groups stay on disk
+            table = pa.Table.from_pylist([
+                {**row, 'detailed_analysis': json.dumps(row['detailed_analysis']) if row.get('detailed_analysis') else None}
+                for row in rows
+            ], schema=parquet_schema())
+            self._parquet.write_table(table)
+
+    def close(self):
+        """Finish this run's Parquet part; other formats are complete after every write()"""
+        if self._parquet is not None:
+            self._parquet.close()
+            os.replace(self._part_path + '.tmp', self._part_path)
+            self._parquet = None
+
+
+def checkpoint_key(relative_path, size, mtime_ns, model_version):
+    # CSV rows come back as strings, so the key is built from str() values
+    return f"{relative_path}|{size}|{mtime_ns}|{model_version}"
+
+
+def enrich(rows, llm_concurrency):
+    """Add OpenAI detailed analyses (served from the analysis cache where possible)"""
+    from openai_service import openai_service
+
+    def analyse(row):
+        basic_advice = ', '.join(row['treatments'])
+        row['detailed_analysis'] = openai_service.generate_detailed_analysis(row['disease'], row['probability'], basic_advice)
+
+    with ThreadPoolExecutor(max_workers=max(1, llm_concurrency)) as pool:
+        list(pool.map(analyse, [row for row in rows if row.get('error') is None]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score every image under a directory with the local ONNX model")
+    parser.add_argument('root', help="Directory to scan recursively")
+    parser.add_argument('--output', default='bulk_results.jsonl', help="Output file (.jsonl, .csv or .parquet)")
+    parser.add_argument('--format', choices=['jsonl', 'csv', 'parquet'], help="Output format (default: from extension)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Decode/preprocess processes")
+    parser.add_argument('--batch-size', type=int, default=16, help="Images per ONNX run")
+    parser.add_argument('--skip-llm', action='store_true', help="Only run detection, no OpenAI analysis")
+    parser.add_argument('--llm-concurrency', type=int, default=4, help="Parallel OpenAI requests")
+    parser.add_argument('--all-files', action='store_true', help="Try every file, not just images and extension-less files")
+    parser.add_argument('--no-resume', action='store_true', help="Score everything even if already in the output")
+    parser.add_argument('--retry-errors', action='store_true', help="Score files again that failed in an earlier run")
+    args = parser.parse_args()
+
+    output_format = args.format or {'.csv': 'csv', '.parquet': 'parquet'}.get(os.path.splitext(args.output)[1].lower(), 'jsonl')
+    writer = ResultWriter(args.output, output_format)
+
+    session = load_model()
+    if session is None:
+        print("❌ The local ONNX model is required for bulk analysis")
+        sys.exit(1)
+    model_version = get_model_version()
+    scheduler = InferenceScheduler(session, max_batch_size=args.batch_size, max_wait_ms=5)
+
+    done = set()
+    failed = set()
+    if not args.no_resume:
+        for row in writer.load_existing():
+            key = checkpoint_key(row['path'], row['size'], row['mtime_ns'], row['model_version'])
+            # A later successful row for the same file wins over an earlier error
+            if row.get('error'):
+                if key not in done:
+                    failed.add(key)
+            else:
+                done.add(key)
+                failed.discard(key)
+        if not args.retry_errors:
+            done |= failed
+
+    # Skip already-scored files without reading them
+    pending = []
+    skipped = skipped_errors = 0
+    for path in find_images(args.root, args.all_files):
+        stat = os.stat(path)
+        relative_path = os.path.relpath(path, args.root)
+        key = checkpoint_key(relative_path, stat.st_size, stat.st_mtime_ns, model_version)
+        if key in done:
+            skipped += 1
+            skipped_errors += key in failed
+            continue
+        pending.append((path, relative_path, stat.st_size, stat.st_mtime_ns))
+
+    print(f"🔍 {len(pending)} images to score with {model_version} ({skipped} already scored"
+          + (f", including {skipped_errors} that failed; --retry-errors scores them again)" if skipped_errors else ")"))
+    if not pending:
+        return
+
+    started = time.perf_counter()
+    scored = errors = 0
+    file_info = {path: (relative_path, size, mtime_ns) for path, relative_path, size, mtime_ns in pending}
+
+    # The Parquet part is finished even when the run is interrupted
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            # Bounded window of decode jobs so decoded arrays never pile up in memory
+            window = max(args.batch_size, args.workers) * 2
+            paths = iter([path for path, _, _, _ in pending])
+            in_flight = deque()
+            for path in paths:
+                in_flight.append(pool.submit(load_and_preprocess, path))
+                if len(in_flight) >= window:
+                    break
+
+            while in_flight:
+                chunk = []
+                while in_flight and len(chunk) < args.batch_size:
+                    chunk.append(in_flight.popleft().result())
+                    next_path = next(paths, None)
+                    if next_path is not None:
+                        in_flight.append(pool.submit(load_and_preprocess, next_path))
+
+                # Submitting the whole chunk at once lets the scheduler run it as one batch
+                futures = [scheduler.submit(array) if array is not None else None for _, _, array, _ in chunk]
+                rows = []
+                for (path, digest, _, error), future in zip(chunk, futures):
+                    relative_path, size, mtime_ns = file_info[path]
+                    row = {'path': relative_path, 'size': size, 'mtime_ns': mtime_ns, 'digest': digest,
+                           'model_version': model_version}
+                    if future is None:
+                        row['error'] = error
+                        errors += 1
+                    else:
+                        result = result_from_prediction(future.result())
+                        result.pop('time', None)
+                        row.update(result)
+                        scored += 1
+                    rows.append(row)
+
+                if not args.skip_llm:
+                    enrich(rows, args.llm_concurrency)
+                writer.write(rows)
+
+                elapsed = time.perf_counter() - started
+                print(f"  {scored + errors}/{len(pending)} processed, {(scored + errors) / elapsed:.1f} images/sec")
+    finally:
+        writer.close()
+
+    scheduler.close()
+    elapsed = time.perf_counter() - started
+    print(f"✅ Scored {scored} images in {elapsed:.1f}s ({scored / elapsed:.1f} images/sec), "
+          f"{errors} failed, results in {args.output}")
+    stats = scheduler.get_stats()
+    print(f"   Average ONNX batch size {stats['avg_batch_size']:.1f}, average run {stats['avg_run_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+In-memory disease catalog built from skindisease.json.
+
+The file is parsed once and indexed by model class index and by name, with
+the per-disease response fragments (overview, symptoms, causes, treatments)
+built up front, so lookups on the request path do no file I/O or JSON
+parsing. An optional watcher thread reloads the catalog when the file's
+modification time changes.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from structured_logging import get_logger
+
+logger = get_logger("disease_catalog")
+
+CATALOG_PATH = os.path.join(os.path.dirname(__file__), 'skindisease.json')
+
+
+class _Snapshot:
+    """Immutable view of one version of the catalog; swapped atomically on reload"""
+
+    def __init__(self, skin_diseases: List[Dict[str, Any]], mtime: float):
+        self.mtime = mtime
+        self.names = [disease['name'] for disease in skin_diseases]
+        self.fragments = [
+            {
+                "disease": disease['name'],
+                "overview": disease['overview'],
+                "symptoms": disease['symptoms'],
+                "causes": disease['causes'],
+                "treatments": disease['treatments'],
+            }
+            for disease in skin_diseases
+        ]
+        self.basic_advice = [', '.join(disease['treatments']) for disease in skin_diseases]
+        self.index_by_name = {name.strip().lower(): index for index, name in enumerate(self.names)}
+
+
+class DiseaseCatalog:
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self._snapshot = self._read()
+        self._reload_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.reloads = 0
+
+    def _read(self) -> _Snapshot:
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, 'r') as file:
+            skin_diseases = json.load(file)['skin_diseases']
+        return _Snapshot(skin_diseases, mtime)
+
+    def __len__(self) -> int:
+        return len(self._snapshot.names)
+
+    def names(self) -> List[str]:
+        return list(self._snapshot.names)
+
+    def get_by_index(self, index: int) -> Dict[str, Any]:
+        """Response fragment for a model class index (a fresh dict the caller may extend)"""
+        return dict(self._snapshot.fragments[int(index)])
+
+    def index_of(self, name: str) -> Optional[int]:
+        return self._snapshot.index_by_name.get(name.strip().lower())
+
+    def get_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        index = self.index_of(name)
+        return None if index is None else self.get_by_index(index)
+
+    def basic_advice(self, index: int) -> str:
+        """Treatments joined the way the OpenAI prompt expects them"""
+        return self._snapshot.basic_advice[int(index)]
+
+    def check_for_changes(self) -> bool:
+        """Reload if the file's mtime changed; returns True when a new catalog was loaded"""
+        with self._reload_lock:
+            try:
+                if os.path.getmtime(self.path) == self._snapshot.mtime:
+                    return False
+                snapshot = self._read()
+            except (OSError, ValueError, KeyError) as e:
+                # Keep serving the previous catalog while the file is missing or being edited
+                logger.warning(f"Failed to reload disease catalog: {type(e).__name__}: {e}")
+                return False
+            self._snapshot = snapshot
+            self.reloads += 1
+        logger.info(f"Disease catalog reloaded ({len(snapshot.names)} diseases)")
+        return True
+
+    def start_watching(self, interval: float = 2.0):
+        """Poll the file's mtime from a background thread"""
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._stop.clear()
+
+        def watch():
+            while not self._stop.wait(interval):
+                self.check_for_changes()
+
+        self._watcher = threading.Thread(target=watch, name="disease-catalog-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+
+# Global instance
+disease_catalog = DiseaseCatalog()
@@ -0,0 +1,115 @@
+"""
+Gunicorn settings for production: several uvicorn workers sharing one model copy.
+
+    gunicorn -c gunicorn_conf.py main:app
+
+The app is imported and the model read into memory (in ORT format) by the
+master before the workers are forked, so every worker's session uses the same
+physical pages for the weights instead of loading its own copy. The available
+cores are split between workers and onnxruntime threads, and each worker is
+pinned to its own cores:
+
+    WEB_CONCURRENCY        workers (default: half the cores, at least 1)
+    ORT_INTRA_OP_THREADS   threads per inference (default: cores / workers)
+    GUNICORN_PIN_WORKERS   pin each worker to its cores (default true)
+    GUNICORN_SHARED_MODEL  preload the model before forking (default true)
+    MODEL_ROLLOUT_DB       /models state shared by the workers (default: a
+                           temporary file for this server when there are several)
+    ANALYSIS_JOB_DB        background analysis jobs, readable by every worker
+                           (the same default)
+"""
+
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(cpu_count: int, workers: int = 0, intra_op_threads: int = 0):
+    """(workers, ORT intra-op threads per worker); 0 picks a default that fills the cores once"""
+    workers = workers or max(1, cpu_count // 2)
+    intra_op_threads = intra_op_threads or max(1, cpu_count // workers)
+    return workers, intra_op_threads
+
+
+def worker_cpus(cpus, slot: int, per_worker: int):
+    """The cores for the worker in a given slot; wraps around when workers outnumber cores"""
+    per_worker = min(per_worker, len(cpus))
+    start = slot * per_worker
+    return [cpus[(start + offset) % len(cpus)] for offset in range(per_worker)]
+
+
+_cpus = available_cpus()
+workers, intra_op_threads = plan_workers(
+    len(_cpus), int(os.getenv("WEB_CONCURRENCY", "0")), int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+)
+pin_workers = os.getenv("GUNICORN_PIN_WORKERS", "true").lower() == "true" and hasattr(os, "sched_setaffinity")
+shared_model = os.getenv("GUNICORN_SHARED_MODEL", "true").lower() == "true"
+# Databases created for this server in on_starting, removed in on_exit
+temporary_dbs = []
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '3000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+
+def on_starting(server):
+    # Read by each worker when it creates its session and pools
+    os.environ["ORT_INTRA_OP_THREADS"] = str(intra_op_threads)
+    os.environ.setdefault("ORT_INTER_OP_THREADS", "1")
+    os.environ.setdefault("DECODE_POOL_SIZE", str(intra_op_threads))
+    # Read by each worker at startup, so /models changes and job results reach all of them
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    for name, variable in (("models", "MODEL_ROLLOUT_DB"), ("jobs", "ANALYSIS_JOB_DB")):
+        if workers > 1 and not os.getenv(variable):
+            path = os.path.join(tempfile.gettempdir(), f"dermadetector-{name}-{os.getpid()}.db")
+            os.environ[variable] = path
+            temporary_dbs.append(path)
+
+    if shared_model:
+        import skin_detection_model
+        size = skin_detection_model.preload_shared_model()
+        if size:
+            server.log.info("Preloaded shared model (%.1f MB) before forking", size / 1e6)
+
+    # The log writer thread would not survive the fork; each worker starts its own
+    import structured_logging
+    structured_logging.shutdown_logging()
+    server.log.info("Starting %d workers with %d ORT intra-op threads each", workers, intra_op_threads)
+
+
+def pre_fork(server, worker):
+    # Lowest slot not used by a live worker, so a restarted worker takes over its predecessor's cores
+    used = {getattr(other, "cpu_slot", None) for other in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in range(len(used) + 1) if slot not in used)
+
+
+def post_fork(server, worker):
+    if pin_workers:
+        cpus = worker_cpus(_cpus, worker.cpu_slot, intra_op_threads)
+        os.sched_setaffinity(0, cpus)
+        server.log.info("Worker %s pinned to CPUs %s", worker.pid, cpus)
+
+    import structured_logging
+    structured_logging.setup_logging()
+
+
+def on_exit(server):
+    # The default shared state only lives as long as this server
+    for path in temporary_dbs:
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.unlink(path + suffix)
+            except FileNotFoundError:
+                pass
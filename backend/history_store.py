@@ -0,0 +1,296 @@
+"""
+Persistent history of analyses in a local SQLite database.
+
+Request handlers only put a snapshot of the finished result (a plain dict)
+on an in-memory queue, a few microseconds; a writer thread collects up to
+`batch_size` entries, or whatever arrived within `flush_interval_ms`, and
+inserts them in one transaction. Serializing the result to JSON also
+happens on that thread.
+When the queue is full, entries are dropped and counted instead of making
+the request wait, like the log queue.
+
+The database runs in WAL mode, so queries read while the writer writes,
+and several server processes can share one file (busy writers wait up to
+`busy_timeout_ms`). Queries page newest first by row id (keyset
+pagination), and every filter has an index ending in the id, so a page
+costs the same however deep it is.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("history_store")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    patient_id TEXT,
+    image_digest TEXT,
+    condition TEXT NOT NULL,
+    probability REAL NOT NULL,
+    model_version TEXT,
+    endpoint TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+DROP INDEX IF EXISTS analyses_created_at;
+CREATE INDEX IF NOT EXISTS analyses_created_at_id ON analyses (created_at, id);
+CREATE INDEX IF NOT EXISTS analyses_patient ON analyses (patient_id, id);
+CREATE INDEX IF NOT EXISTS analyses_digest ON analyses (image_digest, id);
+CREATE INDEX IF NOT EXISTS analyses_condition ON analyses (condition, id);
+CREATE INDEX IF NOT EXISTS analyses_model_version ON analyses (model_version, id);
+"""
+
+INSERT = ("INSERT INTO analyses (created_at, patient_id, image_digest, condition, probability, model_version, endpoint, result) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+# Columns that can be filtered on with an exact match
+FILTERS = ("patient_id", "image_digest", "condition", "model_version")
+
+_STOP = object()
+
+
+class HistoryStore:
+    def __init__(self, path: Optional[str] = None, batch_size: int = 256, flush_interval_ms: float = 100.0,
+                 max_queue: int = 10000, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000.0
+        self.busy_timeout_ms = max(0, busy_timeout_ms)
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, max_queue))
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._readers = threading.local()
+        # Every reader connection, so close() can close those of other threads too
+        self._all_readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._reader_generation = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000.0, check_same_thread=False)
+        connection.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+        return connection
+
+    def start(self):
+        """Create the schema and start the writer thread; a no-op when disabled or already running"""
+        if not self.enabled:
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            connection = self._connect()
+            # WAL is a property of the database file, kept across connections and restarts
+            connection.execute("PRAGMA journal_mode = WAL")
+            # Durable across process crashes; only a power loss can drop the last transactions
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self._thread = threading.Thread(target=self._run, args=(connection,), name="history-writer", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: float = 5.0):
+        """Write what is queued and stop the writer thread"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+        with self._readers_lock:
+            readers, self._all_readers = self._all_readers, []
+            # Threads still holding a closed connection open a new one on their next query
+            self._reader_generation += 1
+        for reader in readers:
+            reader.close()
+
+    def record(self, api_output: Any, endpoint: str, patient_id: Optional[str] = None):
+        """Queue an analysis result (an APIOutput) for writing, as it is now; never blocks"""
+        if not self.enabled:
+            return
+        # A snapshot, so later changes to the caller's object do not reach the row
+        snapshot = api_output.model_dump(exclude={'timings'})
+        try:
+            self._queue.put_nowait((time.time(), patient_id, endpoint, snapshot))
+        except queue.Full:
+            self.dropped += 1
+            metrics.history_writes_total.inc(outcome="dropped")
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued before this call is written; False on timeout"""
+        if self._thread is None:
+            return False
+        written = threading.Event()
+        self._queue.put(written)
+        return written.wait(timeout)
+
+    def _run(self, connection: sqlite3.Connection):
+        try:
+            while True:
+                batch, markers, stop = self._next_batch()
+                if batch:
+                    self._write(connection, batch)
+                for marker in markers:
+                    marker.set()
+                if stop:
+                    return
+        finally:
+            connection.close()
+
+    def _next_batch(self) -> Tuple[List[Any], List[threading.Event], bool]:
+        """Entries that arrive within the flush interval of the first one, up to batch_size"""
+        batch, markers = [], []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is _STOP:
+                return batch, markers, True
+            if isinstance(item, threading.Event):
+                # A flush() marker: write what came before it right away
+                markers.append(item)
+                return batch, markers, False
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, markers, False
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return batch, markers, False
+
+    def _write(self, connection: sqlite3.Connection, batch: List[Any]):
+        started = time.perf_counter()
+        try:
+            rows = [
+                (created_at, patient_id, output["image_digest"], output["disease"], output["probability"],
+                 output["model_version"], endpoint, json.dumps(output, separators=(',', ':')))
+                for created_at, patient_id, endpoint, output in batch
+            ]
+            with connection:
+                connection.executemany(INSERT, rows)
+        except (sqlite3.Error, ValueError, TypeError, KeyError) as e:
+            self.failed += len(batch)
+            metrics.history_writes_total.inc(len(batch), outcome="failed")
+            logger.warning(f"Writing {len(batch)} history entries failed: {type(e).__name__}: {e}")
+            return
+        self.written += len(batch)
+        self.batches += 1
+        self.write_seconds += time.perf_counter() - started
+        metrics.history_writes_total.inc(len(batch), outcome="written")
+
+    def _reader(self) -> sqlite3.Connection:
+        """One read connection per thread; WAL readers never wait for the writer"""
+        connection = getattr(self._readers, "connection", None)
+        if connection is None or self._readers.generation != self._reader_generation:
+            connection = self._connect()
+            connection.execute("PRAGMA query_only = ON")
+            connection.row_factory = sqlite3.Row
+            with self._readers_lock:
+                self._all_readers.append(connection)
+                self._readers.generation = self._reader_generation
+            self._readers.connection = connection
+        return connection
+
+    @staticmethod
+    def _where(filters: Dict[str, Any], since: Optional[float], until: Optional[float]) -> Tuple[List[str], List[Any]]:
+        clauses, params = [], []
+        for column in FILTERS:
+            if filters.get(column) is not None:
+                clauses.append(f"{column} = ?")
+                params.append(filters[column])
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        return clauses, params
+
+    def query(self, limit: int = 50, cursor: Optional[int] = None, since: Optional[float] = None,
+              until: Optional[float] = None, include_result: bool = True,
+              **filters: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        A page of analyses, newest first, and the cursor for the next page (None on the last one).
+        filters are exact matches on patient_id, image_digest, condition and model_version.
+        """
+        clauses, params = self._where(filters, since, until)
+        if cursor is not None:
+            clauses.append("id < ?")
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        columns = "id, created_at, patient_id, image_digest, condition, probability, model_version, endpoint"
+        if include_result:
+            columns += ", result"
+        rows = self._reader().execute(
+            f"SELECT {columns} FROM analyses {where} ORDER BY id DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+
+        items = []
+        for row in rows[:limit]:
+            item = dict(row)
+            if include_result:
+                item["result"] = json.loads(item["result"])
+            items.append(item)
+        next_cursor = items[-1]["id"] if len(rows) > limit else None
+        return items, next_cursor
+
+    def summary(self, since: Optional[float] = None, until: Optional[float] = None,
+                **filters: Optional[str]) -> Dict[str, Any]:
+        """Analysis counts and mean confidence per condition and per model version"""
+        clauses, params = self._where(filters, since, until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        reader = self._reader()
+
+        def grouped(column):
+            return {
+                row[0]: {"count": row[1], "mean_probability": row[2]}
+                for row in reader.execute(
+                    f"SELECT {column}, COUNT(*), AVG(probability) FROM analyses {where} GROUP BY {column} ORDER BY 2 DESC",
+                    params
+                )
+            }
+
+        by_condition = grouped("condition")
+        return {
+            "total": sum(entry["count"] for entry in by_condition.values()),
+            "by_condition": by_condition,
+            "by_model_version": grouped("model_version"),
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_batch_size": self.written / self.batches if self.batches else 0.0,
+            "avg_write_ms": self.write_seconds * 1000 / self.batches if self.batches else 0.0,
+        }
+
+
+history_store = HistoryStore(
+    path=os.getenv('HISTORY_DB_PATH') or None,
+    batch_size=int(os.getenv('HISTORY_BATCH_SIZE', '256')),
+    flush_interval_ms=float(os.getenv('HISTORY_FLUSH_INTERVAL_MS', '100')),
+    max_queue=int(os.getenv('HISTORY_QUEUE_SIZE', '10000')),
+)
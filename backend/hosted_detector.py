@@ -0,0 +1,220 @@
+"""
+Client for the hosted detection API, used when the local model is missing.
+
+The original upload bytes are forwarded as-is over a pooled keep-alive
+session. A circuit breaker stops calling the remote once it keeps failing:
+while open, detect() fails immediately and a background probe polls the
+health URL; the first healthy probe lets one trial request through
+(half-open), and a successful trial closes the circuit again.
+
+Configuration (environment):
+    HOSTED_API_URL                - detection endpoint
+    HOSTED_API_HEALTH_URL         - probed while the circuit is open (default: the API's root URL)
+    HOSTED_API_CONNECT_TIMEOUT    - seconds (default 3)
+    HOSTED_API_READ_TIMEOUT       - seconds (default 30)
+    HOSTED_API_POOL_SIZE          - keep-alive connections (default 10)
+    HOSTED_API_FAILURE_THRESHOLD  - consecutive failures that open the circuit (default 3)
+    HOSTED_API_PROBE_INTERVAL     - seconds between health probes while open (default 10)
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from structured_logging import get_logger
+
+logger = get_logger("hosted_detector")
+
+DEFAULT_HOSTED_API_URL = 'https://skindiseasesdetect-2.onrender.com/detect'
+
+
+class HostedAPIUnavailable(Exception):
+    """Raised without contacting the remote while the circuit is open"""
+
+
+class HostedAPIRejected(Exception):
+    """The remote answered but did not accept the image (4xx)"""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3):
+        self.failure_threshold = max(1, failure_threshold)
+        self.state = self.CLOSED
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._trial_in_flight = False
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow_request(self) -> bool:
+        """Whether a call may go to the remote now; half-open admits a single trial call"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Hosted API recovered, closing circuit")
+            self.state = self.CLOSED
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+            self.opened_at = None
+
+    def record_failure(self) -> bool:
+        """Count a failed call; returns True when this failure opened the circuit"""
+        with self._lock:
+            self._consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self._consecutive_failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                return True
+            return False
+
+    def half_open(self):
+        """Called by the health probe: let the next request try the remote again"""
+        with self._lock:
+            if self.state == self.OPEN:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "open_seconds": time.monotonic() - self.opened_at if self.opened_at is not None else 0.0,
+            }
+
+
+def _default_health_url(url: str) -> str:
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, '/', '', ''))
+
+
+def _content_type(image_bytes: bytes):
+    if image_bytes[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image.png', 'image/png'
+    return 'image.jpg', 'image/jpeg'
+
+
+class HostedDetector:
+    def __init__(self):
+        self.url = os.getenv('HOSTED_API_URL', DEFAULT_HOSTED_API_URL)
+        self.health_url = os.getenv('HOSTED_API_HEALTH_URL') or _default_health_url(self.url)
+        self.connect_timeout = float(os.getenv('HOSTED_API_CONNECT_TIMEOUT', '3'))
+        self.read_timeout = float(os.getenv('HOSTED_API_READ_TIMEOUT', '30'))
+        self.pool_size = int(os.getenv('HOSTED_API_POOL_SIZE', '10'))
+        self.probe_interval = float(os.getenv('HOSTED_API_PROBE_INTERVAL', '10'))
+        self.breaker = CircuitBreaker(int(os.getenv('HOSTED_API_FAILURE_THRESHOLD', '3')))
+
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._probe_stop = threading.Event()
+        self.requests = 0
+        self.failures = 0
+
+    def _get_session(self) -> requests.Session:
+        """Persistent keep-alive session shared by all fallback requests"""
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def detect(self, image_bytes: bytes) -> Dict[str, Any]:
+        """
+        Send the original upload bytes to the hosted API and return its result.
+        Raises HostedAPIUnavailable straight away while the circuit is open.
+        """
+        if not self.breaker.allow_request():
+            raise HostedAPIUnavailable("Hosted API circuit is open")
+
+        filename, content_type = _content_type(image_bytes)
+        self.requests += 1
+        try:
+            response = self._get_session().post(
+                self.url,
+                files={'im': (filename, image_bytes, content_type)},
+                timeout=(self.connect_timeout, self.read_timeout)
+            )
+            if response.status_code >= 500:
+                raise Exception(f"API request failed with status {response.status_code}")
+            result = response.json() if response.status_code == 200 else None
+        except Exception as e:
+            self.failures += 1
+            if self.breaker.record_failure():
+                logger.warning(f"Hosted API failing ({e}); opening circuit")
+                self._start_probe()
+            raise
+        # Client errors mean the remote is up but rejected this image
+        self.breaker.record_success()
+        if result is None:
+            raise HostedAPIRejected(f"API request failed with status {response.status_code}")
+        return result
+
+    def _start_probe(self):
+        with self._session_lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return
+            self._probe_stop.clear()
+            self._probe_thread = threading.Thread(target=self._probe_loop, name="hosted-api-probe", daemon=True)
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        """Poll the health URL while the circuit is open"""
+        while not self._probe_stop.wait(self.probe_interval):
+            if self.breaker.state != CircuitBreaker.OPEN:
+                return
+            try:
+                response = self._get_session().get(self.health_url, timeout=(self.connect_timeout, self.connect_timeout))
+                healthy = response.status_code < 500
+            except Exception:
+                healthy = False
+            if healthy:
+                logger.info("Hosted API health probe succeeded; allowing a trial request")
+                self.breaker.half_open()
+                return
+
+    def close(self):
+        self._probe_stop.set()
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "requests": self.requests,
+            "failures": self.failures,
+            "circuit": self.breaker.get_stats(),
+        }
+
+
+hosted_detector = HostedDetector()
@@ -0,0 +1,170 @@
+"""
+Micro-batching scheduler for ONNX inference.
+
+Concurrent callers submit single preprocessed images; a background thread
+gathers them into one (N, 256, 256, 3) tensor, runs the session once and
+splits the predictions back to each caller.
+
+The batch tensor and the output array are allocated once and reused across
+runs: images are cast to float32 while being copied into the input buffer,
+and when the session supports IO binding the model writes its predictions
+straight into the output buffer.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_INPUT_SHAPE = (256, 256, 3)
+
+
+class InferenceScheduler:
+    def __init__(self, session, input_name: str = "input_1", output_name: str = "dense",
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0):
+        self.session = session
+        self.input_name = input_name
+        self.output_name = output_name
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        # Models exported with a fixed batch dimension cannot take more than that
+        input_shape = session.get_inputs()[0].shape
+        batch_dim = input_shape[0] if input_shape else None
+        if isinstance(batch_dim, int) and batch_dim > 0:
+            max_batch_size = min(max_batch_size, batch_dim)
+        self.max_batch_size = max(1, max_batch_size)
+
+        if len(input_shape) == 4 and all(isinstance(dim, int) for dim in input_shape[1:]):
+            self.input_shape = tuple(input_shape[1:])
+        else:
+            self.input_shape = DEFAULT_INPUT_SHAPE
+
+        # Reused across runs; only the scheduler thread touches them
+        self._input_buffer = np.empty((self.max_batch_size,) + self.input_shape, dtype=np.float32)
+        self._output_buffer = None
+        self._use_io_binding = False
+        outputs = session.get_outputs() if hasattr(session, 'get_outputs') else []
+        output_shape = outputs[0].shape if outputs else None
+        if hasattr(session, 'io_binding') and output_shape and len(output_shape) == 2 and isinstance(output_shape[1], int):
+            self._output_buffer = np.empty((self.max_batch_size, output_shape[1]), dtype=np.float32)
+            self._use_io_binding = True
+
+        self._queue: "queue.Queue[Optional[Tuple[np.ndarray, Future, float]]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes: Dict[int, int] = {}
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._run_time_total = 0.0
+
+        self._thread = threading.Thread(target=self._worker, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, image: np.ndarray) -> Future:
+        """Queue one preprocessed image and return a future for its prediction row"""
+        if image.shape != self.input_shape:
+            raise ValueError(f"Expected image of shape {self.input_shape}, got {image.shape}")
+        future: Future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def infer(self, image: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        """Blocking helper: submit one image and wait for its prediction row"""
+        return self.submit(image).result(timeout=timeout)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self):
+        """Stop the worker thread once the queued requests have been served"""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Batch-size and queue-wait metrics for the scheduler"""
+        with self._stats_lock:
+            batches = self._batches
+            items = self._items
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": batches,
+                "items": items,
+                "queue_depth": self._queue.qsize(),
+                "avg_batch_size": items / batches if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_wait_ms": self._queue_wait_total * 1000.0 / items if items else 0.0,
+                "max_queue_wait_ms": self._queue_wait_max * 1000.0,
+                "avg_run_ms": self._run_time_total * 1000.0 / batches if batches else 0.0,
+            }
+
+    def _collect_batch(self) -> Optional[List[Tuple[np.ndarray, Future, float]]]:
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Serve what we have, then let the worker see the sentinel again
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run_batch(self, images: List[np.ndarray]) -> np.ndarray:
+        size = len(images)
+        inputs = self._input_buffer[:size]
+        for index, image in enumerate(images):
+            np.copyto(inputs[index], image, casting='unsafe')
+
+        if self._use_io_binding:
+            outputs = self._output_buffer[:size]
+            binding = self.session.io_binding()
+            binding.bind_cpu_input(self.input_name, inputs)
+            binding.bind_output(self.output_name, 'cpu', 0, np.float32, list(outputs.shape), outputs.ctypes.data)
+            self.session.run_with_iobinding(binding)
+            return outputs
+
+        return self.session.run([self.output_name], {self.input_name: inputs})[0]
+
+    def _worker(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            futures = [future for _, future, _ in batch]
+            try:
+                outputs = self._run_batch([image for image, _, _ in batch])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            run_time = time.perf_counter() - started
+
+            # Rows are copied out because the output buffer is reused by the next run
+            for index, future in enumerate(futures):
+                future.set_result(outputs[index].copy())
+
+            with self._stats_lock:
+                size = len(batch)
+                self._batches += 1
+                self._items += size
+                self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+                self._run_time_total += run_time
+                for _, _, enqueued in batch:
+                    wait = started - enqueued
+                    self._queue_wait_total += wait
+                    self._queue_wait_max = max(self._queue_wait_max, wait)
@@ -0,0 +1,312 @@
+"""
+Local store and worker pool for background analysis jobs.
+
+`/analyze?async_analysis=true` returns the detection straight away and
+submits the OpenAI enrichment here. A fixed number of worker tasks drain a
+bounded queue, so LLM concurrency is sized independently of HTTP
+concurrency. Finished jobs are kept for a TTL and then expired.
+
+Jobs run in the server process that created them. With several server
+processes, every job's status and result are also written to a SQLite
+database in WAL mode (ANALYSIS_JOB_DB; gunicorn_conf.py sets one when it
+starts several workers), so a poll answered by another worker reads them
+from there. Its writes go through one thread in submission order, off the
+event loop. A job whose worker has exited is reported as failed.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from structured_logging import get_logger
+
+logger = get_logger("job_store")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    job_id TEXT PRIMARY KEY,
+    owner_pid INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS analysis_jobs_finished_at ON analysis_jobs (finished_at);
+"""
+
+
+class JobQueueFull(Exception):
+    """Raised by submit() when the pending-job queue is at capacity"""
+
+
+class AnalysisJob:
+    __slots__ = ("job_id", "payload", "status", "result", "error", "created_at", "finished_at", "done_event")
+
+    def __init__(self, job_id: str, payload: Any):
+        self.job_id = job_id
+        self.payload = payload
+        self.status = PENDING
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.done_event = asyncio.Event()
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AnalysisJobStore:
+    def __init__(self, workers: int = 8, max_pending: int = 1000, ttl_seconds: float = 600.0,
+                 path: Optional[str] = None, poll_interval: float = 0.25, busy_timeout_ms: int = 5000):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.poll_interval = max(0.01, poll_interval)
+        self.busy_timeout_ms = max(0, busy_timeout_ms)
+        self._connections = threading.local()
+        self._database_pool: Optional[ThreadPoolExecutor] = None
+        self._jobs: Dict[str, AnalysisJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._handler: Optional[Callable[[Any], Awaitable[Dict[str, Any]]]] = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.remote_reads = 0
+
+    @property
+    def shared(self) -> bool:
+        return bool(self.path)
+
+    def start(self, handler: Callable[[Any], Awaitable[Dict[str, Any]]], path: Optional[str] = None):
+        """
+        Start the worker tasks on the running event loop; handler(payload) produces the job result.
+        path defaults to ANALYSIS_JOB_DB, read here because gunicorn sets it after the app is imported.
+        """
+        self._handler = handler
+        if self.path is None:
+            self.path = path or os.getenv('ANALYSIS_JOB_DB') or None
+        if self.shared:
+            # One thread, so a job's rows are written in the order its status changed
+            self._database_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis-job-db")
+            connection = self._database()
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(SCHEMA)
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"analysis-job-{index}") for index in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._expire_periodically(), name="analysis-job-expiry"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._database_pool is not None:
+            self._database_pool.shutdown(wait=True)
+            self._database_pool = None
+
+    def _database(self) -> sqlite3.Connection:
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000.0)
+            connection.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._connections.connection = connection
+        return connection
+
+    async def _on_database(self, fn: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._database_pool, fn, *args)
+
+    def _save(self, job_id: str, status: str, result: Optional[Dict[str, Any]], error: Optional[str],
+              finished_at: Optional[float]):
+        with self._database() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO analysis_jobs (job_id, owner_pid, status, result, error, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, os.getpid(), status, json.dumps(result) if result is not None else None, error, finished_at)
+            )
+
+    async def _publish(self, job: AnalysisJob):
+        """Write the job's current state for the other server processes"""
+        if self._database_pool is None:
+            return
+        finished_at = time.time() if job.finished_at is not None else None
+        try:
+            await self._on_database(self._save, job.job_id, job.status, job.result, job.error, finished_at)
+        except sqlite3.Error as e:
+            # The creating process still answers its own polls
+            logger.warning(f"Could not share analysis job {job.job_id}: {type(e).__name__}: {e}")
+
+    def _load(self, job_id: str) -> Optional[AnalysisJob]:
+        row = self._database().execute(
+            "SELECT owner_pid, status, result, error, finished_at FROM analysis_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        owner_pid, status, result, error, finished_at = row
+        if finished_at is not None and time.time() - finished_at > self.ttl_seconds:
+            return None
+        job = AnalysisJob(job_id, None)
+        job.status = status
+        job.result = json.loads(result) if result is not None else None
+        job.error = error
+        if status not in (DONE, FAILED) and not _process_alive(owner_pid):
+            job.status, job.error = FAILED, "The server process running this job has exited"
+        if job.status in (DONE, FAILED):
+            job.finished_at = time.monotonic()
+        return job
+
+    def _expire_rows(self) -> int:
+        """Delete rows past the TTL and finish the rows of jobs whose process has exited"""
+        with self._database() as connection:
+            owners = [row[0] for row in connection.execute(
+                "SELECT DISTINCT owner_pid FROM analysis_jobs WHERE finished_at IS NULL")]
+            dead = [(time.time(), pid) for pid in owners if not _process_alive(pid)]
+            connection.executemany(
+                "UPDATE analysis_jobs SET status = 'failed', error = 'The server process running this job has exited', "
+                "finished_at = ? WHERE owner_pid = ? AND finished_at IS NULL", dead)
+            return connection.execute("DELETE FROM analysis_jobs WHERE finished_at < ?",
+                                      (time.time() - self.ttl_seconds,)).rowcount
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def submit(self, payload: Any) -> str:
+        """
+        Queue a job and return its id once every server process can see it;
+        raises JobQueueFull when the queue is at capacity
+        """
+        if self._queue is None:
+            raise RuntimeError("Job store has not been started")
+        job = AnalysisJob(uuid.uuid4().hex, payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFull(f"{self.max_pending} analysis jobs already pending")
+        self._jobs[job.job_id] = job
+        self.submitted += 1
+        await self._publish(job)
+        return job.job_id
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and self._is_expired(job, time.monotonic()):
+            self._jobs.pop(job_id, None)
+            self.expired += 1
+            return None
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[AnalysisJob]:
+        """Long-poll: return the job once it has finished or the timeout has passed"""
+        job = self.get(job_id)
+        if job is None and self._database_pool is not None:
+            return await self._wait_remote(job_id, timeout)
+        if job is None or job.status in (DONE, FAILED) or timeout <= 0:
+            return job
+        try:
+            await asyncio.wait_for(job.done_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    async def _wait_remote(self, job_id: str, timeout: float) -> Optional[AnalysisJob]:
+        """A job run by another server process, polled from the shared database"""
+        deadline = time.monotonic() + timeout
+        while True:
+            self.remote_reads += 1
+            job = await self._on_database(self._load, job_id)
+            if job is None or job.status in (DONE, FAILED) or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def _is_expired(self, job: AnalysisJob, now: float) -> bool:
+        return job.finished_at is not None and now - job.finished_at > self.ttl_seconds
+
+    def expire(self) -> int:
+        """Drop finished jobs older than the TTL; returns how many were removed"""
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items() if self._is_expired(job, now)]
+        for job_id in expired:
+            del self._jobs[job_id]
+        self.expired += len(expired)
+        return len(expired)
+
+    async def _expire_periodically(self):
+        while True:
+            await asyncio.sleep(max(1.0, min(60.0, self.ttl_seconds / 2)))
+            self.expire()
+            if self._database_pool is not None:
+                try:
+                    self.expired += await self._on_database(self._expire_rows)
+                except sqlite3.Error:
+                    pass  # retried on the next round
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            await self._publish(job)
+            try:
+                job.result = await self._handler(job.payload)
+                job.status = DONE
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = FAILED
+                self.failed += 1
+            finally:
+                job.payload = None  # release image bytes and detection data early
+                job.finished_at = time.monotonic()
+                job.done_event.set()
+                self._queue.task_done()
+            await self._publish(job)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "max_pending": self.max_pending,
+            "jobs": len(self._jobs),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "shared": self.shared,
+            "remote_reads": self.remote_reads,
+        }
+
+
+analysis_jobs = AnalysisJobStore(
+    workers=int(os.getenv('ANALYSIS_JOB_WORKERS', '8')),
+    max_pending=int(os.getenv('ANALYSIS_JOB_QUEUE_SIZE', '1000')),
+    ttl_seconds=float(os.getenv('ANALYSIS_JOB_TTL_SECONDS', '600')),
+    poll_interval=float(os.getenv('ANALYSIS_JOB_POLL_SECONDS', '0.25')),
+)
@@ -0,0 +1,52 @@
+"""
+Rolling latency percentiles for an upstream dependency.
+
+Keeps the last `window` successful call durations and derives an adaptive
+timeout from a high percentile: enough headroom for normal calls, but a slow
+provider no longer gets the full static deadline on every request.
+"""
+
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200, percentile: float = 95.0, multiplier: float = 1.5,
+                 min_timeout: float = 0.5, max_timeout: float = 30.0, min_samples: int = 20):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, percentile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(percentile / 100.0 * len(samples))) - 1))
+        return samples[index]
+
+    def timeout(self) -> float:
+        """Seconds to wait for the next call; the static maximum until enough samples exist"""
+        if len(self._samples) < self.min_samples:
+            return self.max_timeout
+        adaptive = self.quantile(self.percentile) * self.multiplier
+        return min(self.max_timeout, max(self.min_timeout, adaptive))
+
+    def get_stats(self) -> Dict[str, Any]:
+        p50 = self.quantile(50)
+        p95 = self.quantile(95)
+        return {
+            "samples": len(self._samples),
+            "p50_ms": p50 * 1000 if p50 is not None else None,
+            "p95_ms": p95 * 1000 if p95 is not None else None,
+            "timeout_ms": self.timeout() * 1000,
+        }
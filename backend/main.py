@@ -1,34 +1,103 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from PIL import Image
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.routing import Match
+from typing import List, Optional
 from io import BytesIO
-import numpy as np
+import asyncio
+import functools
+import hmac
+import json
+import logging
+import math
+import uuid
+import zipfile
 import os
 import uvicorn
 import time
 from dotenv import load_dotenv
-from skin_detection_model import skindisease_detector
-from schemas import APIOutput, DetectionResponse, DetailedAnalysis
+import skin_detection_model
+from skin_detection_model import skindisease_detector, get_model_version, prepare_model, load_model_version
+from preprocessing import decode_image_timed, ImageTooLarge
+from quality_screen import quality_screen
+from phash_index import near_duplicate_index, perceptual_hashes
+from schemas import (APIOutput, DetectionResponse, DetailedAnalysis, BatchItemResult, StageTimings,
+                     AnalysisJobResponse, ModelLoadRequest, HistoryPage)
 from openai_service import openai_service
+from stage_executor import stage_executor
+from result_cache import detection_cache
+from history_store import history_store
+from upload_store import upload_store, CHUNK_SIZE as UPLOAD_CHUNK_SIZE
+from disease_catalog import disease_catalog
+from hosted_detector import hosted_detector
+from job_store import analysis_jobs, JobQueueFull
+from admission import Overloaded, upload_limiter, inference_limiter, llm_limiter, rate_limiter
+from model_registry import model_registry, ModelStateError
+from model_rollout import model_rollout
+from stage_timer import StageTimer
+import metrics
+import process_stats
+import structured_logging
+from structured_logging import get_logger, setup_logging
 
 # Load environment variables
 load_dotenv()
 
+setup_logging()
+logger = get_logger("main")
+
 # Startup validation
 def validate_startup_config():
     """Validate critical configuration on startup"""
     api_key = os.getenv('OPENAI_API_KEY')
     if not api_key:
-        print("⚠️  WARNING: OPENAI_API_KEY not configured. OpenAI features will use fallback responses.")
+        logger.warning("OPENAI_API_KEY not configured. OpenAI features will use fallback responses.")
     elif api_key == "your-openai-api-key-here":
-        print("⚠️  WARNING: OPENAI_API_KEY is set to example value. Please update your .env file.")
+        logger.warning("OPENAI_API_KEY is set to example value. Please update your .env file.")
     else:
-        print("✅ OpenAI configuration loaded successfully")
+        logger.info("OpenAI configuration loaded successfully")
 
 # Run startup validation
 validate_startup_config()
 
+# Total time an /analyze request may take; the OpenAI enrichment gets what detection leaves (0 = no budget)
+REQUEST_LATENCY_BUDGET_MS = float(os.getenv('REQUEST_LATENCY_BUDGET_MS', '10000'))
+
+# Below this model confidence the OpenAI call is skipped and the standard analysis is returned
+LLM_MIN_CONFIDENCE = float(os.getenv('LLM_MIN_CONFIDENCE', '0.3'))
+
+# Load the model at startup; otherwise it is loaded by the first request
+MODEL_EAGER_LOAD = os.getenv('MODEL_EAGER_LOAD', 'true').lower() == 'true'
+
+# Take the client address for rate limiting from X-Forwarded-For (only behind a trusted proxy)
+RATE_LIMIT_TRUST_FORWARDED = os.getenv('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true'
+
+# Longest a GET /analysis/{job_id} long-poll may wait
+ANALYSIS_JOB_MAX_WAIT_SECONDS = float(os.getenv('ANALYSIS_JOB_MAX_WAIT_SECONDS', '30'))
+
+# Request body caps; larger uploads are answered with 413 before they are buffered
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv('MAX_BATCH_UPLOAD_BYTES', str(200 * 1024 * 1024)))
+
+# Model management: /models may only load ONNX files from MODEL_DIR, and changes need the admin token
+MODEL_DIR = os.path.realpath(os.getenv('MODEL_DIR', os.path.dirname(os.path.abspath(__file__))))
+MODEL_ADMIN_TOKEN = os.getenv('MODEL_ADMIN_TOKEN', '')
+# A second model loaded at startup that shadows MODEL_SHADOW_PERCENT of requests in every worker
+MODEL_SHADOW_PATH = os.getenv('MODEL_SHADOW_PATH', '')
+MODEL_SHADOW_PERCENT = float(os.getenv('MODEL_SHADOW_PERCENT', '10'))
+
+# Stored analyses and uploads are health data: /history and /uploads need this token
+HISTORY_ACCESS_TOKEN = os.getenv('HISTORY_ACCESS_TOKEN', '')
+
+# Longest patient_id accepted with an upload
+PATIENT_ID_MAX_LENGTH = 128
+
+# Batch analysis limits
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', '100'))
+BATCH_MAX_MEMBER_BYTES = int(os.getenv('BATCH_MAX_MEMBER_BYTES', str(20 * 1024 * 1024)))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '16'))
+
 # Create FastAPI app
 app = FastAPI(
     title="AI Derma Detector", 
@@ -36,27 +105,193 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Add request logging middleware
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    
-    # Log incoming request details
-    print(f"📥 {request.method} {request.url}")
-    print(f"📋 Headers: {dict(request.headers)}")
-    print(f"🔍 Content-Type: {request.headers.get('content-type', 'Not specified')}")
-    
-    # For multipart requests, log additional info
-    if request.headers.get('content-type', '').startswith('multipart/form-data'):
-        print(f"📦 Multipart form data detected")
-    
-    response = await call_next(request)
-    
-    process_time = time.time() - start_time
-    print(f"⏱️ Request completed in {process_time:.2f}s with status {response.status_code}")
-    print("─" * 50)
-    
-    return response
+def _endpoint_label(scope) -> str:
+    """Route template for metrics labels, so path parameters do not create new series"""
+    app_instance = scope.get("app")
+    for route in getattr(app_instance, "routes", []):
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+class RequestTelemetryMiddleware:
+    """
+    Counts requests, tracks in-flight requests and latency per endpoint, and writes one
+    structured access log line per sampled request. Plain ASGI, so streamed responses
+    are timed until their last chunk is sent.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        endpoint = _endpoint_label(scope)
+        method = scope["method"]
+        headers = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+        
+        tokens = structured_logging.start_request(request_id)
+        metrics.http_requests_in_flight.inc(endpoint=endpoint)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            metrics.http_requests_in_flight.dec(endpoint=endpoint)
+            metrics.http_requests_total.inc(endpoint=endpoint, method=method, status=str(status_code))
+            metrics.http_request_duration_seconds.observe(duration, endpoint=endpoint, method=method)
+            logger.log(
+                logging.WARNING if status_code >= 500 else logging.INFO, "request completed",
+                extra={"fields": {
+                    "method": method,
+                    "path": scope["path"],
+                    "endpoint": endpoint,
+                    "status": status_code,
+                    "duration_ms": round(duration * 1000, 2),
+                    "content_type": headers.get(b"content-type", b"").decode("latin-1"),
+                    "content_length": headers.get(b"content-length", b"").decode("latin-1"),
+                }}
+            )
+            structured_logging.end_request(tokens)
+
+# The analysis endpoints; probes, job polls and history reads are never shed or rate limited,
+# so a client polling its own job cannot use up the tokens its next upload needs
+UPLOAD_ENDPOINTS = {"/analyze", "/analyze/batch", "/analyze/stream"}
+
+def _client_address(scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def _overloaded_response(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+class AdmissionMiddleware:
+    """
+    Sheds load before a request body is read, on the analysis endpoints only: a per-client
+    rate limit (429), then an upload slot (503 when the upload queue is full) held until the
+    request body has been received.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        if _endpoint_label(scope) not in UPLOAD_ENDPOINTS or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        
+        retry_after = rate_limiter.check(_client_address(scope))
+        if retry_after > 0:
+            metrics.requests_shed_total.inc(stage="rate_limit")
+            await _overloaded_response(429, "Rate limit exceeded", retry_after)(scope, receive, send)
+            return
+        
+        try:
+            acquired_at = await upload_limiter.acquire()
+        except Overloaded as e:
+            metrics.requests_shed_total.inc(stage=e.stage)
+            await _overloaded_response(503, "Server is busy, retry later", e.retry_after)(scope, receive, send)
+            return
+        
+        released = False
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                upload_limiter.release(acquired_at)
+        
+        async def receive_body():
+            message = await receive()
+            if message["type"] == "http.disconnect" or not message.get("more_body", False):
+                release()
+            return message
+        
+        try:
+            await self.app(scope, receive_body, send)
+        finally:
+            release()
+
+class UploadTooLarge(Exception):
+    pass
+
+def _upload_limit(endpoint: str) -> Optional[int]:
+    if endpoint == "/analyze/batch":
+        return MAX_BATCH_UPLOAD_BYTES
+    if endpoint in UPLOAD_ENDPOINTS:
+        return MAX_UPLOAD_BYTES
+    return None
+
+def _too_large_response(limit: int) -> JSONResponse:
+    return JSONResponse({"detail": f"Request body is larger than {limit} bytes"}, status_code=413)
+
+class UploadLimitMiddleware:
+    """
+    Caps request bodies of the upload endpoints. A Content-Length over the cap is answered
+    with 413 before any of the body is read; bodies without one are counted as they stream
+    in and cut off as soon as they pass the cap.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = _upload_limit(_endpoint_label(scope)) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await _too_large_response(limit)(scope, receive, send)
+            return
+        
+        received = 0
+        exceeded = False
+        
+        async def receive_limited():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+        
+        async def send_unless_exceeded(message):
+            # The form parser turns the aborted body into a 400; the 413 below replaces it
+            if not exceeded:
+                await send(message)
+        
+        try:
+            await self.app(scope, receive_limited, send_unless_exceeded)
+        except UploadTooLarge:
+            pass
+        if exceeded:
+            await _too_large_response(limit)(scope, receive, send)
+
+# Inside the telemetry middleware, so shed and rejected requests are counted and logged
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(RequestTelemetryMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -67,74 +302,573 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+startup_report = {}
+
+@app.on_event("startup")
+async def load_model_on_startup():
+    """Create the inference session and warm it up before the server accepts requests"""
+    if not MODEL_EAGER_LOAD:
+        return
+    started = time.perf_counter()
+    # In the server process, where the registry and model_ready are read; not on a stage pool
+    report = await asyncio.to_thread(prepare_model, int(os.getenv('MODEL_WARMUP_RUNS', '3')))
+    report["startup_seconds"] = time.perf_counter() - started
+    startup_report.update(report)
+    
+    if report["local_model"]:
+        warmup = ", ".join(f"{ms:.1f}" for ms in report["warmup_ms"])
+        logger.info(f"Model {report['model_version']} ready in {report['startup_seconds']:.2f}s "
+                    f"(load {report['load_seconds']:.2f}s, first inference {report['first_inference_ms']:.1f} ms, "
+                    f"warm-up runs: {warmup} ms)")
+    else:
+        logger.warning(f"Local model unavailable; ready in {report['startup_seconds']:.2f}s using the hosted API fallback")
+    
+    if MODEL_SHADOW_PATH and report["local_model"]:
+        # Loaded in the background; the active model is already serving
+        try:
+            load_model_version(_model_file(MODEL_SHADOW_PATH), shadow_percent=MODEL_SHADOW_PERCENT)
+        except (HTTPException, ModelStateError) as e:
+            logger.error(f"Shadow model {MODEL_SHADOW_PATH} not loaded: {getattr(e, 'detail', e)}")
+
+@app.on_event("startup")
+async def start_model_rollout():
+    # After the bundled model is registered, so shared changes apply on top of it
+    model_rollout.start()
+
+@app.on_event("startup")
+async def start_catalog_watcher():
+    disease_catalog.start_watching(float(os.getenv('CATALOG_RELOAD_INTERVAL', '2')))
+
+@app.on_event("startup")
+async def start_analysis_jobs():
+    analysis_jobs.start(run_analysis_job)
+
+@app.on_event("startup")
+async def start_history_store():
+    history_store.start()
+    upload_store.start()
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    disease_catalog.stop_watching()
+    model_rollout.close()
+    await analysis_jobs.stop()
+    history_store.close()
+    upload_store.close()
+    stage_executor.shutdown()
+    await openai_service.aclose()
+    hosted_detector.close()
+    structured_logging.shutdown_logging()
+
+# Analyses still running after their request gave up on them; they finish to fill the cache
+_background_analyses = set()
+
+def _finish_in_background(task: asyncio.Future):
+    _background_analyses.add(task)
+    def done(finished):
+        _background_analyses.discard(finished)
+        if not finished.cancelled() and finished.exception() is not None:
+            logger.warning(f"Background analysis failed: {type(finished.exception()).__name__}")
+    task.add_done_callback(done)
+
+def _enrichment_work(condition: str, confidence: float, basic_advice: str):
+    """Awaitable OpenAI enrichment: the async client on the loop, or the sync client on the llm pool"""
+    if openai_service.async_mode:
+        return openai_service.agenerate_detailed_analysis(condition, confidence, basic_advice)
+    return stage_executor.run("llm", openai_service.generate_detailed_analysis, condition, confidence, basic_advice)
+
+async def _admitted_enrichment(condition: str, confidence: float, basic_advice: str):
+    """The enrichment under the llm admission limit; cached analyses do not need a slot"""
+    if not openai_service.requires_provider_call(condition, confidence):
+        return await _enrichment_work(condition, confidence, basic_advice)
+    async with llm_limiter.slot():
+        return await _enrichment_work(condition, confidence, basic_advice)
+
+async def run_analysis_job(payload):
+    """
+    Background job for /analyze?async_analysis=true. Not bound by a request's latency
+    budget; the finished result is cached like a synchronous one.
+    """
+    detection, cache_key = payload
+    condition = detection['disease']
+    confidence = detection['probability']
+    basic_advice = ', '.join(detection['treatments'])
+    
+    with metrics.pipeline_stage_duration_seconds.time(stage="llm"):
+        detailed_analysis_dict = await _enrichment_work(condition, confidence, basic_advice)
+    detailed_analysis = DetailedAnalysis(**detailed_analysis_dict)
+    
+    if confidence > 0 and not openai_service.is_fallback_response(
+        detailed_analysis_dict, condition, basic_advice, confidence
+    ):
+        detection_cache.put(cache_key, APIOutput(**detection, detailed_analysis=detailed_analysis).model_dump(exclude={'timings'}))
+    return detailed_analysis.model_dump()
+
+async def generate_detailed_analysis(condition: str, confidence: float, basic_advice: str,
+                                     budget_seconds: Optional[float] = None):
+    """
+    Run the OpenAI enrichment with the async client, or on the llm pool for the sync client.
+    Waits at most the adaptive enrichment timeout (and the remaining request budget, if given);
+    past that the fallback analysis is returned and the call completes in the background.
+    The fallback is also returned at once when the llm admission queue is full. A cached
+    analysis costs nothing to serve, so it is returned even when the budget is spent.
+    """
+    if openai_service._is_configured():
+        cached = openai_service.cached_detailed_analysis(condition, confidence)
+        if cached is not None:
+            return cached
+    task = asyncio.ensure_future(_admitted_enrichment(condition, confidence, basic_advice))
+    
+    timeout = openai_service.enrichment_timeout()
+    if budget_seconds is not None:
+        timeout = min(timeout, budget_seconds)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout=max(0.0, timeout))
+    except Overloaded as e:
+        metrics.requests_shed_total.inc(stage=e.stage)
+        logger.info("LLM queue full, using fallback analysis", extra={"fields": {"condition": condition}})
+        return openai_service._get_fallback_response(condition, basic_advice, confidence)
+    except asyncio.TimeoutError:
+        metrics.llm_degraded_total.inc()
+        logger.info("Latency budget exhausted, using fallback analysis",
+                    extra={"fields": {"condition": condition, "timeout_ms": round(timeout * 1000, 1)}})
+        _finish_in_background(task)
+        return openai_service._get_fallback_response(condition, basic_advice, confidence)
+
+# Uploads being written to the upload store after their response
+_background_writes = set()
+
+async def _store_upload_file(upload: UploadFile, patient_id: Optional[str]):
+    """
+    Stream an analyzed upload from the request's spooled file into the content-addressed store,
+    chunk by chunk on a thread. Runs as the response's background task, before the form's files
+    are closed. A patient holds one reference to each image filed under them, so the garbage
+    collector keeps it until DELETE /uploads releases it.
+    """
+    def put():
+        upload.file.seek(0)
+        return upload_store.put_file(upload.file, owner=patient_id)
+    try:
+        await asyncio.to_thread(put)
+    except Exception as e:
+        logger.warning(f"Storing upload failed: {type(e).__name__}")
+
+def _upload_background(upload: UploadFile, patient_id: Optional[str]) -> Optional[BackgroundTask]:
+    return BackgroundTask(_store_upload_file, upload, patient_id) if upload_store.enabled else None
+
+def _store_upload(image_bytes: bytes, patient_id: Optional[str]):
+    """
+    Keep an analyzed image that only exists in memory (a batch item) in the content-addressed
+    store, on a thread after the response; the same references as _store_upload_file.
+    """
+    if not upload_store.enabled:
+        return
+    task = asyncio.ensure_future(asyncio.to_thread(upload_store.put_bytes, image_bytes, owner=patient_id))
+    _background_writes.add(task)
+    def done(finished):
+        _background_writes.discard(finished)
+        if not finished.cancelled() and finished.exception() is not None:
+            logger.warning(f"Storing upload failed: {type(finished.exception()).__name__}")
+    task.add_done_callback(done)
+
+def _skipped_analysis(condition: str, confidence: float, basic_advice: str, quality_issues: List[str]):
+    """
+    The standard analysis, without an OpenAI call, for detections not worth paying a completion
+    for: images flagged by the quality screen and predictions below LLM_MIN_CONFIDENCE.
+    None when the call should be made.
+    """
+    if quality_issues:
+        reason = "quality"
+    elif confidence < LLM_MIN_CONFIDENCE:
+        reason = "low_confidence"
+    else:
+        return None
+    metrics.work_skipped_total.inc(stage="llm", reason=reason)
+    return openai_service._get_fallback_response(condition, basic_advice, confidence)
+
 @app.get("/")
 async def root():
     return {"message": "AI Derma Detector API - Skin Disease Detection using ONNX Model", "status": "running"}
 
+SUPPORTED_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+async def analyze_image_bytes(image_bytes: bytes, include_analysis: bool = True,
+                              timer: Optional[StageTimer] = None, patient_id: Optional[str] = None) -> APIOutput:
+    """
+    Run cache lookup, decode, quality screen, near-duplicate lookup, detection and (optionally)
+    OpenAI enrichment for one image. Near duplicates are only looked for among the images of
+    the same patient_id (or, without one, of other uploads without one).
+    Raises HTTPException with the status the /analyze endpoint reports.
+    The returned output carries the per-stage timings recorded on `timer`.
+    """
+    timer = timer or StageTimer()
+    
+    # Byte-identical re-submissions are answered from the result cache
+    with timer.stage("cache_lookup"):
+        image_digest = detection_cache.digest(image_bytes)
+        cache_key = detection_cache.key_for(image_digest, get_model_version())
+        cached_result = await detection_cache.aget(cache_key)
+    if cached_result is not None:
+        return _finish_output(APIOutput(**cached_result), timer, image_digest)
+    
+    # Read and process image; decode and preprocess are measured where they run
+    try:
+        started = time.perf_counter_ns()
+        img_array, decode_ms, preprocess_ms, source_size = await stage_executor.run("decode", decode_image_timed, image_bytes)
+        # Time spent waiting for a decode worker is counted as decode time
+        timer.add("decode", (time.perf_counter_ns() - started) / 1e6 - preprocess_ms)
+        timer.add("preprocess", preprocess_ms)
+        
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
+    
+    # Unusable photos are turned away before they cost a model run and an OpenAI call
+    quality = None
+    if quality_screen.enabled:
+        with timer.stage("quality"):
+            quality = quality_screen.assess(img_array, source_size)
+        verdict = quality_screen.verdict(quality)
+        metrics.quality_screen_total.inc(verdict=verdict)
+        for issue in quality["issues"]:
+            metrics.quality_issues_total.inc(issue=issue)
+        if verdict == "rejected":
+            metrics.work_skipped_total.inc(stage="inference", reason="quality")
+            metrics.work_skipped_total.inc(stage="llm", reason="quality")
+            raise HTTPException(status_code=422, detail=quality_screen.rejection_message(quality))
+    
+    # Re-encoded, rescaled or slightly cropped re-uploads reuse the earlier image's result
+    hashes = None
+    if near_duplicate_index.enabled:
+        with timer.stage("near_duplicate"):
+            hashes = await stage_executor.run("decode", perceptual_hashes, img_array)
+            similar_key = near_duplicate_index.find(hashes, get_model_version(), patient_id)
+            similar_result = await detection_cache.aget(similar_key) if similar_key is not None else None
+        metrics.near_duplicate_lookups_total.inc(result="hit" if similar_result is not None else "miss")
+        if similar_result is not None:
+            reused = {**similar_result, "quality": quality}
+            detection_cache.put(cache_key, reused)
+            return _finish_output(APIOutput(**reused), timer, image_digest)
+    
+    # Run skin disease detection
+    try:
+        with timer.stage("inference"):
+            async with inference_limiter.slot():
+                detection_result = await stage_executor.run("inference", skindisease_detector, img_array, image_bytes)
+        detection_result['quality'] = quality
+        if hashes is not None and detection_result.get('probability', 0.0) > 0 and not (quality and quality["issues"]):
+            # Matches once the analysis is cached, whether here, by an analysis job or by the stream
+            model_version = detection_result.get('model_version')
+            near_duplicate_index.add(hashes, model_version or get_model_version(), _result_key(image_digest, model_version),
+                                     patient_id)
+        if not include_analysis:
+            return _finish_output(APIOutput(**detection_result), timer, image_digest)
+        
+        # Generate detailed analysis using OpenAI
+        condition = detection_result.get('disease', '')
+        confidence = detection_result.get('probability', 0.0)
+        basic_advice = ', '.join(detection_result.get('treatments', []))
+        
+        detailed_analysis_dict = _skipped_analysis(condition, confidence, basic_advice, quality["issues"] if quality else [])
+        if detailed_analysis_dict is None:
+            logger.info("Generating detailed analysis", extra={"fields": {"condition": condition}})
+            budget_seconds = None
+            if REQUEST_LATENCY_BUDGET_MS > 0:
+                budget_seconds = (REQUEST_LATENCY_BUDGET_MS - timer.elapsed_ms()) / 1000.0
+            with timer.stage("llm"):
+                detailed_analysis_dict = await generate_detailed_analysis(condition, confidence, basic_advice, budget_seconds)
+        
+        # Convert to Pydantic model
+        detailed_analysis = DetailedAnalysis(**detailed_analysis_dict)
+        
+        # Add detailed analysis to the result
+        detection_result['detailed_analysis'] = detailed_analysis
+        
+        # Format the response
+        api_output = APIOutput(**detection_result)
+        
+        # Only cache real results, not the detector or OpenAI fallbacks
+        if confidence > 0 and not openai_service.is_fallback_response(
+            detailed_analysis_dict, condition, basic_advice, confidence
+        ):
+            detection_cache.put(_result_key(image_digest, api_output.model_version), api_output.model_dump(exclude={'timings'}))
+        
+        return _finish_output(api_output, timer, image_digest)
+        
+    except Overloaded as e:
+        metrics.requests_shed_total.inc(stage=e.stage)
+        raise HTTPException(status_code=503, detail="Server is busy, retry later",
+                            headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
+
+def _result_key(image_digest: str, model_version: Optional[str]) -> str:
+    """
+    Cache key under the version that produced a result, which a promotion may have changed since
+    the lookup; built from the digest computed for the lookup, so the upload is hashed once
+    """
+    return detection_cache.key_for(image_digest, model_version or get_model_version())
+
+def _finish_output(api_output: APIOutput, timer: StageTimer, image_digest: str) -> APIOutput:
+    """Attach the request's stage timings and the digest of its upload"""
+    api_output.timings = StageTimings(**timer.as_dict())
+    api_output.image_digest = image_digest
+    return api_output
+
 @app.post("/analyze", response_model=DetectionResponse)
-async def analyze_skin_image(image: UploadFile = File(..., description="Skin image file to analyze")):
+async def analyze_skin_image(
+    image: UploadFile = File(..., description="Skin image file to analyze"),
+    patient_id: Optional[str] = Form(None, max_length=PATIENT_ID_MAX_LENGTH, description="Stored with the result in the analysis history"),
+    async_analysis: bool = False
+):
     """
-    Analyze uploaded skin image for disease detection
+    Analyze uploaded skin image for disease detection.
+    With async_analysis=true the detection is returned without waiting for the detailed
+    analysis; it is delivered later through GET /analysis/{job_id}.
+    The result is recorded in the analysis history, under patient_id if one is given.
     """
+    timer = StageTimer()
     try:
-        # Log the received file for debugging
-        print(f"📥 Received file: {image.filename}, content_type: {image.content_type}, size: {image.size}")
+        logger.info("Received file", extra={"fields": {
+            "upload_filename": image.filename, "upload_content_type": image.content_type, "upload_size": image.size
+        }})
         
         # Validate file type
-        if not image.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            raise HTTPException(status_code=415, detail="Unsupported file type. Please upload PNG, JPG, or JPEG images.")
+        if not image.filename.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
             raise HTTPException(status_code=415, detail="Unsupported file type. Please upload PNG, JPG, or JPEG images.")
         
-        # Read and process image
-        try:
+        with timer.stage("upload_read"):
             image_bytes = await image.read()
-            pil_image = Image.open(BytesIO(image_bytes))
-            
-            # Convert to RGB if necessary
-            if pil_image.mode != 'RGB':
-                pil_image = pil_image.convert('RGB')
-            
-            # Convert PIL image to numpy array
-            img_array = np.array(pil_image)
-            
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
+        api_output = await analyze_image_bytes(image_bytes, include_analysis=not async_analysis, timer=timer,
+                                               patient_id=patient_id)
+        message = "Skin disease detection completed successfully"
         
-        # Run skin disease detection
-        try:
-            detection_result = skindisease_detector(img_array)
-            
-            # Generate detailed analysis using OpenAI
-            condition = detection_result.get('disease', '')
-            confidence = detection_result.get('probability', 0.0)
-            basic_advice = ', '.join(detection_result.get('treatments', []))
-            
-            print(f"🤖 Generating detailed analysis for {condition} with OpenAI...")
-            detailed_analysis_dict = openai_service.generate_detailed_analysis(condition, confidence, basic_advice)
-            
-            # Convert to Pydantic model
-            detailed_analysis = DetailedAnalysis(**detailed_analysis_dict)
-            
-            # Add detailed analysis to the result
-            detection_result['detailed_analysis'] = detailed_analysis
-            
-            # Format the response
-            api_output = APIOutput(**detection_result)
-            
-            return DetectionResponse(
+        # A cached result already carries its analysis; otherwise hand the enrichment to a job
+        job_id = None
+        skipped = None
+        if async_analysis and api_output.detailed_analysis is None:
+            skipped = _skipped_analysis(api_output.disease, api_output.probability, ', '.join(api_output.treatments),
+                                        api_output.quality.issues if api_output.quality else [])
+        if skipped is not None:
+            api_output.detailed_analysis = DetailedAnalysis(**skipped)
+        elif async_analysis and api_output.detailed_analysis is None:
+            detection = api_output.model_dump(exclude={'detailed_analysis', 'timings'})
+            try:
+                job_id = await analysis_jobs.submit((detection, _result_key(api_output.image_digest, api_output.model_version)))
+                message = "Skin disease detection completed; detailed analysis pending"
+            except JobQueueFull:
+                # Too much queued work: answer now with the standard analysis instead
+                api_output.detailed_analysis = DetailedAnalysis(**openai_service._get_fallback_response(
+                    api_output.disease, ', '.join(api_output.treatments), api_output.probability
+                ))
+        
+        # Serialized here (rather than by FastAPI) so the stage can be measured; it can only
+        # be reported in the Server-Timing header, not in the body being serialized
+        with timer.stage("serialization"):
+            body = DetectionResponse(
                 success=True,
                 result=api_output,
-                message="Skin disease detection completed successfully"
-            )
-            
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
+                message=message,
+                job_id=job_id
+            ).model_dump_json()
+        history_store.record(api_output, "/analyze", patient_id)
+        return Response(content=body, media_type="application/json",
+                        headers={"Server-Timing": timer.server_timing()},
+                        background=_upload_background(image, patient_id))
             
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.get("/analysis/{job_id}", response_model=AnalysisJobResponse)
+async def get_analysis_job(job_id: str, wait: float = 0.0):
+    """
+    Detailed analysis for an /analyze?async_analysis=true request. With wait > 0 the
+    request long-polls for up to that many seconds until the analysis is ready.
+    """
+    job = await analysis_jobs.wait(job_id, min(max(0.0, wait), ANALYSIS_JOB_MAX_WAIT_SECONDS))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired analysis job")
+    return AnalysisJobResponse(
+        job_id=job.job_id,
+        status=job.status,
+        detailed_analysis=DetailedAnalysis(**job.result) if job.result is not None else None,
+        error=job.error
+    )
+
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_skin_image_stream(
+    image: UploadFile = File(..., description="Skin image file to analyze"),
+    patient_id: Optional[str] = Form(None, max_length=PATIENT_ID_MAX_LENGTH, description="Stored with the result in the analysis history")
+):
+    """
+    Streaming variant of /analyze using server-sent events. The detection result is sent
+    as soon as inference finishes ("detection"), followed by the OpenAI output as it is
+    generated ("token"), the parsed sections ("analysis") and a final "done" event.
+    """
+    if not image.filename.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
+        raise HTTPException(status_code=415, detail="Unsupported file type. Please upload PNG, JPG, or JPEG images.")
+    
+    timer = StageTimer()
+    with timer.stage("upload_read"):
+        image_bytes = await image.read()
+    # Detection errors are still reported as regular HTTP errors, before the stream starts
+    api_output = await analyze_image_bytes(image_bytes, include_analysis=False, timer=timer, patient_id=patient_id)
+    
+    async def stream_events():
+        events = analysis_events()
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+            # Recorded with the analysis once it is known (also when the client left early), like /analyze
+            history_store.record(api_output, "/analyze/stream", patient_id)
+    
+    async def analysis_events():
+        detection = api_output.model_dump(exclude={'detailed_analysis'})
+        yield _sse_event("detection", detection)
+        
+        if api_output.detailed_analysis is not None:
+            # Served from the result cache
+            yield _sse_event("analysis", api_output.detailed_analysis.model_dump())
+            yield _sse_event("done", {})
+            return
+        
+        condition = api_output.disease
+        confidence = api_output.probability
+        basic_advice = ', '.join(api_output.treatments)
+        skipped = _skipped_analysis(condition, confidence, basic_advice,
+                                    api_output.quality.issues if api_output.quality else [])
+        if skipped is not None:
+            api_output.detailed_analysis = DetailedAnalysis(**skipped)
+            yield _sse_event("analysis", api_output.detailed_analysis.model_dump())
+            yield _sse_event("done", {})
+            return
+        
+        llm_started = time.perf_counter_ns()
+        acquired_at = None
+        try:
+            if openai_service.requires_provider_call(condition, confidence):
+                acquired_at = await llm_limiter.acquire()
+        except Overloaded as e:
+            metrics.requests_shed_total.inc(stage=e.stage)
+            fallback = openai_service._get_fallback_response(condition, basic_advice, confidence)
+            api_output.detailed_analysis = DetailedAnalysis(**fallback)
+            yield _sse_event("analysis", api_output.detailed_analysis.model_dump())
+            yield _sse_event("done", {})
+            return
+        try:
+            async for kind, value in openai_service.astream_detailed_analysis(condition, confidence, basic_advice):
+                if kind == "token":
+                    yield _sse_event("token", {"text": value})
+                    continue
+                
+                timer.add("llm", (time.perf_counter_ns() - llm_started) / 1e6)
+                detailed_analysis = DetailedAnalysis(**value)
+                api_output.detailed_analysis = detailed_analysis
+                yield _sse_event("analysis", detailed_analysis.model_dump())
+                
+                if confidence > 0 and not openai_service.is_fallback_response(value, condition, basic_advice, confidence):
+                    detection_cache.put(
+                        _result_key(api_output.image_digest, api_output.model_version),
+                        APIOutput(**detection, detailed_analysis=detailed_analysis).model_dump(exclude={'timings'})
+                    )
+        except Exception as e:
+            yield _sse_event("error", {"detail": f"Detailed analysis failed: {str(e)}"})
+        finally:
+            if acquired_at is not None:
+                llm_limiter.release(acquired_at)
+        yield _sse_event("done", {})
+    
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": timer.server_timing()},
+        background=_upload_background(image, patient_id)
+    )
+
+def _is_zip_upload(upload: UploadFile) -> bool:
+    return (upload.filename or '').lower().endswith('.zip') or upload.content_type in ('application/zip', 'application/x-zip-compressed')
+
+def _read_zip_member(archive: zipfile.ZipFile, member: zipfile.ZipInfo) -> bytes:
+    if member.file_size > BATCH_MAX_MEMBER_BYTES:
+        raise HTTPException(status_code=413, detail=f"Archive member is larger than {BATCH_MAX_MEMBER_BYTES} bytes")
+    return archive.read(member)
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    images: List[UploadFile] = File(..., description="Skin images, or zip archives of images, to analyze"),
+    patient_id: Optional[str] = Form(None, max_length=PATIENT_ID_MAX_LENGTH, description="Stored with every result in the analysis history"),
+    include_analysis: bool = True
+):
+    """
+    Analyze many images in one request. Results are streamed as NDJSON, one line per
+    image in completion order; a failing image produces an error line instead of failing the batch.
+    """
+    # Upload files are closed once this handler returns, so their contents are read up front;
+    # zip members are only decompressed when their turn comes
+    items = []
+    for upload in images:
+        data = await upload.read()
+        if _is_zip_upload(upload):
+            try:
+                archive = zipfile.ZipFile(BytesIO(data))
+            except zipfile.BadZipFile:
+                items.append((upload.filename, None, "Invalid zip archive"))
+                continue
+            for member in archive.infolist():
+                if not member.is_dir() and member.filename.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
+                    items.append((member.filename, functools.partial(_read_zip_member, archive, member), None))
+        elif (upload.filename or '').lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
+            items.append((upload.filename, data, None))
+        else:
+            items.append((upload.filename, None, "Unsupported file type. Please upload PNG, JPG, or JPEG images."))
+    
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in the request")
+    if len(items) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"Too many images in one batch (limit {BATCH_MAX_IMAGES})")
+    
+    # Bounded so a large batch cannot monopolise the inference and LLM pools
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def process(index, filename, source, error):
+        if error is not None:
+            return BatchItemResult(index=index, filename=filename, success=False, error=error)
+        async with semaphore:
+            try:
+                image_bytes = source if isinstance(source, bytes) else await asyncio.to_thread(source)
+                result = await analyze_image_bytes(image_bytes, include_analysis=include_analysis, patient_id=patient_id)
+                history_store.record(result, "/analyze/batch", patient_id)
+                _store_upload(image_bytes, patient_id)
+                return BatchItemResult(index=index, filename=filename, success=True, result=result)
+            except HTTPException as e:
+                return BatchItemResult(index=index, filename=filename, success=False, error=str(e.detail))
+            except Exception as e:
+                return BatchItemResult(index=index, filename=filename, success=False, error=f"Internal server error: {str(e)}")
+    
+    async def stream_results():
+        tasks = [asyncio.create_task(process(index, *item)) for index, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item_result = await next_done
+                started = time.perf_counter_ns()
+                line = item_result.model_dump_json(exclude_none=True) + "\n"
+                metrics.pipeline_stage_duration_seconds.observe((time.perf_counter_ns() - started) / 1e9, stage="serialization")
+                yield line
+        finally:
+            # Client disconnected: stop work that nobody will read
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @app.get("/test-openai")
 async def test_openai():
     """Test OpenAI integration endpoint"""
@@ -144,7 +878,7 @@ async def test_openai():
         test_confidence = 0.85
         test_advice = "Use gentle cleanser twice daily"
         
-        result = openai_service.generate_detailed_analysis(test_condition, test_confidence, test_advice)
+        result = await generate_detailed_analysis(test_condition, test_confidence, test_advice)
         
         return {
             "success": True,
@@ -163,20 +897,250 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "API is running properly"}
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness for load balancers: 503 until the model is loaded and warmed up, and while
+    an admission queue is full. /health only reports that the process is up.
+    """
+    model_ready = skin_detection_model.model_ready or not MODEL_EAGER_LOAD
+    limiters = {limiter.name: limiter for limiter in (upload_limiter, inference_limiter, llm_limiter)}
+    saturated = [name for name, limiter in limiters.items() if limiter.saturated]
+    ready = model_ready and not saturated
+    return JSONResponse({
+        "ready": ready,
+        "model_ready": model_ready,
+        "local_model": model_registry.active is not None,
+        "model_version": get_model_version(),
+        "hosted_api_circuit": hosted_detector.breaker.state,
+        "saturated_stages": saturated,
+        "queues": {
+            **{name: {"active": limiter.active, "waiting": limiter.waiting} for name, limiter in limiters.items()},
+            "analysis_jobs": {"pending": analysis_jobs.get_stats()["pending"]},
+        },
+    }, status_code=200 if ready else 503)
+
+@app.get("/stats")
+async def get_stats():
+    """Runtime performance statistics"""
+    active = model_registry.active
+    # Reads the upload index on disk
+    upload_stats = await asyncio.to_thread(upload_store.get_stats)
+    return {
+        "startup": startup_report,
+        "inference": active.scheduler.get_stats() if active is not None else None,
+        "models": model_registry.get_stats(),
+        "stages": stage_executor.get_stats(),
+        "result_cache": detection_cache.get_stats(),
+        "history": history_store.get_stats(),
+        "upload_store": upload_stats,
+        "near_duplicate_index": near_duplicate_index.get_stats(),
+        "analysis_cache": openai_service.analysis_cache.get_stats(),
+        "hosted_api": hosted_detector.get_stats(),
+        "analysis_jobs": analysis_jobs.get_stats(),
+        "admission": {
+            "upload": upload_limiter.get_stats(),
+            "inference": inference_limiter.get_stats(),
+            "llm": llm_limiter.get_stats(),
+            "rate_limit": rate_limiter.get_stats(),
+        },
+        "llm_latency": {
+            **openai_service.latency_tracker.get_stats(),
+            "enrichment_timeout_ms": openai_service.enrichment_timeout() * 1000,
+            "request_budget_ms": REQUEST_LATENCY_BUDGET_MS,
+            "degraded": metrics.llm_degraded_total.value(),
+            "background_in_flight": len(_background_analyses),
+        },
+        "logging": structured_logging.get_stats(),
+        "process": {
+            **process_stats.get_stats(),
+            "ort_intra_op_threads": int(os.getenv('ORT_INTRA_OP_THREADS', '0')) or None,
+            "shared_model_mb": (len(skin_detection_model.shared_model_bytes) / 1e6
+                                if skin_detection_model.shared_model_bytes is not None else None),
+        },
+    }
+
+def _require_history_access(request: Request):
+    token = request.headers.get("x-history-token")
+    if not HISTORY_ACCESS_TOKEN:
+        raise HTTPException(status_code=403, detail="History access is disabled; set HISTORY_ACCESS_TOKEN")
+    if token is None:
+        raise HTTPException(status_code=401, detail="Missing X-History-Token")
+    if not hmac.compare_digest(token, HISTORY_ACCESS_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid history token")
+
+def _require_history(request: Request):
+    _require_history_access(request)
+    if not history_store.enabled:
+        raise HTTPException(status_code=404, detail="Analysis history is disabled; set HISTORY_DB_PATH")
+
+@app.get("/history", response_model=HistoryPage)
+async def get_history(
+    request: Request,
+    patient_id: Optional[str] = None,
+    condition: Optional[str] = None,
+    model_version: Optional[str] = None,
+    image_digest: Optional[str] = None,
+    since: Optional[float] = Query(None, description="Unix time; only analyses at or after it"),
+    until: Optional[float] = Query(None, description="Unix time; only analyses before it"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[int] = Query(None, description="next_cursor of the previous page"),
+    include_result: bool = True
+):
+    """
+    Recorded analyses, newest first, one page at a time. Entries are written in batches,
+    so an analysis appears here within HISTORY_FLUSH_INTERVAL_MS of its response.
+    """
+    _require_history(request)
+    items, next_cursor = await asyncio.to_thread(
+        history_store.query, limit=limit, cursor=cursor, since=since, until=until, include_result=include_result,
+        patient_id=patient_id, condition=condition, model_version=model_version, image_digest=image_digest
+    )
+    return HistoryPage(items=items, next_cursor=next_cursor)
+
+@app.get("/history/summary")
+async def get_history_summary(
+    request: Request,
+    patient_id: Optional[str] = None,
+    model_version: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None
+):
+    """Analysis counts and mean confidence per condition and model version, for dashboards"""
+    _require_history(request)
+    return await asyncio.to_thread(history_store.summary, since=since, until=until,
+                                   patient_id=patient_id, model_version=model_version)
+
+def _open_stored_upload(digest: str):
+    """
+    A stored upload opened for reading, its media type and size, or None. The open file stays
+    readable if the garbage collector removes it meanwhile.
+    """
+    path = upload_store.get(digest)
+    if path is None:
+        return None
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        # Collected between the lookup and the open
+        return None
+    is_png = file.read(8) == b"\x89PNG\r\n\x1a\n"
+    file.seek(0)
+    return file, "image/png" if is_png else "image/jpeg", os.fstat(file.fileno()).st_size
+
+@app.get("/uploads/{digest}")
+async def get_upload(request: Request, digest: str):
+    """A stored upload by the image_digest of its result"""
+    _require_history_access(request)
+    # The stat, open and signature read are disk I/O, so they run on a thread
+    found = await asyncio.to_thread(_open_stored_upload, digest)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    file, media_type, size = found
+
+    def chunks():
+        with file:
+            yield from iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b'')
+    # A sync iterator, so Starlette reads the chunks on a thread
+    return StreamingResponse(chunks(), media_type=media_type, headers={"Content-Length": str(size)})
+
+@app.delete("/uploads")
+async def release_uploads(
+    request: Request,
+    patient_id: str = Query(..., max_length=PATIENT_ID_MAX_LENGTH),
+    image_digest: Optional[str] = Query(None, description="Only this upload; all of the patient's when omitted")
+):
+    """
+    Stop keeping a patient's uploads. The files are removed by the garbage collector
+    UPLOAD_STORE_TTL_SECONDS after their last use, unless another patient still holds them.
+    """
+    _require_history_access(request)
+    if not upload_store.enabled:
+        raise HTTPException(status_code=404, detail="Upload storage is disabled; set UPLOAD_STORE_DIR")
+    released = await asyncio.to_thread(upload_store.release, patient_id, image_digest)
+    return {"released": released}
+
+def _model_file(path: str) -> str:
+    """Resolve a model file name inside MODEL_DIR; anything outside it is refused"""
+    resolved = os.path.realpath(os.path.join(MODEL_DIR, path))
+    if not resolved.startswith(MODEL_DIR + os.sep):
+        raise HTTPException(status_code=400, detail="Model files must be inside MODEL_DIR")
+    if not resolved.endswith('.onnx'):
+        raise HTTPException(status_code=400, detail="Only .onnx model files can be loaded")
+    if not os.path.isfile(resolved):
+        raise HTTPException(status_code=404, detail=f"Model file {path} not found")
+    return resolved
+
+def _require_admin(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model management is disabled; set MODEL_ADMIN_TOKEN")
+    if not hmac.compare_digest(token, MODEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+async def _model_change(change, *args):
+    """
+    Apply a registry change through the rollout, which shares it with the other workers;
+    unknown versions map to 404 and wrong states to 409
+    """
+    try:
+        return await asyncio.to_thread(change, *args)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model {args[0]} is not loaded")
+    except ModelStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/models")
+async def list_models(request: Request):
+    """
+    Loaded model versions with their state, latency and shadow agreement in the worker that
+    answers; `rollout.converged` tells whether it has applied the latest change yet
+    """
+    _require_admin(request)
+    return {**model_registry.get_stats(), "rollout": model_rollout.get_stats()}
+
+@app.post("/models", status_code=202)
+async def load_model_endpoint(body: ModelLoadRequest, request: Request):
+    """
+    Load and warm up another model version in the background while the active one keeps serving.
+    Poll GET /models until its state is "ready" (or it is promoted or shadowing, if requested).
+    """
+    _require_admin(request)
+    path = _model_file(body.path)
+    version = body.version or await asyncio.to_thread(skin_detection_model.model_file_version, path)
+    load = functools.partial(model_rollout.load, path=path, activate=body.activate, shadow_percent=body.shadow_percent)
+    entry = await _model_change(load, version)
+    return entry.get_stats()
+
+@app.post("/models/{version}/promote")
+async def promote_model(version: str, request: Request):
+    """Send new requests to this version; in-flight requests finish on the previous one"""
+    _require_admin(request)
+    return (await _model_change(model_rollout.promote, version)).get_stats()
+
+@app.post("/models/{version}/shadow")
+async def shadow_model(version: str, request: Request, percent: float = 10.0):
+    """Mirror a percentage of requests to this version for comparison; 0 stops mirroring"""
+    _require_admin(request)
+    return (await _model_change(model_rollout.set_shadow, version, percent)).get_stats()
+
+@app.delete("/models/{version}")
+async def unload_model(version: str, request: Request):
+    """Unload a version that is not active, once its in-flight requests have finished"""
+    _require_admin(request)
+    await _model_change(model_rollout.unload, version)
+    return {"unloaded": version}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request and pipeline stage metrics in Prometheus text format"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/supported-diseases")
 async def get_supported_diseases():
     """Get list of supported skin diseases"""
-    try:
-        import json
-        json_path = os.path.join(os.path.dirname(__file__), 'skindisease.json')
-        with open(json_path, 'r') as file:
-            skin_diseases = json.load(file)['skin_diseases']
-        
-        disease_list = [disease['name'] for disease in skin_diseases]
-        return {"supported_diseases": disease_list, "total_count": len(disease_list)}
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to load disease list: {str(e)}")
+    disease_list = disease_catalog.names()
+    return {"supported_diseases": disease_list, "total_count": len(disease_list)}
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=3000)
@@ -0,0 +1,381 @@
+"""
+Registry of loaded model versions, for rolling out a new model without a restart.
+
+A new ONNX file is loaded and warmed up on a background thread while the
+current version keeps serving. Promoting it swaps the active version under a
+lock: requests already running keep the version they started on, and the
+previous version stays loaded as a standby so rolling back is another promote.
+Unloading waits for a version's in-flight requests before its scheduler stops.
+
+A loaded version can also shadow the active one: a percentage of requests is
+mirrored to it, its prediction is compared with the active model's and then
+discarded, so its latency and top-class agreement can be judged on real
+traffic before it is promoted. Each version reports its own latency.
+
+The registry lives in the server process; with several gunicorn workers,
+model_rollout.py shares /models changes between the workers' registries.
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from inference_scheduler import InferenceScheduler
+from latency_tracker import LatencyTracker
+from structured_logging import get_logger
+
+logger = get_logger("model_registry")
+
+LOADING = "loading"
+READY = "ready"
+ACTIVE = "active"
+SHADOW = "shadow"
+FAILED = "failed"
+RETIRED = "retired"
+
+
+class ModelStateError(Exception):
+    """The requested change does not fit the version's current state"""
+
+
+def warm_up(scheduler: InferenceScheduler, runs: int = 3) -> List[float]:
+    """Run warm-up inferences, then the largest batch shape; returns each single run's milliseconds"""
+    image = np.zeros(scheduler.input_shape, dtype=np.float32)
+    timings = []
+    for _ in range(max(1, runs)):
+        started = time.perf_counter()
+        scheduler.infer(image)
+        timings.append((time.perf_counter() - started) * 1000)
+    if scheduler.max_batch_size > 1:
+        batch = np.zeros((scheduler.max_batch_size,) + scheduler.input_shape, dtype=np.float32)
+        scheduler.session.run([scheduler.output_name], {scheduler.input_name: batch})
+    return timings
+
+
+class ModelVersion:
+    def __init__(self, version: str, path: str):
+        self.version = version
+        self.path = path
+        self.state = LOADING
+        self.error: Optional[str] = None
+        self.scheduler: Optional[InferenceScheduler] = None
+        self.loaded_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_ms: List[float] = []
+        self.in_flight = 0
+        self.requests = 0
+        self.latency = LatencyTracker(window=1000)
+        # Only counted while this version is the shadow
+        self.mirrored = 0
+        self.agreed = 0
+        self.shadow_errors = 0
+        self.skipped = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        p50 = self.latency.quantile(50)
+        p95 = self.latency.quantile(95)
+        compared = self.mirrored - self.shadow_errors
+        return {
+            "version": self.version,
+            "path": os.path.basename(self.path),
+            "state": self.state,
+            "error": self.error,
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+            "warmup_ms": self.warmup_ms,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "p50_ms": p50 * 1000 if p50 is not None else None,
+            "p95_ms": p95 * 1000 if p95 is not None else None,
+            "shadow": {
+                "mirrored": self.mirrored,
+                "agreed": self.agreed,
+                "errors": self.shadow_errors,
+                "skipped": self.skipped,
+                "agreement_rate": self.agreed / compared if compared else None,
+            },
+        }
+
+
+class ModelRegistry:
+    def __init__(self, max_batch_size: int = 8, max_wait_ms: float = 5.0, warmup_runs: int = 3,
+                 max_loaded: int = 3, shadow_max_queue: int = 32):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.warmup_runs = warmup_runs
+        self.max_loaded = max(2, max_loaded)
+        self.shadow_max_queue = shadow_max_queue
+        self._versions: Dict[str, ModelVersion] = {}
+        self._active: Optional[ModelVersion] = None
+        self._shadow: Optional[ModelVersion] = None
+        self._shadow_percent = 0.0
+        self._lock = threading.Lock()
+        self.promotions = 0
+
+    @property
+    def active(self) -> Optional[ModelVersion]:
+        return self._active
+
+    @property
+    def shadow(self) -> Optional[ModelVersion]:
+        return self._shadow
+
+    @property
+    def shadow_percent(self) -> float:
+        return self._shadow_percent
+
+    def states(self) -> Dict[str, str]:
+        """State of every loaded (or failed) version"""
+        with self._lock:
+            return {version: entry.state for version, entry in self._versions.items()}
+
+    def get(self, version: str) -> ModelVersion:
+        """The loaded version with this id; raises KeyError for unknown versions"""
+        return self._versions[version]
+
+    def register(self, version: str, path: str, session, activate: bool = True) -> ModelVersion:
+        """Add a version from a session created by the caller, without warm-up"""
+        with self._lock:
+            entry = self._reserve(version, path)
+        self._start(entry, session)
+        entry.state = READY
+        if activate:
+            self.promote(version)
+        return entry
+
+    def load(self, version: str, path: str, create_session: Callable[[], Any], activate: bool = False,
+             shadow_percent: Optional[float] = None, background: bool = True) -> ModelVersion:
+        """
+        Create, start and warm up a new version; on a background thread unless told otherwise.
+        Once it is ready it is promoted (activate) or starts shadowing the active version.
+        """
+        with self._lock:
+            entry = self._reserve(version, path)
+
+        def run():
+            started = time.perf_counter()
+            try:
+                self._start(entry, create_session())
+                entry.warmup_ms = warm_up(entry.scheduler, self.warmup_runs)
+            except Exception as e:
+                self._close(entry)
+                entry.state = FAILED
+                entry.error = str(e)
+                logger.error(f"Loading model {version} failed: {e}")
+                return
+            entry.load_seconds = time.perf_counter() - started
+            # Only now can it be promoted or mirrored to
+            entry.state = READY
+            logger.info(f"Model {version} loaded and warmed up in {entry.load_seconds:.2f}s")
+            if activate:
+                self.promote(version)
+            elif shadow_percent:
+                self.set_shadow(version, shadow_percent)
+
+        if background:
+            threading.Thread(target=run, name=f"model-load-{version}", daemon=True).start()
+        else:
+            run()
+        return entry
+
+    def promote(self, version: str) -> ModelVersion:
+        """Route new requests to a ready version; the previous active version stays loaded as a standby"""
+        with self._lock:
+            entry = self._versions.get(version)
+            if entry is None:
+                raise KeyError(version)
+            if entry.state not in (READY, SHADOW, ACTIVE):
+                raise ModelStateError(f"Model {version} is {entry.state}, not ready")
+            previous = self._active
+            if previous is entry:
+                return entry
+            if self._shadow is entry:
+                self._shadow = None
+                self._shadow_percent = 0.0
+            if previous is not None:
+                previous.state = READY
+            entry.state = ACTIVE
+            self._active = entry
+            self.promotions += 1
+        logger.info(f"Promoted model {version}" + (f" (was {previous.version})" if previous else ""))
+        return entry
+
+    def set_shadow(self, version: str, percent: float) -> ModelVersion:
+        """Mirror `percent` of requests to a ready version; 0 stops mirroring"""
+        percent = min(100.0, max(0.0, percent))
+        with self._lock:
+            entry = self._versions.get(version)
+            if entry is None:
+                raise KeyError(version)
+            if entry is self._active:
+                raise ModelStateError(f"Model {version} is active and cannot shadow itself")
+            if entry.state not in (READY, SHADOW):
+                raise ModelStateError(f"Model {version} is {entry.state}, not ready")
+            if self._shadow is not None and self._shadow is not entry:
+                self._shadow.state = READY
+            if percent > 0:
+                entry.state = SHADOW
+                self._shadow = entry
+                self._shadow_percent = percent
+            else:
+                entry.state = READY
+                self._shadow = None
+                self._shadow_percent = 0.0
+        logger.info(f"Model {version} shadows {percent:.1f}% of requests")
+        return entry
+
+    def unload(self, version: str):
+        """Remove a version that is not active; its scheduler stops once in-flight requests finish"""
+        with self._lock:
+            entry = self._versions.get(version)
+            if entry is None:
+                raise KeyError(version)
+            if entry is self._active:
+                raise ModelStateError(f"Model {version} is active; promote another version first")
+            if entry.state == LOADING:
+                raise ModelStateError(f"Model {version} is still loading")
+            self._retire(entry)
+
+    def infer(self, image: np.ndarray) -> Tuple[np.ndarray, str]:
+        """Prediction row and version id from the active model, mirroring to the shadow if selected"""
+        with self._lock:
+            primary = self._active
+            if primary is None:
+                raise RuntimeError("No active model version")
+            primary.in_flight += 1
+            primary.requests += 1
+            shadow = self._shadow
+            if shadow is not None and random.random() * 100 < self._shadow_percent:
+                if shadow.scheduler.queue_depth() >= self.shadow_max_queue:
+                    # The shadow is falling behind; mirroring more would only slow the host down
+                    shadow.skipped += 1
+                    shadow = None
+                else:
+                    shadow.in_flight += 1
+            else:
+                shadow = None
+
+        # Submitted first so both models see the request at the same time
+        mirrored = self._mirror(shadow, image) if shadow is not None else None
+        started = time.perf_counter()
+        prediction = None
+        try:
+            prediction = primary.scheduler.infer(image)
+        finally:
+            self._release(primary)
+            if mirrored is not None:
+                # Also when the primary failed, so the shadow's in-flight count is released
+                mirrored(prediction)
+        elapsed = time.perf_counter() - started
+        primary.latency.record(elapsed)
+        metrics.model_inference_duration_seconds.observe(elapsed, version=primary.version, role="primary")
+        return prediction, primary.version
+
+    def _mirror(self, shadow: ModelVersion, image: np.ndarray):
+        """
+        Submit to the shadow; returns a function that compares its result with the primary's once
+        known, or only releases the shadow when called with None because the primary failed
+        """
+        started = time.perf_counter()
+        try:
+            future = shadow.scheduler.submit(image)
+        except Exception:
+            with self._lock:
+                shadow.mirrored += 1
+                shadow.shadow_errors += 1
+            self._release(shadow)
+            return None
+
+        def compare(primary_prediction):
+            def done(finished):
+                if primary_prediction is None:
+                    self._release(shadow)
+                    return
+                try:
+                    prediction = finished.result()
+                    elapsed = time.perf_counter() - started
+                    shadow.latency.record(elapsed)
+                    metrics.model_inference_duration_seconds.observe(elapsed, version=shadow.version, role="shadow")
+                    outcome = "agree" if np.argmax(prediction) == np.argmax(primary_prediction) else "disagree"
+                except Exception:
+                    outcome = "error"
+                with self._lock:
+                    shadow.mirrored += 1
+                    shadow.agreed += outcome == "agree"
+                    shadow.shadow_errors += outcome == "error"
+                metrics.shadow_predictions_total.inc(version=shadow.version, outcome=outcome)
+                self._release(shadow)
+            future.add_done_callback(done)
+        return compare
+
+    def _reserve(self, version: str, path: str) -> ModelVersion:
+        existing = self._versions.get(version)
+        if existing is not None and existing.state != FAILED:
+            raise ModelStateError(f"Model {version} is already loaded")
+        loaded = [entry for entry in self._versions.values() if entry.state != FAILED]
+        if len(loaded) >= self.max_loaded:
+            # Make room by dropping the standby that was loaded first
+            standby = [entry for entry in loaded if entry.state == READY]
+            if not standby:
+                raise ModelStateError(f"{len(loaded)} models are loaded and none is a standby to unload")
+            self._retire(standby[0])
+        entry = ModelVersion(version, path)
+        self._versions[version] = entry
+        return entry
+
+    def _start(self, entry: ModelVersion, session):
+        entry.scheduler = InferenceScheduler(session, max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms)
+        entry.loaded_at = time.time()
+
+    def _retire(self, entry: ModelVersion):
+        """Called with the lock held"""
+        if entry is self._shadow:
+            self._shadow = None
+            self._shadow_percent = 0.0
+        entry.state = RETIRED
+        self._versions.pop(entry.version, None)
+        if entry.in_flight == 0:
+            self._close(entry)
+        logger.info(f"Unloaded model {entry.version}")
+
+    def _release(self, entry: ModelVersion):
+        with self._lock:
+            entry.in_flight -= 1
+            closing = entry.state == RETIRED and entry.in_flight == 0
+        if closing:
+            self._close(entry)
+
+    @staticmethod
+    def _close(entry: ModelVersion):
+        scheduler, entry.scheduler = entry.scheduler, None
+        if scheduler is not None:
+            # May be called from a scheduler's own callback thread, which cannot join itself
+            threading.Thread(target=scheduler.close, name=f"model-close-{entry.version}", daemon=True).start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            versions = list(self._versions.values())
+            active = self._active
+            shadow = self._shadow
+            percent = self._shadow_percent
+        return {
+            "active": active.version if active is not None else None,
+            "shadow": shadow.version if shadow is not None else None,
+            "shadow_percent": percent,
+            "promotions": self.promotions,
+            "versions": [entry.get_stats() for entry in versions],
+        }
+
+
+model_registry = ModelRegistry(
+    max_batch_size=int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '8')),
+    max_wait_ms=float(os.getenv('INFERENCE_MAX_WAIT_MS', '5')),
+    warmup_runs=int(os.getenv('MODEL_WARMUP_RUNS', '3')),
+    max_loaded=int(os.getenv('MODEL_REGISTRY_MAX_LOADED', '3')),
+    shadow_max_queue=int(os.getenv('MODEL_SHADOW_MAX_QUEUE', '32')),
+)
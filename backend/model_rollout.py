@@ -0,0 +1,264 @@
+"""
+Model rollout state shared by all server processes.
+
+Each gunicorn worker has its own ModelRegistry, so a /models call only
+reaches the worker that handled it. That worker applies the change to its
+registry and records the resulting desired state (the versions to keep
+loaded, which one is active and which shadows how much traffic) in a small
+SQLite database in WAL mode. Every worker checks the database's generation
+every MODEL_ROLLOUT_POLL_SECONDS and brings its own registry in line:
+missing versions are loaded and warmed up in the background, the active and
+shadow versions are switched once they are ready locally, and versions no
+longer wanted are unloaded. Until then the worker keeps serving what it has.
+
+MODEL_ROLLOUT_DB names the database; gunicorn_conf.py sets one per server
+when it starts several workers. Without it the registry is local to the
+process, and model changes are refused while more than one worker runs.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from model_registry import ModelRegistry, ModelStateError, ModelVersion, model_registry, ACTIVE, FAILED, LOADING, READY, SHADOW
+from skin_detection_model import load_model_version
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("model_rollout")
+
+ACTIVE_ROLE = "active"
+SHADOW_ROLE = "shadow"
+STANDBY_ROLE = "standby"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollout (
+    version TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    role TEXT NOT NULL,
+    shadow_percent REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollout_generation (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    generation INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO rollout_generation (id, generation) VALUES (0, 0);
+"""
+
+# version -> (path, role, shadow percent)
+DesiredState = Dict[str, Tuple[str, str, float]]
+
+
+class ModelRollout:
+    def __init__(self, registry: ModelRegistry, load_version: Callable[..., ModelVersion], path: Optional[str] = None,
+                 poll_seconds: float = 2.0, workers: int = 1, busy_timeout_ms: int = 5000):
+        self.registry = registry
+        self.load_version = load_version
+        self.path = path
+        self.poll_seconds = max(0.1, poll_seconds)
+        self.workers = max(1, workers)
+        self.busy_timeout_ms = max(0, busy_timeout_ms)
+        self._connections = threading.local()
+        self._generation = -1
+        self._desired: DesiredState = {}
+        self._sync_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.syncs = 0
+
+    @property
+    def shared(self) -> bool:
+        return bool(self.path)
+
+    @property
+    def changes_allowed(self) -> bool:
+        """A change through one worker only reaches the others through the shared database"""
+        return self.shared or self.workers == 1
+
+    def _database(self) -> sqlite3.Connection:
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000.0, isolation_level=None)
+            connection.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(SCHEMA)
+            self._connections.connection = connection
+        return connection
+
+    def _snapshot(self) -> DesiredState:
+        """This process's registry as a desired state"""
+        stats = self.registry.get_stats()
+        snapshot = {}
+        for entry in stats["versions"]:
+            if entry["state"] == FAILED:
+                continue
+            role = {ACTIVE: ACTIVE_ROLE, SHADOW: SHADOW_ROLE}.get(entry["state"], STANDBY_ROLE)
+            path = self.registry.get(entry["version"]).path
+            snapshot[entry["version"]] = (path, role, stats["shadow_percent"] if role == SHADOW_ROLE else 0.0)
+        return snapshot
+
+    def _change(self, apply: Callable[[], Any], record: Callable[[DesiredState], None]):
+        """Apply a change to this process's registry, then record it for the other workers"""
+        if not self.changes_allowed:
+            raise ModelStateError(f"{self.workers} workers are running and MODEL_ROLLOUT_DB is not set; "
+                                  "a model change would only reach one of them")
+        before = self._snapshot()
+        result = apply()
+        if not self.shared:
+            return result
+        after = set(self.registry.states())
+        database = self._database()
+        database.execute("BEGIN IMMEDIATE")
+        try:
+            desired = {row[0]: (row[1], row[2], row[3]) for row in database.execute(
+                "SELECT version, path, role, shadow_percent FROM rollout")}
+            # The first change starts from the state this worker served before it
+            desired = desired or before
+            # Versions this worker just unloaded to make room are dropped everywhere
+            for version in set(before) - after:
+                desired.pop(version, None)
+            record(desired)
+            database.execute("DELETE FROM rollout")
+            database.executemany("INSERT INTO rollout (version, path, role, shadow_percent) VALUES (?, ?, ?, ?)",
+                                 [(version, *values) for version, values in desired.items()])
+            database.execute("UPDATE rollout_generation SET generation = generation + 1")
+            database.execute("COMMIT")
+        except BaseException:
+            database.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _assign(desired: DesiredState, version: str, path: str, role: str, percent: float = 0.0):
+        """Give a version a role, moving the version that had it to standby"""
+        if role != STANDBY_ROLE:
+            for other, (other_path, other_role, _) in list(desired.items()):
+                if other_role == role and other != version:
+                    desired[other] = (other_path, STANDBY_ROLE, 0.0)
+        desired[version] = (path, role, percent)
+
+    def load(self, version: str, path: str, activate: bool = False,
+             shadow_percent: Optional[float] = None) -> ModelVersion:
+        def record(desired):
+            if activate:
+                self._assign(desired, version, path, ACTIVE_ROLE)
+            elif shadow_percent:
+                self._assign(desired, version, path, SHADOW_ROLE, shadow_percent)
+            else:
+                self._assign(desired, version, path, STANDBY_ROLE)
+        return self._change(
+            lambda: self.load_version(path, version, activate=activate, shadow_percent=shadow_percent), record)
+
+    def promote(self, version: str) -> ModelVersion:
+        def record(desired):
+            self._assign(desired, version, self.registry.get(version).path, ACTIVE_ROLE)
+        return self._change(lambda: self.registry.promote(version), record)
+
+    def set_shadow(self, version: str, percent: float) -> ModelVersion:
+        def record(desired):
+            role = SHADOW_ROLE if percent > 0 else STANDBY_ROLE
+            self._assign(desired, version, self.registry.get(version).path, role, min(100.0, percent))
+        return self._change(lambda: self.registry.set_shadow(version, percent), record)
+
+    def unload(self, version: str):
+        return self._change(lambda: self.registry.unload(version), lambda desired: desired.pop(version, None))
+
+    def sync(self):
+        """Bring this process's registry in line with the shared desired state"""
+        if not self.shared:
+            return
+        with self._sync_lock:
+            database = self._database()
+            generation = database.execute("SELECT generation FROM rollout_generation").fetchone()[0]
+            if generation != self._generation:
+                self._desired = {row[0]: (row[1], row[2], row[3]) for row in database.execute(
+                    "SELECT version, path, role, shadow_percent FROM rollout")}
+                self._generation = generation
+            self.syncs += 1
+            if self._desired:
+                self._reconcile(self._desired)
+
+    def _reconcile(self, desired: DesiredState):
+        registry = self.registry
+        states = registry.states()
+        for version, (path, _, _) in desired.items():
+            if version not in states:
+                # A version that failed here stays failed until it is loaded again under another id
+                try:
+                    self.load_version(path, version)
+                except (ModelStateError, OSError) as e:
+                    logger.warning(f"Could not load model {version} for the rollout: {e}")
+
+        states = registry.states()
+        ready = (READY, SHADOW, ACTIVE)
+        for version, (_, role, percent) in desired.items():
+            if states.get(version) not in ready:
+                continue
+            if role == ACTIVE_ROLE and states[version] != ACTIVE:
+                registry.promote(version)
+            elif role == SHADOW_ROLE and (registry.shadow is None or registry.shadow.version != version
+                                          or registry.shadow_percent != percent):
+                registry.set_shadow(version, percent)
+            elif role == STANDBY_ROLE and states[version] == SHADOW:
+                registry.set_shadow(version, 0)
+
+        for version, state in registry.states().items():
+            active = registry.active
+            if version not in desired and (active is None or active.version != version) and state != LOADING:
+                registry.unload(version)
+
+    def converged(self) -> bool:
+        states = self.registry.states()
+        expected = {ACTIVE_ROLE: ACTIVE, SHADOW_ROLE: SHADOW, STANDBY_ROLE: READY}
+        return (set(states) <= set(self._desired) and
+                all(states.get(version) == expected[role] for version, (_, role, _) in self._desired.items()))
+
+    def start(self, path: Optional[str] = None, workers: Optional[int] = None):
+        """
+        Start polling the shared state; a no-op without a database. path and workers default to
+        MODEL_ROLLOUT_DB and WEB_CONCURRENCY, read here rather than at import because gunicorn
+        sets them after the app has been preloaded.
+        """
+        if self.path is None:
+            self.path = path or os.getenv('MODEL_ROLLOUT_DB') or None
+        self.workers = max(1, workers or int(os.getenv('WEB_CONCURRENCY') or self.workers))
+        if not self.shared or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, name="model-rollout", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _poll(self):
+        while True:
+            try:
+                self.sync()
+            except (sqlite3.Error, ModelStateError, KeyError) as e:
+                logger.warning(f"Model rollout sync failed: {type(e).__name__}: {e}")
+            if self._stop.wait(self.poll_seconds):
+                return
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "shared": self.shared,
+            "workers": self.workers,
+            "generation": self._generation if self.shared else None,
+            "converged": self.converged() if self._desired else True,
+            "syncs": self.syncs,
+        }
+
+
+model_rollout = ModelRollout(
+    model_registry,
+    load_model_version,
+    poll_seconds=float(os.getenv('MODEL_ROLLOUT_POLL_SECONDS', '2')),
+)
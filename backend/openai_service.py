@@ -1,12 +1,21 @@
+import asyncio
 import requests
+import httpx
 import json
-from typing import Dict, Any
+import time
+from typing import Dict, Any, AsyncIterator, Optional, Tuple
 import os
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from analysis_cache import AnalysisCache, SECTIONS, is_valid_analysis
+from latency_tracker import LatencyTracker
+from structured_logging import get_logger
 
 # Load environment variables
 load_dotenv()
 
+logger = get_logger("openai_service")
+
 class OpenAIService:
     def __init__(self):
         # Load API key from environment variable - no fallback for security
@@ -14,30 +23,97 @@ class OpenAIService:
         self.base_url = os.getenv('OPENAI_BASE_URL', 'https://openrouter.ai/api/v1')
         self.model = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
         
+        # "async" uses a pooled httpx.AsyncClient on the event loop; "sync" uses a pooled requests.Session
+        self.client_mode = os.getenv('OPENAI_CLIENT_MODE', 'sync').strip().lower()
+        self.max_connections = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+        self.max_keepalive_connections = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '10'))
+        self.keepalive_expiry = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '30'))
+        self.connect_timeout = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+        # Total time allowed for one completion request, including connection setup
+        self.request_deadline = float(os.getenv('OPENAI_REQUEST_DEADLINE', '30'))
+        
+        # Generated analyses are cached per (model, condition, confidence band)
+        self.analysis_cache = AnalysisCache(
+            bucket_width=float(os.getenv('ANALYSIS_CACHE_BUCKET_WIDTH', '0.1')),
+            max_entries=int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '1024')),
+            precomputed_path=os.getenv(
+                'ANALYSIS_CACHE_FILE', os.path.join(os.path.dirname(__file__), 'precomputed_analyses.json')
+            ),
+        )
+        
+        # Successful completion latencies; the enrichment timeout adapts to their percentile
+        self.latency_tracker = LatencyTracker(
+            window=int(os.getenv('LLM_LATENCY_WINDOW', '200')),
+            percentile=float(os.getenv('LLM_TIMEOUT_PERCENTILE', '95')),
+            multiplier=float(os.getenv('LLM_TIMEOUT_MULTIPLIER', '1.5')),
+            min_timeout=float(os.getenv('LLM_MIN_TIMEOUT_MS', '500')) / 1000.0,
+            max_timeout=self.request_deadline,
+        )
+        
+        self._session: Optional[requests.Session] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_client_loop = None
+        
         # Validate that API key is configured
         if not self.api_key:
-            print("WARNING: OPENAI_API_KEY environment variable is not set!")
-            print("Please set the OPENAI_API_KEY in your .env file or environment variables.")
+            logger.warning("OPENAI_API_KEY environment variable is not set! "
+                           "Please set the OPENAI_API_KEY in your .env file or environment variables.")
             
         # Don't log the API key, even partially for security
-        print(f"OpenAI Service initialized with model: {self.model}")
-        print(f"OpenAI Base URL: {self.base_url}")
+        logger.info("OpenAI Service initialized", extra={"fields": {
+            "model": self.model, "base_url": self.base_url, "client_mode": self.client_mode
+        }})
         
     def _is_configured(self) -> bool:
         """Check if the OpenAI service is properly configured"""
         return bool(self.api_key and self.api_key.strip())
-        
-    def generate_detailed_analysis(self, condition: str, confidence: float, basic_advice: str) -> Dict[str, str]:
-        """
-        Generate detailed analysis sections for the results screen
-        """
-        # Check if OpenAI is properly configured
-        if not self._is_configured():
-            print("OpenAI API key not configured, returning fallback response")
-            return self._get_fallback_response(condition, basic_advice, confidence)
-            
-        try:
-            prompt = f"""
+    
+    @property
+    def async_mode(self) -> bool:
+        return self.client_mode == 'async'
+    
+    def enrichment_timeout(self) -> float:
+        """How long a request should wait for an analysis, from recent provider latency"""
+        return min(self.request_deadline, self.latency_tracker.timeout())
+    
+    def _get_session(self) -> requests.Session:
+        """Persistent keep-alive session for the sync client mode"""
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Persistent connection pool for the async client mode, bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.request_deadline, connect=self.connect_timeout),
+            )
+            self._async_client_loop = loop
+        return self._async_client
+    
+    async def aclose(self):
+        """Close pooled connections"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_client_loop = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+    
+    def _build_request(self, condition: str, confidence: float, basic_advice: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """Build the chat completion URL, headers and payload for a detected condition"""
+        prompt = f"""
 You are a medical AI assistant providing detailed educational information about skin conditions. 
 Based on the detected condition "{condition}" with {confidence*100:.1f}% confidence, provide comprehensive information for each section below.
 
@@ -60,59 +136,224 @@ Basic advice from initial analysis: {basic_advice}
 Format your response as a JSON object with keys: overview, detection_details, recommendations, important_notes, next_steps
 """
 
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": self.model,
-                "messages": [
-                    {
-                        "role": "system", 
-                        "content": "You are a medical AI assistant providing educational information about skin conditions. Always emphasize that AI analysis is not a substitute for professional medical diagnosis and care."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                "max_tokens": 2000,
-                "temperature": 0.3
-            }
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        data = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system", 
+                    "content": "You are a medical AI assistant providing educational information about skin conditions. Always emphasize that AI analysis is not a substitute for professional medical diagnosis and care."
+                },
+                {
+                    "role": "user", 
+                    "content": prompt
+                }
+            ],
+            "max_tokens": 2000,
+            "temperature": 0.3
+        }
+        
+        return f"{self.base_url}/chat/completions", headers, data
+    
+    def _parse_completion(self, result: Dict[str, Any], condition: str, basic_advice: str, confidence: float) -> Optional[Dict[str, str]]:
+        """Extract the analysis sections from a chat completion response body"""
+        return self._parse_content(result['choices'][0]['message']['content'], condition, basic_advice, confidence)
+    
+    def _parse_content(self, content: str, condition: str, basic_advice: str, confidence: float) -> Optional[Dict[str, str]]:
+        """
+        Turn the model's message text into the analysis sections; None for JSON of the wrong
+        shape, which must not be cached
+        """
+        # Try to parse as JSON
+        try:
+            parsed = json.loads(content)
+        except json.JSONDecodeError:
+            # If JSON parsing fails, create structured response from text
+            return self._parse_text_response(content, condition, basic_advice, confidence)
+        if not is_valid_analysis(parsed):
+            logger.warning("OpenAI API returned JSON without the analysis sections")
+            return None
+        return {section: parsed[section] for section in SECTIONS}
+        
+    def cached_detailed_analysis(self, condition: str, confidence: float) -> Optional[Dict[str, str]]:
+        """The cached or precomputed analysis for this condition and confidence band, or None"""
+        return self.analysis_cache.get(self.analysis_cache.make_key(condition, confidence, self.model))
+    
+    def requires_provider_call(self, condition: str, confidence: float) -> bool:
+        """Whether an analysis for this condition and confidence would call the provider"""
+        if not self._is_configured():
+            return False
+        return self.cached_detailed_analysis(condition, confidence) is None
+    
+    def generate_detailed_analysis(self, condition: str, confidence: float, basic_advice: str) -> Dict[str, str]:
+        """
+        Generate detailed analysis sections for the results screen
+        """
+        # Check if OpenAI is properly configured
+        if not self._is_configured():
+            logger.debug("OpenAI API key not configured, returning fallback response")
+            return self._get_fallback_response(condition, basic_advice, confidence)
+        
+        # Analyses are shared by every request in the same confidence band
+        key = self.analysis_cache.make_key(condition, confidence, self.model)
+        band_confidence = self.analysis_cache.bucket_confidence(confidence)
+        analysis = self.analysis_cache.get_or_compute(
+            key, lambda: self._request_analysis(condition, band_confidence, basic_advice)
+        )
+        return analysis or self._get_fallback_response(condition, basic_advice, confidence)
+    
+    async def agenerate_detailed_analysis(self, condition: str, confidence: float, basic_advice: str) -> Dict[str, str]:
+        """
+        Async variant of generate_detailed_analysis using the pooled keep-alive client
+        """
+        if not self._is_configured():
+            logger.debug("OpenAI API key not configured, returning fallback response")
+            return self._get_fallback_response(condition, basic_advice, confidence)
+        
+        key = self.analysis_cache.make_key(condition, confidence, self.model)
+        band_confidence = self.analysis_cache.bucket_confidence(confidence)
+        analysis = await self.analysis_cache.aget_or_compute(
+            key, lambda: self._arequest_analysis(condition, band_confidence, basic_advice)
+        )
+        return analysis or self._get_fallback_response(condition, basic_advice, confidence)
+    
+    def _request_analysis(self, condition: str, confidence: float, basic_advice: str) -> Optional[Dict[str, str]]:
+        """
+        Call the chat completions API; returns None when no analysis could be generated
+        """
+        try:
+            url, headers, data = self._build_request(condition, confidence, basic_advice)
             
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
+            started = time.perf_counter()
+            response = self._get_session().post(
+                url,
                 headers=headers,
                 json=data,
-                timeout=30
+                timeout=(self.connect_timeout, self.request_deadline)
             )
             
             if response.status_code == 200:
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                
-                # Try to parse as JSON
-                try:
-                    return json.loads(content)
-                except json.JSONDecodeError:
-                    # If JSON parsing fails, create structured response from text
-                    return self._parse_text_response(content, condition, basic_advice, confidence)
+                self.latency_tracker.record(time.perf_counter() - started)
+                return self._parse_completion(response.json(), condition, basic_advice, confidence)
             else:
-                print(f"OpenAI API error: {response.status_code}")
+                logger.warning("OpenAI API error", extra={"fields": {"status": response.status_code}})
                 # Don't log the full response as it might contain sensitive info
-                return self._get_fallback_response(condition, basic_advice, confidence)
+                return None
                 
         except requests.exceptions.Timeout:
-            print("OpenAI API request timed out")
-            return self._get_fallback_response(condition, basic_advice, confidence)
+            logger.warning("OpenAI API request timed out")
+            return None
         except requests.exceptions.ConnectionError:
-            print("Failed to connect to OpenAI API")
-            return self._get_fallback_response(condition, basic_advice, confidence)
+            logger.warning("Failed to connect to OpenAI API")
+            return None
         except Exception as e:
-            print(f"Error generating detailed analysis: {type(e).__name__}")
+            logger.warning(f"Error generating detailed analysis: {type(e).__name__}")
             # Don't log the full error message as it might contain sensitive info
-            return self._get_fallback_response(condition, basic_advice, confidence)
+            return None
+    
+    async def _arequest_analysis(self, condition: str, confidence: float, basic_advice: str) -> Optional[Dict[str, str]]:
+        """
+        Async counterpart of _request_analysis
+        """
+        try:
+            url, headers, data = self._build_request(condition, confidence, basic_advice)
+            
+            # The deadline covers waiting for a pooled connection as well as the request itself
+            started = time.perf_counter()
+            response = await asyncio.wait_for(
+                self._get_async_client().post(url, headers=headers, json=data),
+                timeout=self.request_deadline
+            )
+            
+            if response.status_code == 200:
+                self.latency_tracker.record(time.perf_counter() - started)
+                return self._parse_completion(response.json(), condition, basic_advice, confidence)
+            else:
+                logger.warning("OpenAI API error", extra={"fields": {"status": response.status_code}})
+                return None
+        
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            logger.warning("OpenAI API request timed out")
+            return None
+        except httpx.ConnectError:
+            logger.warning("Failed to connect to OpenAI API")
+            return None
+        except Exception as e:
+            logger.warning(f"Error generating detailed analysis: {type(e).__name__}")
+            return None
+    
+    async def astream_detailed_analysis(self, condition: str, confidence: float, basic_advice: str) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Stream the detailed analysis using the provider's streaming mode.
+        Yields ("token", text) as content arrives, then exactly one ("analysis", sections);
+        the sections are the fallback response if anything goes wrong. A stream started while
+        the same analysis is already being generated waits for it and yields no tokens.
+        """
+        if not self._is_configured():
+            yield "analysis", self._get_fallback_response(condition, basic_advice, confidence)
+            return
+        
+        key = self.analysis_cache.make_key(condition, confidence, self.model)
+        cached, future, is_leader = self.analysis_cache.claim(key)
+        if cached is not None:
+            yield "analysis", cached
+            return
+        if not is_leader:
+            analysis = await asyncio.wrap_future(future)
+            yield "analysis", analysis or self._get_fallback_response(condition, basic_advice, confidence)
+            return
+        
+        band_confidence = self.analysis_cache.bucket_confidence(confidence)
+        content_parts = []
+        analysis = None
+        try:
+            started = time.perf_counter()
+            async for delta in self._astream_content(condition, band_confidence, basic_advice):
+                content_parts.append(delta)
+                yield "token", delta
+            if content_parts:
+                self.latency_tracker.record(time.perf_counter() - started)
+                analysis = self._parse_content("".join(content_parts), condition, basic_advice, band_confidence)
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            logger.warning("OpenAI API request timed out")
+        except httpx.ConnectError:
+            logger.warning("Failed to connect to OpenAI API")
+        except Exception as e:
+            logger.warning(f"Error streaming detailed analysis: {type(e).__name__}")
+        finally:
+            # Also runs when the client disconnects mid-stream, so waiters are never left hanging
+            self.analysis_cache.settle(key, future, analysis)
+        
+        yield "analysis", analysis or self._get_fallback_response(condition, basic_advice, confidence)
+    
+    async def _astream_content(self, condition: str, confidence: float, basic_advice: str) -> AsyncIterator[str]:
+        """Content deltas of a streaming completion; raises on errors and past the deadline"""
+        url, headers, data = self._build_request(condition, confidence, basic_advice)
+        data["stream"] = True
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_deadline
+        async with self._get_async_client().stream("POST", url, headers=headers, json=data) as response:
+            if response.status_code != 200:
+                logger.warning("OpenAI API error", extra={"fields": {"status": response.status_code}})
+                raise RuntimeError("streaming request failed")
+            
+            async for line in response.aiter_lines():
+                if loop.time() > deadline:
+                    raise asyncio.TimeoutError()
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                choices = json.loads(payload).get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
     
     def _parse_text_response(self, content: str, condition: str, basic_advice: str, confidence: float) -> Dict[str, str]:
         """
@@ -154,6 +395,10 @@ Format your response as a JSON object with keys: overview, detection_details, re
         
         return sections
     
+    def is_fallback_response(self, analysis: Dict[str, str], condition: str, basic_advice: str, confidence: float = 0.0) -> bool:
+        """Check whether an analysis is the canned fallback rather than a generated one"""
+        return analysis == self._get_fallback_response(condition, basic_advice, confidence)
+    
     def _get_fallback_response(self, condition: str, basic_advice: str, confidence: float = 0.0) -> Dict[str, str]:
         """
         Provide fallback response when OpenAI API is unavailable
@@ -0,0 +1,113 @@
+"""
+Image decode and preprocessing for the ONNX model.
+
+The model only needs a 256x256x3 tensor, so large JPEGs are decoded at a
+reduced scale (libjpeg DCT scaling via PIL's draft mode) and resized straight
+to 256x256 uint8. The conversion to float32 happens once, when the inference
+scheduler copies the image into its preallocated batch buffer.
+
+Dimensions are checked from the image header before any pixel data is
+decoded: MAX_IMAGE_PIXELS caps the declared size (decompression bombs), and
+MAX_DECODE_PIXELS caps what is actually decoded after reduced-scale decoding,
+which bounds the memory a single upload can take.
+"""
+
+import os
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+INPUT_SIZE = 256
+
+# MPO is the multi-picture JPEG many phone cameras write
+DRAFT_FORMATS = ('JPEG', 'MPO')
+
+
+class ImageTooLarge(ValueError):
+    """The image's dimensions exceed the configured decode limits"""
+
+
+def _draft_enabled() -> bool:
+    return os.getenv('DECODE_DRAFT_ENABLED', 'true').lower() == 'true'
+
+
+def _max_image_pixels() -> int:
+    return int(os.getenv('MAX_IMAGE_PIXELS', str(100_000_000)))
+
+
+def _max_decode_pixels() -> int:
+    return int(os.getenv('MAX_DECODE_PIXELS', str(4096 * 4096)))
+
+
+def decode_image(image_bytes, target_size=INPUT_SIZE, use_draft=None):
+    """
+    Decode uploaded image bytes into a (target_size, target_size, 3) uint8 RGB array
+    """
+    return preprocess_image(load_rgb(image_bytes, target_size, use_draft), target_size)
+
+
+def decode_image_timed(image_bytes, target_size=INPUT_SIZE, use_draft=None):
+    """
+    decode_image that also returns the decode and preprocess durations in milliseconds,
+    measured where the work runs (possibly a worker process), and the uploaded image's
+    (width, height) before any scaling
+    """
+    started = time.perf_counter_ns()
+    rgb, source_size = _load_rgb(image_bytes, target_size, use_draft)
+    decoded = time.perf_counter_ns()
+    img_array = preprocess_image(rgb, target_size)
+    return img_array, (decoded - started) / 1e6, (time.perf_counter_ns() - decoded) / 1e6, source_size
+
+
+def load_rgb(image_bytes, target_size=INPUT_SIZE, use_draft=None):
+    """
+    Decode image bytes into an RGB array, at reduced scale for large JPEGs.
+    Raises ImageTooLarge, before decoding any pixels, when the image exceeds the limits.
+    """
+    return _load_rgb(image_bytes, target_size, use_draft)[0]
+
+
+def _load_rgb(image_bytes, target_size, use_draft):
+    # Only the header is read here; pixels are decoded by convert()/asarray below
+    try:
+        pil_image = Image.open(BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+
+    source_size = width, height = pil_image.size
+    if width * height > _max_image_pixels():
+        raise ImageTooLarge(f"Image is {width}x{height} pixels; at most {_max_image_pixels()} pixels are accepted")
+
+    if use_draft is None:
+        use_draft = _draft_enabled()
+    # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale while both sides stay >= target_size
+    if use_draft and pil_image.format in DRAFT_FORMATS and min(pil_image.size) >= 2 * target_size:
+        pil_image.draft('RGB', (target_size, target_size))
+
+    # Size after draft(): formats without reduced-scale decoding are decoded in full
+    width, height = pil_image.size
+    if width * height > _max_decode_pixels():
+        raise ImageTooLarge(
+            f"Image would decode to {width}x{height} pixels; at most {_max_decode_pixels()} pixels are decoded"
+        )
+
+    # Convert to RGB if necessary
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+
+    return np.asarray(pil_image), source_size
+
+
+def preprocess_image(img_array, target_size=INPUT_SIZE, out=None):
+    """
+    Resize an RGB array to the model's input size. Arrays that are already the
+    right size are returned as-is; `out` may be a preallocated destination.
+    """
+    if img_array.shape[:2] == (target_size, target_size) and out is None:
+        return img_array
+    if out is None:
+        out = np.empty((target_size, target_size, 3), dtype=np.uint8)
+    return cv2.resize(img_array, (target_size, target_size), dst=out)
@@ -0,0 +1,63 @@
+"""
+Memory and CPU usage of server processes, read from /proc (Linux only).
+
+Reported for the current worker under `process` in GET /stats, and for every
+gunicorn worker by benchmark_workers.py. PSS divides shared pages (such as a
+model preloaded before forking) between the processes that map them, so the
+PSS of all workers adds up to their real footprint; RSS counts them in full.
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+_SMAPS_FIELDS = {
+    "Rss": "rss_mb",
+    "Pss": "pss_mb",
+    "Shared_Clean": "shared_mb",
+    "Shared_Dirty": "shared_mb",
+    "Private_Clean": "private_mb",
+    "Private_Dirty": "private_mb",
+}
+
+
+def memory_usage(pid="self") -> Optional[Dict[str, float]]:
+    """RSS, PSS, shared and private memory of a process in MB; None where /proc is unavailable"""
+    usage = {name: 0.0 for name in _SMAPS_FIELDS.values()}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            for line in file:
+                parts = line.split()
+                name = _SMAPS_FIELDS.get(parts[0].rstrip(":"))
+                if name is not None:
+                    usage[name] += int(parts[1]) / 1024
+    except OSError:
+        return None
+    return usage
+
+
+def cpu_seconds(pid="self") -> Optional[float]:
+    """User plus system CPU time the process has used"""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # Fields after the parenthesised command name; utime and stime are the 14th and 15th
+            fields = file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def child_pids(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as file:
+            return [int(child) for child in file.read().split()]
+    except OSError:
+        return []
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        "pid": os.getpid(),
+        "cpu_affinity": sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+        "cpu_seconds": cpu_seconds(),
+        "memory_mb": memory_usage(),
+    }
@@ -0,0 +1,198 @@
+"""
+Content-addressed cache for detection results.
+
+Entries are keyed by a SHA-256 digest of the uploaded bytes plus the model
+version, so byte-identical re-submissions skip decode, inference and the LLM
+round-trip. A bounded in-memory LRU tier sits in front of an optional
+on-disk tier (one JSON file per entry) that survives restarts.
+
+The disk tier never runs on the event loop: aget() reads it on a thread,
+and put() hands the write to a single background writer thread, which also
+drops the oldest 10% of entries when the tier goes over its bound (so the
+directory is scanned once per disk_max_entries / 10 new entries).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("result_cache")
+
+
+class DetectionCache:
+    def __init__(self, max_entries: int = 1024, disk_dir: Optional[str] = None, disk_max_entries: int = 100000):
+        self.max_entries = max(0, max_entries)
+        self.disk_dir = disk_dir
+        self.disk_max_entries = max(1, disk_max_entries)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._disk_entries = 0
+        self._disk_writer: Optional[ThreadPoolExecutor] = None
+        self._trim_pending = False
+
+        if self.disk_dir:
+            self._disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-cache-disk")
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_entries = sum(1 for name in os.listdir(self.disk_dir) if name.endswith('.json'))
+
+    @staticmethod
+    def digest(image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    @staticmethod
+    def key_for(digest: str, model_version: str) -> str:
+        return f"{model_version}:{digest}"
+
+    @classmethod
+    def make_key(cls, image_bytes: bytes, model_version: str) -> str:
+        """Cache key for an upload: model version plus digest of the raw bytes"""
+        return cls.key_for(cls.digest(image_bytes), model_version)
+
+    def _disk_path(self, key: str) -> str:
+        # Model versions may contain characters that are not valid in file names
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up both tiers on the calling thread; use aget() on the event loop"""
+        value = self._get_memory(key)
+        if value is None and self.disk_dir:
+            value = self._get_disk(key)
+        if value is None:
+            self._count_miss()
+        return value
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """get() for the event loop: a memory miss reads the disk tier on a thread"""
+        value = self._get_memory(key)
+        if value is None and self.disk_dir:
+            value = await asyncio.to_thread(self._get_disk, key)
+        if value is None:
+            self._count_miss()
+        return value
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._memory_hits += 1
+            return value
+
+    def _get_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._disk_path(key), 'r') as file:
+                value = json.load(file)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._disk_hits += 1
+        self._put_memory(key, value)
+        return value
+
+    def _count_miss(self):
+        with self._lock:
+            self._misses += 1
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Store in memory now; the disk write happens on the writer thread"""
+        self._put_memory(key, value)
+        if self._disk_writer is not None:
+            self._disk_writer.submit(self._put_disk, key, value)
+
+    def flush(self):
+        """Wait until the disk writes queued so far, and any trim they started, are done"""
+        while self._disk_writer is not None:
+            self._disk_writer.submit(lambda: None).result()
+            with self._lock:
+                if not self._trim_pending:
+                    return
+
+    def _put_memory(self, key: str, value: Dict[str, Any]):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _put_disk(self, key: str, value: Dict[str, Any]):
+        path = self._disk_path(key)
+        try:
+            is_new = not os.path.exists(path)
+            # Write to a temp file and rename so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as file:
+                json.dump(value, file)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to write result cache entry: {type(e).__name__}")
+            return
+
+        if is_new:
+            with self._lock:
+                self._disk_entries += 1
+                trim = self._disk_entries > self.disk_max_entries and not self._trim_pending
+                self._trim_pending = self._trim_pending or trim
+            if trim:
+                # Queued behind the writes already waiting, so they are not held up
+                self._disk_writer.submit(self._trim_disk)
+
+    def _trim_disk(self):
+        """Drop the oldest 10% of disk entries once the disk tier exceeds its bound"""
+        try:
+            paths = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if name.endswith('.json')]
+            paths.sort(key=lambda path: os.path.getmtime(path))
+            excess = len(paths) - self.disk_max_entries
+            to_remove = paths[:max(excess, len(paths) // 10)]
+            for path in to_remove:
+                os.remove(path)
+            with self._lock:
+                self._disk_entries = len(paths) - len(to_remove)
+        except OSError as e:
+            logger.warning(f"Failed to trim result cache: {type(e).__name__}")
+        finally:
+            with self._lock:
+                self._trim_pending = False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_enabled": bool(self.disk_dir),
+                "disk_entries": self._disk_entries,
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+# Global instance
+detection_cache = DetectionCache(
+    max_entries=int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1024')),
+    disk_dir=os.getenv('RESULT_CACHE_DIR') or None,
+    disk_max_entries=int(os.getenv('RESULT_CACHE_DISK_MAX_ENTRIES', '100000')),
+)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Dict, Optional
 
 class DetailedAnalysis(BaseModel):
@@ -8,7 +8,30 @@ class DetailedAnalysis(BaseModel):
     important_notes: str
     next_steps: str
 
+class StageTimings(BaseModel):
+    """Milliseconds spent in each stage of the request; stages that did not run are null"""
+    upload_read: Optional[float] = None
+    cache_lookup: Optional[float] = None
+    decode: Optional[float] = None
+    preprocess: Optional[float] = None
+    quality: Optional[float] = None
+    near_duplicate: Optional[float] = None
+    inference: Optional[float] = None
+    llm: Optional[float] = None
+    serialization: Optional[float] = None
+    total: Optional[float] = None
+
+class QualityReport(BaseModel):
+    """Image-quality screen measurements; `issues` lists the checks that failed"""
+    sharpness: float
+    brightness: float
+    min_side: int
+    skin_ratio: float
+    issues: List[str] = []
+
 class APIOutput(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+    
     disease: str 
     overview: str
     symptoms: List[str]
@@ -16,9 +39,54 @@ class APIOutput(BaseModel):
     treatments: List[str]
     probability: float
     time: str
+    # Registry version that produced the detection; "hosted-api" for the fallback detector
+    model_version: Optional[str] = None
+    # SHA-256 of the uploaded bytes, as stored in the analysis history
+    image_digest: Optional[str] = None
+    quality: Optional[QualityReport] = None
     detailed_analysis: Optional[DetailedAnalysis] = None
+    timings: Optional[StageTimings] = None
 
 class DetectionResponse(BaseModel):
     success: bool
     result: APIOutput
     message: str = ""
+    # Set when the detailed analysis is delivered later via GET /analysis/{job_id}
+    job_id: Optional[str] = None
+
+class AnalysisJobResponse(BaseModel):
+    job_id: str
+    status: str  # pending, running, done or failed
+    detailed_analysis: Optional[DetailedAnalysis] = None
+    error: Optional[str] = None
+
+class ModelLoadRequest(BaseModel):
+    path: str  # ONNX file name inside MODEL_DIR
+    version: Optional[str] = None  # defaults to the file name and content digest
+    activate: bool = False  # promote as soon as it is warmed up
+    shadow_percent: Optional[float] = None  # otherwise mirror this share of requests to it
+
+class BatchItemResult(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    success: bool
+    result: Optional[APIOutput] = None
+    error: Optional[str] = None
+
+class HistoryEntry(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+    
+    id: int
+    created_at: float  # Unix time
+    patient_id: Optional[str] = None
+    image_digest: Optional[str] = None
+    condition: str
+    probability: float
+    model_version: Optional[str] = None
+    endpoint: str
+    result: Optional[Dict] = None
+
+class HistoryPage(BaseModel):
+    items: List[HistoryEntry]
+    # Pass as `cursor` to get the next (older) page; null on the last page
+    next_cursor: Optional[int] = None
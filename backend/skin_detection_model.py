@@ -1,123 +1,304 @@
-import json
+import hashlib
+import threading
 import onnxruntime as rt
-import cv2
 import numpy as np
 import time
 import os
-import requests
 import base64
 from io import BytesIO
 from PIL import Image
 from pathlib import Path
+from model_registry import model_registry, warm_up
+from disease_catalog import disease_catalog
+from preprocessing import preprocess_image
+from structured_logging import get_logger
+from hosted_detector import hosted_detector
 
-# Global variable to hold the model
-model_session = None
+logger = get_logger("skin_detection_model")
 
-def load_model():
-    """Load the ONNX model if not already loaded"""
-    global model_session
-    if model_session is None:
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "VIT23n_quantmodel.onnx")
+HOSTED_API_VERSION = "hosted-api"
+
+# Sessions and schedulers live in model_registry; these describe the bundled model
+model_version = None
+model_ready = False
+_model_lock = threading.Lock()
+# ORT-format model read by the gunicorn master before forking workers (see gunicorn_conf.py)
+shared_model_bytes = None
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': rt.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': rt.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': rt.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': rt.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+def _optimized_model_path(model_path, level_name):
+    """Where the graph-optimized model is cached; the level is part of the name"""
+    default_path = str(Path(model_path).with_suffix(f".{level_name}.optimized.onnx"))
+    if model_path != MODEL_PATH:
+        return default_path
+    return os.getenv('MODEL_OPTIMIZED_PATH', default_path)
+
+def _optimization_level_name():
+    level_name = os.getenv('ORT_GRAPH_OPTIMIZATION_LEVEL', 'extended').strip().lower()
+    if level_name not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"ORT_GRAPH_OPTIMIZATION_LEVEL must be one of {list(GRAPH_OPTIMIZATION_LEVELS)}")
+    return level_name
+
+def _session_options(level):
+    """
+    Session options with the given optimization level and the configured thread counts.
+    ORT_INTRA_OP_THREADS / ORT_INTER_OP_THREADS of 0 keep onnxruntime's default of one
+    thread per core, which oversubscribes the host when several workers run on it.
+    """
+    options = rt.SessionOptions()
+    options.graph_optimization_level = level
+    intra_op_threads = int(os.getenv('ORT_INTRA_OP_THREADS', '0'))
+    inter_op_threads = int(os.getenv('ORT_INTER_OP_THREADS', '0'))
+    if intra_op_threads > 0:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads > 0:
+        options.inter_op_num_threads = inter_op_threads
+    return options
+
+def export_ort_model(model_path, ort_path, level_name):
+    """Save the model, optimized at the given level, in onnxruntime's ORT format"""
+    options = rt.SessionOptions()
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[level_name]
+    # A single thread, so no thread pool is started in a process that is about to fork
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    options.optimized_model_filepath = ort_path + '.tmp'
+    options.add_session_config_entry('session.save_model_format', 'ORT')
+    rt.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+    os.replace(ort_path + '.tmp', ort_path)
+
+def preload_shared_model():
+    """
+    Read the model into memory ahead of forking worker processes, so all workers share its pages.
+    The model is converted once to ORT format (cached next to it), which lets sessions use the
+    weights in place instead of copying them into each worker. Returns the bytes preloaded.
+    """
+    global shared_model_bytes
+    if not os.path.exists(MODEL_PATH):
+        logger.warning(f"Local model file not found at {MODEL_PATH}; nothing to preload")
+        return 0
+    
+    level_name = _optimization_level_name()
+    ort_path = str(Path(MODEL_PATH).with_suffix(f".{level_name}.optimized.ort"))
+    if not os.path.exists(ort_path) or os.path.getmtime(ort_path) < os.path.getmtime(MODEL_PATH):
+        export_ort_model(MODEL_PATH, ort_path, level_name)
+        logger.info(f"Saved ORT-format model to {ort_path}")
+    with open(ort_path, 'rb') as file:
+        shared_model_bytes = file.read()
+    # Hashed once here instead of in every worker
+    get_model_version()
+    return len(shared_model_bytes)
+
+def _create_shared_session():
+    """Session whose initializers point into the preloaded model bytes"""
+    # Optimized when exported; rewriting the graph would copy the weights again
+    options = _session_options(rt.GraphOptimizationLevel.ORT_DISABLE_ALL)
+    options.add_session_config_entry('session.use_ort_model_bytes_directly', '1')
+    options.add_session_config_entry('session.use_ort_model_bytes_for_initializers', '1')
+    # Pre-packed weight copies are private to each worker. Not packing them shares all weights, but
+    # costs kernel speed and crashes onnxruntime 1.16 on some graphs optimized above 'basic'
+    if os.getenv('ORT_DISABLE_PREPACKING', 'false').lower() == 'true':
+        if _optimization_level_name() in ('disable', 'basic'):
+            options.add_session_config_entry('session.disable_prepacking', '1')
+        else:
+            logger.warning("ORT_DISABLE_PREPACKING needs ORT_GRAPH_OPTIMIZATION_LEVEL=basic or disable; ignored")
+    return rt.InferenceSession(shared_model_bytes, sess_options=options, providers=['CPUExecutionProvider'])
+
+def _create_session(model_path):
+    """
+    Create the inference session with graph optimization. The optimized graph is
+    saved next to the model so later starts load it without re-optimizing.
+    """
+    if shared_model_bytes is not None and model_path == MODEL_PATH:
+        session = _create_shared_session()
+        logger.info(f"Created session on the shared preloaded model ({len(shared_model_bytes) / 1e6:.1f} MB)")
+        return session
+    
+    providers = ['CPUExecutionProvider']
+    level_name = _optimization_level_name()
+    
+    cache_path = _optimized_model_path(model_path, level_name) if level_name != 'disable' else None
+    if cache_path and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(model_path):
+        # Already optimized offline; only cheap, always-safe passes are needed
+        options = _session_options(rt.GraphOptimizationLevel.ORT_ENABLE_BASIC)
         try:
-            # Model path - you'll need to download the model file
-            model_path = os.path.join(os.path.dirname(__file__), "VIT23n_quantmodel.onnx")
-            if not os.path.exists(model_path):
-                print(f"Local model file not found at {model_path}")
-                return None
-            
-            providers = ['CPUExecutionProvider']
-            model_session = rt.InferenceSession(model_path, providers=providers)
-            print(f"Model loaded successfully from {model_path}")
+            session = rt.InferenceSession(cache_path, sess_options=options, providers=providers)
+            logger.info(f"Loaded optimized model from cache {cache_path}")
+            return session
         except Exception as e:
-            print(f"Error loading local model: {e}")
-            model_session = None
-    return model_session
+            logger.warning(f"Optimized model cache is unusable, rebuilding: {e}")
+            os.remove(cache_path)
+    
+    options = _session_options(GRAPH_OPTIMIZATION_LEVELS[level_name])
+    if cache_path:
+        # Written during session creation; renamed only once the session is known to be good
+        options.optimized_model_filepath = cache_path + '.tmp'
+    session = rt.InferenceSession(model_path, sess_options=options, providers=providers)
+    if cache_path and os.path.exists(cache_path + '.tmp'):
+        os.replace(cache_path + '.tmp', cache_path)
+        logger.info(f"Saved optimized model to {cache_path}")
+    return session
+
+def load_model():
+    """Create an inference session for the bundled model, or None if it is unavailable"""
+    try:
+        # Model path - you'll need to download the model file
+        model_path = MODEL_PATH
+        if not os.path.exists(model_path):
+            logger.warning(f"Local model file not found at {model_path}")
+            return None
+        
+        session = _create_session(model_path)
+        logger.info(f"Model loaded successfully from {model_path}")
+        return session
+    except Exception as e:
+        logger.error(f"Error loading local model: {e}")
+        return None
 
-def detect_with_hosted_api(img_array):
+def prepare_model(warmup_runs=3):
     """
-    Use the hosted API as fallback when local model is not available
+    Load the model, start the scheduler and run warm-up inferences ahead of the first request.
+    Returns timings for the startup log.
+    """
+    global model_ready
+    report = {"local_model": False, "load_seconds": 0.0, "first_inference_ms": None, "warmup_ms": []}
+    
+    started = time.perf_counter()
+    scheduler = get_scheduler()
+    report["load_seconds"] = time.perf_counter() - started
+    report["model_version"] = get_model_version()
+    
+    if scheduler is not None:
+        report["local_model"] = True
+        report["warmup_ms"] = warm_up(scheduler, warmup_runs)
+        report["first_inference_ms"] = report["warmup_ms"][0]
+        model_registry.active.load_seconds = report["load_seconds"]
+        model_registry.active.warmup_ms = report["warmup_ms"]
+    
+    model_ready = True
+    return report
+
+def model_file_version(model_path):
+    """Version id of a model file: its name and a prefix of its content digest"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return f"{Path(model_path).stem}-{digest.hexdigest()[:12]}"
+
+def get_model_version():
+    """
+    Identify the model that produces detections, for cache keys and responses.
+    This is the active registry version once a local model serves; before that,
+    MODEL_VERSION or the bundled model file's content digest.
+    """
+    global model_version
+    active = model_registry.active
+    if active is not None:
+        return active.version
+    if model_version is None:
+        override = os.getenv('MODEL_VERSION')
+        if override:
+            model_version = override
+        elif os.path.exists(MODEL_PATH):
+            model_version = model_file_version(MODEL_PATH)
+        else:
+            # Not cached: the local model may still be installed later
+            return HOSTED_API_VERSION
+    return model_version
+
+def get_scheduler():
+    """Return the scheduler of the active model version, loading the bundled model on first use"""
+    if model_registry.active is None:
+        with _model_lock:
+            if model_registry.active is None:
+                session = load_model()
+                if session is None:
+                    return None
+                model_registry.register(get_model_version(), MODEL_PATH, session)
+                logger.info(f"Inference scheduler started (max batch {model_registry.max_batch_size}, "
+                            f"max wait {model_registry.max_wait_ms:.1f} ms)")
+    return model_registry.active.scheduler
+
+def load_model_version(model_path, version=None, activate=False, shadow_percent=None, background=True):
+    """
+    Load another model file into the registry next to the serving one, warm it up, and then
+    promote it (activate) or mirror `shadow_percent` of requests to it.
+    """
+    version = version or model_file_version(model_path)
+    return model_registry.load(version, model_path, lambda: _create_session(model_path),
+                               activate=activate, shadow_percent=shadow_percent, background=background)
+
+def detect_with_hosted_api(img_array, image_bytes=None):
+    """
+    Use the hosted API as fallback when local model is not available.
+    The original upload bytes are forwarded when given; the array is only
+    re-encoded for callers that no longer have them.
     """
     try:
-        # Convert numpy array to PIL Image
-        pil_image = Image.fromarray(img_array.astype('uint8'))
-        
-        # Convert to bytes
-        img_byte_arr = BytesIO()
-        pil_image.save(img_byte_arr, format='JPEG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
-        # Prepare the request
-        files = {'im': ('image.jpg', img_byte_arr, 'image/jpeg')}
+        if image_bytes is None:
+            img_byte_arr = BytesIO()
+            Image.fromarray(img_array.astype('uint8')).save(img_byte_arr, format='JPEG')
+            image_bytes = img_byte_arr.getvalue()
         
-        # Make request to hosted API
-        response = requests.post(
-            'https://skindiseasesdetect-2.onrender.com/detect',
-            files=files,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result
-        else:
-            raise Exception(f"API request failed with status {response.status_code}")
+        return hosted_detector.detect(image_bytes)
             
     except Exception as e:
-        print(f"Error with hosted API: {e}")
+        logger.warning(f"Error with hosted API: {e}")
         raise
 
-def skindisease_detector(img_array):
+def result_from_prediction(prediction, time_elapsed=0.0):
+    """Map one row of model output to the detection result returned by the API"""
+    disease_index = np.argmax(prediction)
+    confidence = float(prediction[disease_index])
+    
+    # Get disease information from the in-memory catalog
+    result = disease_catalog.get_by_index(disease_index)
+    result["probability"] = confidence
+    result["time"] = str(time_elapsed)
+    return result
+
+def skindisease_detector(img_array, image_bytes=None):
     """
     Detect skin disease from image array using ONNX model or hosted API
     
     Args:
         img_array: numpy array of the input image
+        image_bytes: original upload, forwarded as-is to the hosted API
     
     Returns:
         dict: Detection results with disease info
     """
     try:
-        # Load skin diseases from the JSON file
-        json_path = os.path.join(os.path.dirname(__file__), 'skindisease.json')
-        with open(json_path, 'r') as file:
-            skin_diseases = json.load(file)['skin_diseases']
-        
         # Try to use local model first
-        model = load_model()
-        
-        if model is not None:
+        if get_scheduler() is not None:
             # Use local model
             time_init = time.time()
             
-            # Preprocess image
-            test_image = cv2.resize(img_array, (256, 256))
-            im = np.float32(test_image)
-            img_array_processed = np.expand_dims(im, axis=0)
+            # Preprocess image (a no-op when decode_image already produced 256x256);
+            # the scheduler converts to float32 while copying into its batch buffer
+            test_image = preprocess_image(img_array)
 
-            # Run inference
-            onn_pred = model.run(['dense'], {"input_1": img_array_processed})
+            # Run inference on the active version; concurrent callers are batched together
+            prediction, version = model_registry.infer(test_image)
 
             time_elapsed = time.time() - time_init
-            disease_index = np.argmax(onn_pred[0][0])
-            confidence = float(onn_pred[0][0][disease_index])
-            
-            # Get disease information
-            disease_info = skin_diseases[disease_index]
-
-            return {
-                "disease": disease_info['name'],
-                "overview": disease_info['overview'],
-                "symptoms": disease_info['symptoms'],
-                "causes": disease_info['causes'],
-                "treatments": disease_info['treatments'],
-                "probability": confidence,
-                "time": str(time_elapsed)
-            }
+            result = result_from_prediction(prediction, time_elapsed)
+            result["model_version"] = version
+            return result
         else:
             # Use hosted API as fallback
-            print("Using hosted API as fallback...")
+            logger.info("Using hosted API as fallback...")
             time_init = time.time()
             
-            api_result = detect_with_hosted_api(img_array)
+            api_result = detect_with_hosted_api(img_array, image_bytes)
             
             time_elapsed = time.time() - time_init
             
@@ -125,11 +306,12 @@ def skindisease_detector(img_array):
             # Add time if not present
             if 'time' not in api_result:
                 api_result['time'] = str(time_elapsed)
+            api_result['model_version'] = HOSTED_API_VERSION
                 
             return api_result
     
     except Exception as e:
-        print(f"Error in skin disease detection: {e}")
+        logger.error(f"Error in skin disease detection: {e}")
         
         # Fallback to a default response
         return {
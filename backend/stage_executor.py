@@ -0,0 +1,99 @@
+"""
+Execution layer that keeps blocking work off the asyncio event loop.
+
+Each pipeline stage gets its own pool so a slow stage (e.g. the LLM call)
+cannot starve the others. Pool kind and size are configured per stage:
+
+    DECODE_POOL_KIND=thread|process     DECODE_POOL_SIZE=4
+    INFERENCE_POOL_KIND=thread          INFERENCE_POOL_SIZE=16
+    LLM_POOL_KIND=thread                LLM_POOL_SIZE=32
+"""
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from structured_logging import get_logger
+
+logger = get_logger("stage_executor")
+
+_CPU_COUNT = os.cpu_count() or 1
+
+# stage -> (default kind, default size, allowed kinds)
+STAGE_DEFAULTS = {
+    # CPU-bound: PIL/OpenCV release the GIL, so threads scale well enough by default
+    "decode": ("thread", min(4, _CPU_COUNT), ("thread", "process")),
+    # Threads here mostly wait on the micro-batching scheduler. The model registry,
+    # its batches and the readiness flag live in the server process, so no process pool
+    "inference": ("thread", 16, ("thread",)),
+    # I/O-bound: blocking HTTP clients only need a thread to wait in
+    "llm": ("thread", 32, ("thread",)),
+}
+
+
+class StageExecutor:
+    def __init__(self):
+        self._pools: Dict[str, Executor] = {}
+        self._config: Dict[str, Dict[str, Any]] = {}
+        self._in_flight: Dict[str, int] = {stage: 0 for stage in STAGE_DEFAULTS}
+        self._lock = threading.Lock()
+
+    def _load_config(self, stage: str) -> Dict[str, Any]:
+        if stage not in STAGE_DEFAULTS:
+            raise ValueError(f"Unknown pipeline stage: {stage}")
+        default_kind, default_size, allowed_kinds = STAGE_DEFAULTS[stage]
+        kind = os.getenv(f"{stage.upper()}_POOL_KIND", default_kind).strip().lower()
+        if kind not in allowed_kinds:
+            raise ValueError(f"{stage.upper()}_POOL_KIND must be one of {allowed_kinds}, got '{kind}'")
+        size = max(1, int(os.getenv(f"{stage.upper()}_POOL_SIZE", str(default_size))))
+        return {"kind": kind, "size": size}
+
+    def get_pool(self, stage: str) -> Executor:
+        """Return (creating on first use) the pool for a stage"""
+        pool = self._pools.get(stage)
+        if pool is not None:
+            return pool
+        with self._lock:
+            if stage not in self._pools:
+                config = self._load_config(stage)
+                if config["kind"] == "process":
+                    pool = ProcessPoolExecutor(max_workers=config["size"])
+                else:
+                    pool = ThreadPoolExecutor(max_workers=config["size"], thread_name_prefix=f"{stage}-pool")
+                self._config[stage] = config
+                self._pools[stage] = pool
+                logger.info(f"Started {config['kind']} pool for '{stage}' stage with {config['size']} workers")
+            return self._pools[stage]
+
+    async def run(self, stage: str, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking callable on the stage's pool and await its result"""
+        pool = self.get_pool(stage)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._in_flight[stage] += 1
+        try:
+            return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            with self._lock:
+                self._in_flight[stage] -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                stage: {**self._config.get(stage, {"kind": None, "size": None}), "in_flight": self._in_flight[stage]}
+                for stage in STAGE_DEFAULTS
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Global instance
+stage_executor = StageExecutor()
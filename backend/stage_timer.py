@@ -0,0 +1,51 @@
+"""
+Per-request stage timing.
+
+A StageTimer records how long each pipeline stage of one request took, using
+the monotonic nanosecond clock. The same numbers go into the response's
+`timings`, the `Server-Timing` header and the pipeline stage histograms
+served by /metrics.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import metrics
+
+
+class StageTimer:
+    def __init__(self):
+        self._started_ns = time.perf_counter_ns()
+        self.durations_ms: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the with-block as stage `name`"""
+        started = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter_ns() - started) / 1e6)
+
+    def add(self, name: str, duration_ms: float):
+        """Record a duration measured elsewhere (e.g. inside a worker process)"""
+        self.durations_ms[name] = self.durations_ms.get(name, 0.0) + duration_ms
+        metrics.pipeline_stage_duration_seconds.observe(duration_ms / 1000.0, stage=name)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter_ns() - self._started_ns) / 1e6
+
+    def as_dict(self, include_total: bool = True) -> Dict[str, float]:
+        """Stage durations in milliseconds, rounded for the response body"""
+        result = {name: round(duration, 3) for name, duration in self.durations_ms.items()}
+        if include_total:
+            result["total"] = round(self.elapsed_ms(), 3)
+        return result
+
+    def server_timing(self, extra: Optional[Dict[str, float]] = None) -> str:
+        """Value for the Server-Timing response header"""
+        entries = dict(self.durations_ms)
+        entries.update(extra or {})
+        entries["total"] = self.elapsed_ms()
+        return ", ".join(f"{name};dur={duration:.3f}" for name, duration in entries.items())
@@ -25,19 +25,25 @@ def check_environment():
     print("✅ Environment configuration looks good")
     return True
 
-def start_server():
+def start_server(production=False):
     """Start the FastAPI server"""
     print("🚀 Starting DermaDetect backend server...")
     
-    try:
-        # Use uvicorn to start the server
-        subprocess.run([
+    if production:
+        # Several workers sharing one preloaded model; see gunicorn_conf.py
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app"]
+    else:
+        # Single uvicorn process that reloads on code changes
+        command = [
             sys.executable, "-m", "uvicorn", 
             "main:app", 
             "--host", "0.0.0.0", 
             "--port", "3000",
             "--reload"
-        ], check=True)
+        ]
+    
+    try:
+        subprocess.run(command, check=True)
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")
     except subprocess.CalledProcessError as e:
@@ -59,7 +65,7 @@ def main():
         sys.exit(1)
     
     # Start server
-    start_server()
+    start_server(production="--production" in sys.argv[1:])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,153 @@
+"""
+Non-blocking structured logging.
+
+Log calls only put the record on an in-memory queue (QueueHandler); a
+QueueListener thread formats and writes them, so request handlers never wait
+on stdout. When the queue is full, records are dropped and counted instead of
+blocking the event loop.
+
+Requests are sampled as a whole: with LOG_SAMPLE_RATE=0.1 one request in ten
+gets its access line and INFO logs written. Warnings and errors are always
+written.
+
+Configuration (environment):
+    LOG_LEVEL        - minimum level (default INFO)
+    LOG_FORMAT       - "json" (default) or "text"
+    LOG_SAMPLE_RATE  - fraction of requests whose INFO logs are written (default 1.0)
+    LOG_QUEUE_SIZE   - records buffered before dropping (default 10000)
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Any, Dict, Optional
+
+LOGGER_NAME = "dermadetector"
+
+# Per-request context, set by the request middleware
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+request_sampled_var: contextvars.ContextVar[bool] = contextvars.ContextVar("request_sampled", default=True)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["_DroppingQueueHandler"] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the application namespace, e.g. get_logger("openai_service")"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def sample_rate() -> float:
+    return min(1.0, max(0.0, float(os.getenv('LOG_SAMPLE_RATE', '1.0'))))
+
+
+def start_request(request_id: str) -> Any:
+    """Mark the current request and decide whether it is sampled; returns tokens for end_request"""
+    rate = sample_rate()
+    sampled = rate >= 1.0 or random.random() < rate
+    return request_id_var.set(request_id), request_sampled_var.set(sampled)
+
+
+def end_request(tokens):
+    request_id_token, sampled_token = tokens
+    request_id_var.reset(request_id_token)
+    request_sampled_var.reset(sampled_token)
+
+
+class _SamplingFilter(logging.Filter):
+    """Drops sub-WARNING records of unsampled requests and attaches the request id"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not request_sampled_var.get():
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from extra={"fields": {...}}"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def setup_logging(stream=None):
+    """Attach the queue handler to the application logger and start the writer thread"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(TextFormatter() if os.getenv('LOG_FORMAT', 'json').lower() == 'text' else JsonFormatter())
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+    _queue_handler = _DroppingQueueHandler(log_queue)
+    _queue_handler.addFilter(_SamplingFilter())
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    logger.addHandler(_queue_handler)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger(LOGGER_NAME).removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        "sample_rate": sample_rate(),
+        "queued": _queue_handler.queue.qsize() if _queue_handler is not None else 0,
+        "dropped": _queue_handler.dropped if _queue_handler is not None else 0,
+    }
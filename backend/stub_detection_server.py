@@ -0,0 +1,135 @@
+"""
+Local stand-in for the hosted detection API.
+
+Accepts multipart uploads on POST /detect (field "im") and answers GET /
+as a health check. Records the uploaded bytes and counts TCP connections so
+byte forwarding, keep-alive and the circuit breaker can be tested without
+network access. set_status() simulates an outage and its recovery.
+
+    with StubDetectionServer() as stub:
+        os.environ['HOSTED_API_URL'] = stub.url
+"""
+
+import json
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESULT = {
+    "disease": "Acne",
+    "overview": "Stub overview",
+    "symptoms": ["Stub symptom"],
+    "causes": ["Stub cause"],
+    "treatments": ["Stub treatment"],
+    "probability": 0.9,
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.stats_lock:
+            self.server.health_checks += 1
+        self._respond(self.server.status_code, {"status": "ok" if self.server.status_code < 500 else "down"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        message = BytesParser(policy=policy.default).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode() + body
+        )
+        upload = None
+        for part in message.iter_parts() if message.is_multipart() else []:
+            if part.get_param("name", header="content-disposition") == "im":
+                upload = (part.get_filename(), part.get_content_type(), part.get_payload(decode=True))
+        with self.server.stats_lock:
+            self.server.requests += 1
+            if upload is not None:
+                self.server.uploads.append(upload)
+
+        if self.server.status_code != 200:
+            self._respond(self.server.status_code, {"error": "stub failure"})
+        elif upload is None:
+            self._respond(400, {"error": "missing im field"})
+        else:
+            self._respond(200, self.server.result)
+
+    def _respond(self, status_code, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class StubDetectionServer:
+    def __init__(self, result=None, status_code: int = 200, delay: float = 0.0):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.result = result or DEFAULT_RESULT
+        self._server.status_code = status_code
+        self._server.delay = delay
+        self._server.stats_lock = threading.Lock()
+        self._server.connections = 0
+        self._server.requests = 0
+        self._server.health_checks = 0
+        self._server.uploads = []
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/detect"
+
+    @property
+    def connections(self) -> int:
+        return self._server.connections
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    @property
+    def health_checks(self) -> int:
+        return self._server.health_checks
+
+    @property
+    def uploads(self):
+        """(filename, content_type, bytes) for every upload received"""
+        return self._server.uploads
+
+    def set_status(self, status_code: int):
+        self._server.status_code = status_code
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,139 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions endpoint.
+
+Used by tests and benchmarks so the LLM client can be exercised without
+network access or an API key. Counts accepted TCP connections and requests
+so keep-alive behaviour can be verified. Requests with "stream": true get
+the analysis back as server-sent chat.completion.chunk events.
+
+    with StubLLMServer(delay=0.05) as stub:
+        service.base_url = stub.base_url
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANALYSIS = {
+    "overview": "Stub overview",
+    "detection_details": "Stub detection details",
+    "recommendations": "Stub recommendations",
+    "important_notes": "Stub important notes",
+    "next_steps": "Stub next steps",
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; without this Nagle adds ~40 ms per keep-alive response
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.stats_lock:
+            self.server.requests += 1
+            self.server.payloads.append(body)
+
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        if self.path.rstrip("/").endswith("/chat/completions") and body.get("stream"):
+            self._stream_completion(json.dumps(self.server.analysis))
+            return
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            content = json.dumps(self.server.analysis)
+            payload = json.dumps({"choices": [{"message": {"role": "assistant", "content": content}}]}).encode()
+            self.send_response(self.server.status_code)
+        else:
+            payload = b'{"error": "not found"}'
+            self.send_response(404)
+
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client gave up (e.g. deadline tests)
+            pass
+
+
+    def _stream_completion(self, content, chunk_size=16):
+        self.send_response(self.server.status_code)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        events = [{"choices": [{"delta": {"content": piece}}]} for piece in pieces]
+        try:
+            for event in events:
+                self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+                if self.server.stream_delay:
+                    time.sleep(self.server.stream_delay)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StubLLMServer:
+    def __init__(self, delay: float = 0.0, analysis=None, status_code: int = 200, stream_delay: float = 0.0):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.delay = delay
+        self._server.analysis = analysis or DEFAULT_ANALYSIS
+        self._server.status_code = status_code
+        self._server.stream_delay = stream_delay
+        self._server.stats_lock = threading.Lock()
+        self._server.connections = 0
+        self._server.requests = 0
+        self._server.payloads = []
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def connections(self) -> int:
+        return self._server.connections
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    @property
+    def payloads(self):
+        return self._server.payloads
+
+    def set_delay(self, delay: float):
+        self._server.delay = delay
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,128 @@
+"""
+Test script for admission control, rate limiting and the readiness endpoint
+"""
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('MODEL_EAGER_LOAD', 'false')
+
+from admission import StageLimiter, ClientRateLimiter, Overloaded
+
+
+def test_stage_limiter_queues_then_sheds():
+    async def run():
+        limiter = StageLimiter("test", concurrency=1, queue_size=1, queue_timeout=5)
+        first = await limiter.acquire()
+
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1 and limiter.saturated
+
+        try:
+            await limiter.acquire()
+            assert False, "a full queue must refuse new callers"
+        except Overloaded as e:
+            assert e.stage == "test" and e.retry_after >= 1
+
+        # Releasing hands the slot to the queued caller, not to a newcomer
+        limiter.release(first)
+        await queued
+        assert limiter.active == 1 and limiter.waiting == 0
+        limiter.release()
+        assert limiter.active == 0
+        assert limiter.get_stats()["rejected"] == 1
+    asyncio.run(run())
+    print("✅ Stage limiter queues up to its bound and sheds the rest")
+
+
+def test_stage_limiter_queue_timeout_and_cancellation():
+    async def run():
+        limiter = StageLimiter("test", concurrency=1, queue_size=5, queue_timeout=0.05)
+        await limiter.acquire()
+        try:
+            await limiter.acquire()
+            assert False, "a caller that waits past the timeout must be refused"
+        except Overloaded:
+            pass
+        assert limiter.timed_out == 1 and limiter.waiting == 0
+
+        cancelled = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert limiter.waiting == 0
+
+        limiter.release()
+        async with limiter.slot():
+            assert limiter.active == 1
+        assert limiter.active == 0
+    asyncio.run(run())
+    print("✅ Timed-out and cancelled waiters leave the queue without leaking slots")
+
+
+def test_client_rate_limiter_token_bucket():
+    now = [0.0]
+    limiter = ClientRateLimiter(rate=2.0, burst=3, max_clients=2, clock=lambda: now[0])
+    assert [limiter.check("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    retry_after = limiter.check("a")
+    assert abs(retry_after - 0.5) < 1e-9, retry_after
+    assert limiter.check("b") == 0.0, "clients have separate buckets"
+
+    now[0] += 0.5
+    assert limiter.check("a") == 0.0, "one token refilled after 1/rate seconds"
+
+    limiter.check("c")
+    assert limiter.get_stats()["clients"] == 2, "least recently seen client is evicted"
+    assert ClientRateLimiter(rate=0, burst=1).check("a") == 0.0, "rate 0 disables the limit"
+    print("✅ Per-client token buckets refill at the configured rate")
+
+
+def test_overload_responses_and_readiness():
+    from fastapi.testclient import TestClient
+    import main
+
+    saved = (main.rate_limiter, main.upload_limiter)
+    try:
+        main.rate_limiter = ClientRateLimiter(rate=0.01, burst=1)
+        main.upload_limiter = StageLimiter("upload", concurrency=1, queue_size=0)
+        with TestClient(main.app) as client:
+            upload = {"image": ("a.jpg", b"not an image", "image/jpeg")}
+            assert client.post("/analyze", files=upload).status_code == 400
+            response = client.post("/analyze", files=upload)
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) >= 1
+            # Polls and reads do not count against the client's analysis requests
+            for _ in range(5):
+                assert client.get("/supported-diseases").status_code == 200
+                assert client.get(f"/analysis/{'0' * 32}").status_code == 404
+
+            ready = client.get("/ready")
+            assert ready.status_code == 200, ready.text
+            assert ready.json()["ready"] is True and "inference" in ready.json()["queues"]
+
+            main.rate_limiter = ClientRateLimiter(rate=0, burst=1)
+            asyncio.run(main.upload_limiter.acquire())
+            response = client.post("/analyze", files={"image": ("a.jpg", b"not an image", "image/jpeg")})
+            assert response.status_code == 503
+            assert "Retry-After" in response.headers
+
+            ready = client.get("/ready")
+            assert ready.status_code == 503
+            assert ready.json()["saturated_stages"] == ["upload"]
+
+            main.upload_limiter.release()
+            response = client.post("/analyze", files={"image": ("a.jpg", b"not an image", "image/jpeg")})
+            assert response.status_code == 400
+            assert main.upload_limiter.active == 0, "upload slot is released once the body is read"
+    finally:
+        main.rate_limiter, main.upload_limiter = saved
+    print("✅ Overload answers 429/503 with Retry-After and /ready reports saturation")
+
+
+if __name__ == "__main__":
+    test_stage_limiter_queues_then_sheds()
+    test_stage_limiter_queue_timeout_and_cancellation()
+    test_client_rate_limiter_token_bucket()
+    test_overload_responses_and_readiness()
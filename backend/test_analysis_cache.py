@@ -0,0 +1,96 @@
+"""
+Test script for the detailed analysis cache
+"""
+import sys
+import os
+import asyncio
+import tempfile
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analysis_cache import AnalysisCache
+
+SAMPLE_ANALYSIS = {"overview": "o", "detection_details": "d", "recommendations": "r",
+                   "important_notes": "i", "next_steps": "n"}
+
+
+def test_confidence_buckets():
+    cache = AnalysisCache(bucket_width=0.1)
+    assert cache.bucket(0.0) == 0 and cache.bucket(0.849) == 8 and cache.bucket(1.0) == 9
+    assert cache.bucket_confidence(0.83) == 0.85
+    assert cache.make_key("Acne", 0.81, "gpt") == cache.make_key("acne ", 0.89, "gpt")
+    assert cache.make_key("Acne", 0.81, "gpt") != cache.make_key("Acne", 0.91, "gpt")
+    assert cache.make_key("Acne", 0.81, "gpt") != cache.make_key("Acne", 0.81, "other-model")
+    print("✅ Keys collapse to condition, confidence band and model")
+
+
+def test_concurrent_misses_share_one_call():
+    cache = AnalysisCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return SAMPLE_ANALYSIS
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [SAMPLE_ANALYSIS] * 8
+    assert cache.get_stats()["coalesced"] == 7
+    print("✅ 8 concurrent misses made 1 call")
+
+
+def test_async_misses_share_one_call_and_failures_are_not_cached():
+    cache = AnalysisCache()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return None
+
+    async def run():
+        return await asyncio.gather(*[cache.aget_or_compute("k", failing) for _ in range(5)])
+
+    assert asyncio.run(run()) == [None] * 5
+    assert len(calls) == 1
+    assert cache.get("k") is None
+    print("✅ Async misses coalesced; failed calls not cached")
+
+
+def test_precomputed_file_answers_without_compute():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "analyses.json")
+        writer = AnalysisCache()
+        key = writer.make_key("Acne", 0.85, "gpt")
+        AnalysisCache.save_precomputed(path, {key: SAMPLE_ANALYSIS}, writer.bucket_width, "gpt")
+
+        cache = AnalysisCache(precomputed_path=path)
+        assert cache.get_or_compute(key, lambda: 1 / 0) == SAMPLE_ANALYSIS
+        assert cache.get_stats()["precomputed_hits"] == 1
+
+        # A file generated with other bands is ignored rather than misused
+        assert AnalysisCache(bucket_width=0.05, precomputed_path=path).get(key) is None
+
+        # Entries without every section as a string are skipped instead of served
+        malformed = {writer.make_key("Eczema", 0.85, "gpt"): ["overview"],
+                     writer.make_key("Rosacea", 0.85, "gpt"): {**SAMPLE_ANALYSIS, "next_steps": ["a", "b"]}}
+        AnalysisCache.save_precomputed(path, {key: SAMPLE_ANALYSIS, **malformed}, writer.bucket_width, "gpt")
+        cache = AnalysisCache(precomputed_path=path)
+        assert cache.get(key) == SAMPLE_ANALYSIS
+        assert all(cache.get(malformed_key) is None for malformed_key in malformed)
+    print("✅ Precomputed analyses served without a network call")
+
+
+if __name__ == "__main__":
+    test_confidence_buckets()
+    test_concurrent_misses_share_one_call()
+    test_async_misses_share_one_call_and_failures_are_not_cached()
+    test_precomputed_file_answers_without_compute()
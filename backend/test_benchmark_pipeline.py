@@ -0,0 +1,47 @@
+"""
+Test script for the pipeline benchmark's tiny model and regression check
+"""
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import onnxruntime as ort
+
+from benchmark_pipeline import build_tiny_model, compare, NUM_CLASSES
+
+
+def test_tiny_model_matches_real_signature():
+    with tempfile.TemporaryDirectory() as directory:
+        path = build_tiny_model(os.path.join(directory, 'tiny.onnx'))
+        session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+        assert session.get_inputs()[0].name == 'input_1'
+        assert session.get_outputs()[0].name == 'dense'
+
+        batch = np.random.RandomState(1).randint(0, 256, (3, 256, 256, 3)).astype(np.float32)
+        predictions = session.run(['dense'], {'input_1': batch})[0]
+        assert predictions.shape == (3, NUM_CLASSES)
+        assert np.allclose(predictions.sum(axis=1), 1.0, atol=1e-5)
+    print("✅ Generated model takes (N, 256, 256, 3) and returns class probabilities")
+
+
+def test_compare_flags_only_real_slowdowns():
+    baseline = {
+        "decode": {"median_ms": 10.0},
+        "lookup": {"median_ms": 0.01},
+        "model_run": {"median_ms": 5.0},
+    }
+    current = {
+        "decode": {"median_ms": 13.0},   # 30% slower
+        "lookup": {"median_ms": 0.02},   # 100% slower, but below the noise floor
+        "model_run": {"median_ms": 5.5},  # within threshold
+        "new_stage": {"median_ms": 1.0},
+    }
+    assert compare(current, baseline, threshold=0.2, min_delta_ms=0.05) == ["decode"]
+    print("✅ Regression check ignores noise and new stages")
+
+
+if __name__ == "__main__":
+    test_tiny_model_matches_real_signature()
+    test_compare_flags_only_real_slowdowns()
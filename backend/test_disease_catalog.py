@@ -0,0 +1,62 @@
+"""
+Test script for the in-memory disease catalog
+"""
+import sys
+import os
+import json
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from disease_catalog import DiseaseCatalog, disease_catalog
+
+
+def _write_catalog(path, names, mtime):
+    diseases = [{"name": name, "overview": f"{name} overview", "symptoms": ["s"], "causes": ["c"],
+                 "treatments": ["t1", "t2"]} for name in names]
+    with open(path, 'w') as file:
+        json.dump({"skin_diseases": diseases}, file)
+    os.utime(path, (mtime, mtime))
+
+
+def test_bundled_catalog_is_indexed():
+    assert len(disease_catalog) == 22
+    first = disease_catalog.get_by_index(0)
+    assert first["disease"] == "Acne"
+    assert set(first) == {"disease", "overview", "symptoms", "causes", "treatments"}
+    assert disease_catalog.get_by_name("acne")["overview"] == first["overview"]
+    assert disease_catalog.get_by_name("Not a disease") is None
+    print(f"✅ {len(disease_catalog)} diseases indexed by class index and name")
+
+
+def test_fragments_are_not_shared_between_callers():
+    result = disease_catalog.get_by_index(0)
+    result["probability"] = 0.5
+    assert "probability" not in disease_catalog.get_by_index(0)
+    print("✅ Callers get their own response dict")
+
+
+def test_reload_on_mtime_change():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.json")
+        _write_catalog(path, ["Acne", "Eczema"], mtime=1000)
+        catalog = DiseaseCatalog(path)
+        assert catalog.check_for_changes() is False
+
+        _write_catalog(path, ["Acne", "Eczema", "Warts"], mtime=2000)
+        assert catalog.check_for_changes() is True
+        assert catalog.names() == ["Acne", "Eczema", "Warts"]
+        assert catalog.basic_advice(2) == "t1, t2"
+
+        # A broken edit keeps the last good catalog
+        with open(path, 'w') as file:
+            file.write("{not json")
+        os.utime(path, (3000, 3000))
+        assert catalog.check_for_changes() is False
+        assert len(catalog) == 3
+    print("✅ Catalog reloads when the file changes")
+
+
+if __name__ == "__main__":
+    test_bundled_catalog_is_indexed()
+    test_fragments_are_not_shared_between_callers()
+    test_reload_on_mtime_change()
@@ -0,0 +1,227 @@
+"""
+Test script for the analysis history store: batched background writes, indexed queries and /history
+"""
+import sys
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from io import BytesIO
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('MODEL_EAGER_LOAD', 'false')
+
+import numpy as np
+from PIL import Image
+
+from history_store import HistoryStore
+from schemas import APIOutput
+
+CONDITIONS = ["Acne", "Eczema", "Psoriasis"]
+
+
+def _output(number):
+    return APIOutput(
+        disease=CONDITIONS[number % 3], overview="", symptoms=[], causes=[], treatments=[],
+        probability=0.5 + (number % 5) / 10, time="0.0", model_version=f"v{number % 2}",
+        image_digest=f"{number:064x}",
+    )
+
+
+def test_batched_writes_and_keyset_pages():
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(os.path.join(directory, "history.db"), batch_size=500, flush_interval_ms=50)
+        store.start()
+        try:
+            outputs = [_output(number) for number in range(5000)]
+            started = time.perf_counter()
+            for number, output in enumerate(outputs):
+                store.record(output, "/analyze", patient_id=f"patient-{number % 10}")
+            per_record_us = (time.perf_counter() - started) * 1e6 / len(outputs)
+            assert store.flush(timeout=30)
+
+            stats = store.get_stats()
+            assert stats["written"] == 5000 and stats["dropped"] == 0 and stats["failed"] == 0
+            assert stats["batches"] <= 20, f"{stats['batches']} transactions for 5000 entries"
+            assert per_record_us < 100, f"record() took {per_record_us:.1f} us"
+
+            # Pages follow each other without gaps or repeats, newest first
+            seen = []
+            cursor = None
+            while True:
+                items, cursor = store.query(limit=70, cursor=cursor, patient_id="patient-3", include_result=False)
+                seen.extend(item["id"] for item in items)
+                if cursor is None:
+                    break
+            assert len(seen) == 500 and seen == sorted(set(seen), reverse=True)
+
+            items, _ = store.query(limit=5, condition="Eczema", model_version="v0")
+            assert len(items) == 5 and all(item["condition"] == "Eczema" and item["model_version"] == "v0" for item in items)
+            assert items[0]["result"]["disease"] == "Eczema" and "timings" not in items[0]["result"]
+            items, _ = store.query(image_digest=f"{42:064x}")
+            assert [item["patient_id"] for item in items] == ["patient-2"]
+
+            summary = store.summary(model_version="v1")
+            assert summary["total"] == 2500 and set(summary["by_model_version"]) == {"v1"}
+            assert sum(entry["count"] for entry in summary["by_condition"].values()) == 2500
+
+            # Every filter is answered from an index
+            reader = store._reader()
+            for column in ("patient_id", "image_digest", "condition", "model_version"):
+                plan = " ".join(row[3] for row in reader.execute(
+                    f"EXPLAIN QUERY PLAN SELECT id FROM analyses WHERE {column} = ? AND id < ? ORDER BY id DESC LIMIT 50", ("x", 10)))
+                assert "USING" in plan and "INDEX" in plan and "TEMP B-TREE" not in plan, plan
+            # A since/until page finds its ids in the (created_at, id) index without reading rows
+            plan = " ".join(row[3] for row in reader.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM analyses WHERE created_at >= ? AND created_at < ? AND id < ? "
+                "ORDER BY id DESC LIMIT 50", (0, 1, 10)))
+            assert "COVERING INDEX analyses_created_at_id" in plan, plan
+            assert reader.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        finally:
+            store.close()
+    print(f"✅ 5000 entries written in {stats['batches']} transactions, {per_record_us:.1f} us per record()")
+
+
+def test_full_queue_drops_instead_of_blocking():
+    with tempfile.TemporaryDirectory() as directory:
+        # Not started, so nothing drains the queue
+        store = HistoryStore(os.path.join(directory, "history.db"), max_queue=10)
+        started = time.perf_counter()
+        for number in range(50):
+            store.record(_output(number), "/analyze")
+        assert time.perf_counter() - started < 0.05
+        assert store.get_stats()["queued"] == 10 and store.dropped == 40
+
+        # Written once the writer starts; unset path disables the store
+        store.start()
+        assert store.flush() and store.written == 10
+        store.close()
+        disabled = HistoryStore(None)
+        disabled.record(_output(0), "/analyze")
+        assert disabled.get_stats()["queued"] == 0
+    print("✅ A full history queue drops entries instead of blocking requests")
+
+
+def test_record_keeps_the_result_as_it_was():
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(os.path.join(directory, "history.db"), flush_interval_ms=50)
+        store.start()
+        try:
+            output = _output(1)
+            store.record(output, "/analyze")
+            # The caller keeps using its object after record() returns
+            output.disease = "Changed"
+            output.symptoms.append("changed")
+            assert store.flush()
+            item = store.query()[0][0]
+            assert item["condition"] == "Eczema" and item["result"]["disease"] == "Eczema"
+            assert item["result"]["symptoms"] == []
+        finally:
+            store.close()
+    print("✅ record() stores a snapshot taken when it is called")
+
+
+def test_close_closes_every_reader():
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(os.path.join(directory, "history.db"))
+        store.start()
+        store.record(_output(0), "/analyze")
+        assert store.flush()
+        readers = [store._reader()]
+        threads = [threading.Thread(target=lambda: readers.append(store._reader())) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len({id(reader) for reader in readers}) == 4
+
+        store.close()
+        for reader in readers:
+            try:
+                reader.execute("SELECT 1")
+                raise AssertionError("reader left open")
+            except sqlite3.ProgrammingError:
+                pass
+        # A thread that queried before close() gets a fresh connection afterwards
+        store.start()
+        assert len(store.query()[0]) == 1
+        store.close()
+    print("✅ close() closes the read connections of every thread")
+
+
+def _jpeg(seed):
+    pixels = np.random.RandomState(seed).normal((190, 130, 110), 25, (320, 320, 3)).clip(0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def test_analyze_records_history_per_patient():
+    from fastapi.testclient import TestClient
+    import main
+    from disease_catalog import disease_catalog
+
+    def fake_detector(img_array, image_bytes=None):
+        result = disease_catalog.get_by_index(1)
+        result.update(probability=0.8, time="0.0", model_version=main.get_model_version())
+        return result
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(os.path.join(directory, "history.db"), flush_interval_ms=10)
+        saved = (main.history_store, main.skindisease_detector, main.HISTORY_ACCESS_TOKEN)
+        main.history_store, main.skindisease_detector, main.HISTORY_ACCESS_TOKEN = store, fake_detector, "secret"
+        headers = {"X-History-Token": "secret"}
+        main.detection_cache.clear()
+        try:
+            with TestClient(main.app) as client:
+                for seed in range(3):
+                    response = client.post("/analyze?async_analysis=true", data={"patient_id": "p-17"},
+                                           files={"image": ("skin.jpg", _jpeg(seed), "image/jpeg")})
+                    assert response.status_code == 200, response.text
+                digest = response.json()["result"]["image_digest"]
+                client.post("/analyze?async_analysis=true", files={"image": ("skin.jpg", _jpeg(9), "image/jpeg")})
+                assert client.post("/analyze", data={"patient_id": "x" * 200},
+                                   files={"image": ("skin.jpg", _jpeg(0), "image/jpeg")}).status_code == 422
+                assert store.flush()
+
+                assert client.get("/history").status_code == 401
+                assert client.get("/history", headers={"X-History-Token": "wrong"}).status_code == 403
+                assert client.get("/history/summary").status_code == 401
+                page = client.get("/history", params={"patient_id": "p-17", "limit": 2}, headers=headers).json()
+                assert len(page["items"]) == 2 and page["next_cursor"] is not None
+                assert page["items"][0]["image_digest"] == digest and page["items"][0]["endpoint"] == "/analyze"
+                rest = client.get("/history", params={"patient_id": "p-17", "cursor": page["next_cursor"]},
+                                  headers=headers).json()
+                assert len(rest["items"]) == 1 and rest["next_cursor"] is None
+                assert client.get("/history", params={"limit": 500}, headers=headers).status_code == 422
+
+                summary = client.get("/history/summary", headers=headers).json()
+                assert summary["total"] == 4
+                assert client.get("/stats").json()["history"]["written"] == 4
+
+                # Streamed results are recorded after their analysis, so the row includes it
+                response = client.post("/analyze/stream", data={"patient_id": "p-18"},
+                                       files={"image": ("skin.jpg", _jpeg(5), "image/jpeg")})
+                assert response.status_code == 200 and "event: done" in response.text
+                assert store.flush()
+                items, _ = store.query(patient_id="p-18")
+                assert [item["endpoint"] for item in items] == ["/analyze/stream"]
+                assert items[0]["result"]["detailed_analysis"]["overview"]
+        finally:
+            main.history_store, main.skindisease_detector, main.HISTORY_ACCESS_TOKEN = saved
+            main.detection_cache.clear()
+        assert store.get_stats()["queued"] == 0
+
+    with TestClient(main.app) as client:
+        expected = 403 if not main.HISTORY_ACCESS_TOKEN else 401
+        assert client.get("/history").status_code == expected, "disabled without a token"
+    print("✅ /analyze records results per patient and /history pages through them")
+
+
+if __name__ == "__main__":
+    test_batched_writes_and_keyset_pages()
+    test_full_queue_drops_instead_of_blocking()
+    test_record_keeps_the_result_as_it_was()
+    test_close_closes_every_reader()
+    test_analyze_records_history_per_patient()
@@ -0,0 +1,107 @@
+"""
+Test script for the hosted-API fallback client and its circuit breaker
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from hosted_detector import CircuitBreaker, HostedAPIUnavailable, HostedDetector
+from stub_detection_server import StubDetectionServer, DEFAULT_RESULT
+
+JPEG_BYTES = b'\xff\xd8\xff\xe0' + b'original upload bytes' * 100
+
+
+def _detector_for(stub, failure_threshold=2, probe_interval=0.05):
+    detector = HostedDetector()
+    detector.url = stub.url
+    detector.health_url = stub.url.rsplit('/', 1)[0] + '/'
+    detector.breaker = CircuitBreaker(failure_threshold)
+    detector.probe_interval = probe_interval
+    return detector
+
+
+def test_forwards_original_bytes_over_keep_alive():
+    with StubDetectionServer() as stub:
+        detector = _detector_for(stub)
+        for _ in range(5):
+            assert detector.detect(JPEG_BYTES) == DEFAULT_RESULT
+        detector.close()
+
+        assert all(upload == ('image.jpg', 'image/jpeg', JPEG_BYTES) for upload in stub.uploads)
+        assert stub.requests == 5
+        assert stub.connections == 1, f"expected one reused connection, got {stub.connections}"
+    print("✅ Upload bytes are forwarded unchanged on one keep-alive connection")
+
+
+def test_circuit_opens_and_fails_fast():
+    with StubDetectionServer(status_code=503) as stub:
+        detector = _detector_for(stub, probe_interval=60)
+        for _ in range(2):
+            try:
+                detector.detect(JPEG_BYTES)
+                assert False, "expected a failure"
+            except HostedAPIUnavailable:
+                assert False, "circuit opened too early"
+            except Exception:
+                pass
+        assert detector.breaker.state == CircuitBreaker.OPEN
+
+        started = time.perf_counter()
+        try:
+            detector.detect(JPEG_BYTES)
+            assert False, "expected the open circuit to reject"
+        except HostedAPIUnavailable:
+            pass
+        assert time.perf_counter() - started < 0.01
+        assert stub.requests == 2, "no request may reach the remote while the circuit is open"
+        detector.close()
+    print("✅ Circuit opens after repeated failures and rejects without calling the remote")
+
+
+def test_health_probe_recovers_circuit():
+    with StubDetectionServer(status_code=503) as stub:
+        detector = _detector_for(stub)
+        for _ in range(2):
+            try:
+                detector.detect(JPEG_BYTES)
+            except Exception:
+                pass
+        assert detector.breaker.state == CircuitBreaker.OPEN
+
+        # Still down: probes run but the circuit stays open
+        time.sleep(0.2)
+        assert stub.health_checks >= 1 and detector.breaker.state == CircuitBreaker.OPEN
+
+        stub.set_status(200)
+        deadline = time.time() + 2
+        while detector.breaker.state != CircuitBreaker.HALF_OPEN and time.time() < deadline:
+            time.sleep(0.02)
+        assert detector.breaker.state == CircuitBreaker.HALF_OPEN
+
+        # The trial request succeeds and closes the circuit
+        assert detector.detect(JPEG_BYTES) == DEFAULT_RESULT
+        assert detector.breaker.state == CircuitBreaker.CLOSED
+        detector.close()
+    print("✅ Health probe half-opens the circuit and a successful trial closes it")
+
+
+def test_client_errors_do_not_open_circuit():
+    with StubDetectionServer(status_code=400) as stub:
+        detector = _detector_for(stub)
+        for _ in range(5):
+            try:
+                detector.detect(JPEG_BYTES)
+            except Exception:
+                pass
+        assert detector.breaker.state == CircuitBreaker.CLOSED
+        assert stub.requests == 5
+        detector.close()
+    print("✅ Rejected images do not count as remote failures")
+
+
+if __name__ == "__main__":
+    test_forwards_original_bytes_over_keep_alive()
+    test_circuit_opens_and_fails_fast()
+    test_health_probe_recovers_circuit()
+    test_client_errors_do_not_open_circuit()
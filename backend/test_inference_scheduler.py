@@ -0,0 +1,100 @@
+"""
+Test script for the micro-batching inference scheduler
+Uses a small stand-in session so it runs without the ONNX model file
+"""
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from inference_scheduler import InferenceScheduler
+
+
+class _Input:
+    def __init__(self, shape):
+        self.shape = shape
+
+
+class FakeSession:
+    """Mimics onnxruntime.InferenceSession: returns the per-image mean as a one-hot-ish row"""
+
+    def __init__(self, batch_dim="N", delay=0.01):
+        self.batch_dim = batch_dim
+        self.delay = delay
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [_Input([self.batch_dim, 256, 256, 3])]
+
+    def run(self, output_names, feeds):
+        batch = feeds["input_1"]
+        assert batch.dtype == np.float32
+        self.batch_sizes.append(batch.shape[0])
+        time.sleep(self.delay)
+        means = batch.reshape(batch.shape[0], -1).mean(axis=1)
+        return [np.stack([means, -means], axis=1)]
+
+
+def _submit_concurrently(scheduler, count):
+    results = [None] * count
+
+    def worker(index):
+        image = np.full((256, 256, 3), index, dtype=np.float32)
+        results[index] = scheduler.infer(image, timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_requests_are_batched():
+    session = FakeSession()
+    scheduler = InferenceScheduler(session, max_batch_size=8, max_wait_ms=50)
+    try:
+        results = _submit_concurrently(scheduler, 16)
+    finally:
+        scheduler.close()
+
+    # Every caller gets its own row back
+    for index, row in enumerate(results):
+        assert row[0] == index and row[1] == -index
+
+    stats = scheduler.get_stats()
+    assert stats["items"] == 16
+    assert stats["batches"] < 16
+    assert max(session.batch_sizes) <= 8
+    print(f"✅ 16 requests served in {stats['batches']} batches: {stats['batch_size_histogram']}")
+
+
+def test_fixed_batch_dimension_caps_batch_size():
+    session = FakeSession(batch_dim=1)
+    scheduler = InferenceScheduler(session, max_batch_size=8, max_wait_ms=5)
+    try:
+        assert scheduler.max_batch_size == 1
+        _submit_concurrently(scheduler, 4)
+    finally:
+        scheduler.close()
+    assert session.batch_sizes == [1, 1, 1, 1]
+    print("✅ Fixed batch dimension respected")
+
+
+def test_wrong_shape_is_rejected():
+    scheduler = InferenceScheduler(FakeSession(), max_batch_size=4, max_wait_ms=1)
+    try:
+        scheduler.submit(np.zeros((128, 128, 3), dtype=np.float32))
+        assert False, "expected ValueError"
+    except ValueError:
+        print("✅ Wrong input shape rejected")
+    finally:
+        scheduler.close()
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_are_batched()
+    test_fixed_batch_dimension_caps_batch_size()
+    test_wrong_shape_is_rejected()
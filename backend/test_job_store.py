@@ -0,0 +1,141 @@
+"""
+Test script for the background analysis job store
+"""
+import sys
+import os
+import asyncio
+import subprocess
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from job_store import AnalysisJobStore, JobQueueFull, DONE, FAILED, PENDING, RUNNING
+
+
+def test_jobs_run_with_bounded_concurrency():
+    async def run():
+        running = 0
+        peak = 0
+
+        async def handler(payload):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+            return {"echo": payload}
+
+        store = AnalysisJobStore(workers=2, max_pending=10)
+        store.start(handler)
+        job_ids = [await store.submit(index) for index in range(6)]
+        jobs = [await store.wait(job_id, timeout=2) for job_id in job_ids]
+        await store.stop()
+
+        assert [job.status for job in jobs] == [DONE] * 6
+        assert [job.result for job in jobs] == [{"echo": index} for index in range(6)]
+        assert peak == 2, f"expected at most 2 concurrent jobs, saw {peak}"
+    asyncio.run(run())
+    print("✅ Jobs complete on a fixed-size worker pool")
+
+
+def test_full_queue_rejects_and_failures_are_reported():
+    async def run():
+        release = asyncio.Event()
+
+        async def handler(payload):
+            await release.wait()
+            if payload == "bad":
+                raise ValueError("provider exploded")
+            return {}
+
+        store = AnalysisJobStore(workers=1, max_pending=2)
+        store.start(handler)
+        bad = await store.submit("bad")
+        await asyncio.sleep(0)  # the worker takes the first job
+        await store.submit("ok")
+        await store.submit("ok")
+        try:
+            await store.submit("one too many")
+            assert False, "expected JobQueueFull"
+        except JobQueueFull:
+            pass
+
+        # Long-poll times out while the job is still running
+        started = time.perf_counter()
+        job = await store.wait(bad, timeout=0.05)
+        assert job.status != DONE and time.perf_counter() - started >= 0.05
+
+        release.set()
+        job = await store.wait(bad, timeout=2)
+        await store.stop()
+        assert job.status == FAILED and "provider exploded" in job.error
+        assert store.get_stats()["rejected"] == 1
+    asyncio.run(run())
+    print("✅ Full queue rejects new jobs and failed jobs report their error")
+
+
+def test_finished_jobs_expire_after_ttl():
+    async def run():
+        async def handler(payload):
+            return {}
+
+        store = AnalysisJobStore(workers=1, ttl_seconds=0.05)
+        store.start(handler)
+        job_id = await store.submit(None)
+        assert store.get(job_id).status in (PENDING, DONE)
+        await store.wait(job_id, timeout=1)
+        assert store.get(job_id).status == DONE
+        await asyncio.sleep(0.1)
+        assert store.get(job_id) is None
+        await store.stop()
+    asyncio.run(run())
+    print("✅ Finished jobs are dropped once their TTL has passed")
+
+
+def test_jobs_can_be_polled_from_another_process():
+    async def run():
+        release = asyncio.Event()
+
+        async def handler(payload):
+            await release.wait()
+            return {"echo": payload}
+
+        async def unused(payload):
+            raise AssertionError("a job runs where it was submitted")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "jobs.db")
+            owner = AnalysisJobStore(workers=1, path=path)
+            other = AnalysisJobStore(workers=1, path=path, poll_interval=0.01)
+            owner.start(handler)
+            other.start(unused)
+
+            job_id = await owner.submit("hello")
+            assert other.get(job_id) is None, "not in the other process's memory"
+            job = await other.wait(job_id, timeout=0.05)
+            assert job.status in (PENDING, RUNNING)
+
+            release.set()
+            job = await other.wait(job_id, timeout=2)
+            assert job.status == DONE and job.result == {"echo": "hello"}
+            assert await other.wait("unknown", timeout=0) is None
+
+            # A job left unfinished by a process that has exited is reported as failed
+            exited = subprocess.Popen(["true"])
+            exited.wait()
+            other._save("orphan", RUNNING, None, None, None)
+            other._database().execute("UPDATE analysis_jobs SET owner_pid = ?", (exited.pid,)).connection.commit()
+            job = await owner.wait("orphan", timeout=0)
+            assert job.status == FAILED and "exited" in job.error
+
+            await owner.stop()
+            await other.stop()
+    asyncio.run(run())
+    print("✅ Jobs are readable from every server process sharing the job database")
+
+
+if __name__ == "__main__":
+    test_jobs_run_with_bounded_concurrency()
+    test_full_queue_rejects_and_failures_are_reported()
+    test_finished_jobs_expire_after_ttl()
+    test_jobs_can_be_polled_from_another_process()
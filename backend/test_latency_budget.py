@@ -0,0 +1,75 @@
+"""
+Test script for adaptive enrichment timeouts and budgeted degradation
+"""
+import sys
+import os
+import asyncio
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('MODEL_EAGER_LOAD', 'false')
+
+from latency_tracker import LatencyTracker
+from stub_llm_server import StubLLMServer, DEFAULT_ANALYSIS
+
+
+def test_timeout_follows_latency_percentile():
+    tracker = LatencyTracker(window=100, percentile=95, multiplier=2.0, min_timeout=0.1, max_timeout=30.0, min_samples=10)
+    assert tracker.timeout() == 30.0, "static maximum until there are enough samples"
+
+    for index in range(100):
+        tracker.record(0.2 if index < 95 else 1.0)
+    assert abs(tracker.timeout() - 0.4) < 1e-9  # p95 = 0.2 s, times 2
+
+    for _ in range(100):
+        tracker.record(0.01)
+    assert tracker.timeout() == 0.1, "never below the floor"
+
+    for _ in range(100):
+        tracker.record(60.0)
+    assert tracker.timeout() == 30.0, "never above the static deadline"
+    print("✅ Enrichment timeout adapts to the provider's p95 latency within bounds")
+
+
+def test_budget_exhaustion_degrades_and_fills_cache():
+    import main
+    service = main.openai_service
+    saved = (service.api_key, service.base_url, service.client_mode)
+
+    async def run(stub):
+        condition, confidence, advice = "Budget Test Condition", 0.83, "Rest"
+        started = time.perf_counter()
+        analysis = await main.generate_detailed_analysis(condition, confidence, advice, budget_seconds=0.1)
+        elapsed = time.perf_counter() - started
+        assert elapsed < 0.3, f"request waited {elapsed:.2f}s despite a 0.1s budget"
+        assert service.is_fallback_response(analysis, condition, advice, confidence)
+
+        # The provider call keeps going and lands in the analysis cache
+        deadline = time.time() + 3
+        while main._background_analyses and time.time() < deadline:
+            await asyncio.sleep(0.02)
+        assert stub.requests == 1
+
+        started = time.perf_counter()
+        analysis = await main.generate_detailed_analysis(condition, confidence, advice, budget_seconds=0.1)
+        assert analysis == DEFAULT_ANALYSIS
+        assert time.perf_counter() - started < 0.1
+        # A spent budget still serves the cached analysis rather than the fallback
+        assert await main.generate_detailed_analysis(condition, confidence, advice, budget_seconds=-0.5) == DEFAULT_ANALYSIS
+        assert stub.requests == 1
+        await service.aclose()
+
+    with StubLLMServer(delay=0.5) as stub:
+        service.api_key = "test-key"
+        service.base_url = stub.base_url
+        service.client_mode = "async"
+        try:
+            asyncio.run(run(stub))
+        finally:
+            service.api_key, service.base_url, service.client_mode = saved
+    print("✅ Exhausted budget returns the fallback at once and the late answer fills the cache")
+
+
+if __name__ == "__main__":
+    test_timeout_follows_latency_percentile()
+    test_budget_exhaustion_degrades_and_fills_cache()
@@ -0,0 +1,85 @@
+"""
+Test script for the metrics registry, sampled structured logging and /metrics
+"""
+import sys
+import os
+import io
+import json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import structured_logging
+from metrics import MetricsRegistry
+from structured_logging import get_logger
+
+
+def test_prometheus_text_format():
+    registry = MetricsRegistry()
+    requests_total = registry.counter("requests_total", "Requests", ("endpoint",))
+    in_flight = registry.gauge("in_flight", "In flight")
+    latency = registry.histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+
+    requests_total.inc(endpoint="/analyze")
+    requests_total.inc(2, endpoint="/analyze")
+    in_flight.inc()
+    in_flight.dec()
+    latency.observe(0.05, stage="decode")
+    latency.observe(0.5, stage="decode")
+    latency.observe(5.0, stage="decode")
+
+    text = registry.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{endpoint="/analyze"} 3' in text
+    assert 'in_flight 0' in text
+    assert 'latency_seconds_bucket{stage="decode",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="decode",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{stage="decode",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{stage="decode"} 3' in text
+    assert 'latency_seconds_sum{stage="decode"} 5.55' in text
+    print("✅ Counters, gauges and cumulative histogram buckets render as Prometheus text")
+
+
+def test_unsampled_requests_only_log_warnings():
+    os.environ['LOG_SAMPLE_RATE'] = '0'
+    stream = io.StringIO()
+    structured_logging.shutdown_logging()  # in case the app already started it
+    structured_logging.setup_logging(stream)
+    logger = get_logger("test")
+    try:
+        tokens = structured_logging.start_request("req-1")
+        logger.info("dropped for unsampled request")
+        logger.warning("always kept", extra={"fields": {"status": 503}})
+        structured_logging.end_request(tokens)
+        logger.info("outside a request")
+    finally:
+        structured_logging.shutdown_logging()
+        del os.environ['LOG_SAMPLE_RATE']
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["message"] for line in lines] == ["always kept", "outside a request"]
+    assert lines[0]["request_id"] == "req-1" and lines[0]["status"] == 503
+    assert lines[0]["level"] == "WARNING"
+    print("✅ Sampling drops INFO logs of unsampled requests but keeps warnings")
+
+
+def test_metrics_endpoint_counts_requests():
+    os.environ['MODEL_EAGER_LOAD'] = 'false'
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as client:
+        assert client.get("/health").status_code == 200
+        assert client.get("/health").headers.get("x-request-id")
+        response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_requests_total{endpoint="/health",method="GET",status="200"}' in text
+    assert 'http_request_duration_seconds_count{endpoint="/health",method="GET"}' in text
+    assert 'http_requests_in_flight{endpoint="/metrics"} 1' in text
+    print("✅ /metrics reports request counts, in-flight requests and latency per endpoint")
+
+
+if __name__ == "__main__":
+    test_prometheus_text_format()
+    test_unsampled_requests_only_log_warnings()
+    test_metrics_endpoint_counts_requests()
@@ -0,0 +1,264 @@
+"""
+Test script for the model registry: background loading, atomic promotion and shadow traffic
+Uses small stand-in sessions, and generated ONNX models for the /models endpoints
+"""
+import sys
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('MODEL_EAGER_LOAD', 'false')
+
+import numpy as np
+from PIL import Image
+
+from model_registry import ModelRegistry, ModelStateError
+from model_rollout import ModelRollout
+
+
+class _Input:
+    def __init__(self, shape):
+        self.shape = shape
+
+
+class FakeSession:
+    """Predicts the same class for every image, after an optional delay"""
+
+    def __init__(self, label, delay=0.0, classes=4):
+        self.label = label
+        self.delay = delay
+        self.classes = classes
+        self.runs = 0
+
+    def get_inputs(self):
+        return [_Input(["N", 256, 256, 3])]
+
+    def run(self, output_names, feeds):
+        self.runs += 1
+        time.sleep(self.delay)
+        rows = np.zeros((feeds["input_1"].shape[0], self.classes), dtype=np.float32)
+        rows[:, self.label] = 1.0
+        return [rows]
+
+
+def _wait_for_state(registry, version, state, timeout=10):
+    deadline = time.time() + timeout
+    while registry.get(version).state != state:
+        assert time.time() < deadline, f"{version} stuck in {registry.get(version).state}"
+        time.sleep(0.01)
+
+
+def test_promote_swaps_without_dropping_in_flight_requests():
+    registry = ModelRegistry(max_batch_size=1, max_wait_ms=0, warmup_runs=1)
+    image = np.zeros((256, 256, 3), dtype=np.float32)
+    registry.register("v1", "v1.onnx", FakeSession(label=1, delay=0.3))
+
+    # v2 loads and warms up in the background while v1 keeps serving
+    registry.load("v2", "v2.onnx", lambda: FakeSession(label=2))
+    _wait_for_state(registry, "v2", "ready")
+    assert registry.active.version == "v1"
+
+    results = {}
+    in_flight = threading.Thread(target=lambda: results.update(slow=registry.infer(image)))
+    in_flight.start()
+    time.sleep(0.05)
+    registry.promote("v2")
+    prediction, version = registry.infer(image)
+    assert version == "v2" and np.argmax(prediction) == 2
+    in_flight.join()
+    assert results["slow"][1] == "v1" and np.argmax(results["slow"][0]) == 1, "started on v1, finished on v1"
+
+    # The previous version is kept warm for rollback, and cannot be unloaded while active
+    assert registry.get("v1").state == "ready"
+    registry.promote("v1")
+    assert registry.infer(image)[1] == "v1"
+    try:
+        registry.unload("v1")
+        assert False, "the active version must not be unloaded"
+    except ModelStateError:
+        pass
+    registry.unload("v2")
+    assert [entry["version"] for entry in registry.get_stats()["versions"]] == ["v1"]
+    assert registry.get_stats()["promotions"] == 3
+
+    registry.load("broken", "broken.onnx", lambda: (_ for _ in ()).throw(RuntimeError("bad file")), background=False)
+    assert registry.get("broken").state == "failed"
+    try:
+        registry.promote("broken")
+        assert False, "a failed version must not be promoted"
+    except ModelStateError:
+        pass
+    print("✅ Promotion is atomic and in-flight requests finish on the version they started on")
+
+
+def test_shadow_mirrors_traffic_and_measures_agreement():
+    registry = ModelRegistry(max_batch_size=1, max_wait_ms=0, warmup_runs=1)
+    image = np.zeros((256, 256, 3), dtype=np.float32)
+    registry.register("v1", "v1.onnx", FakeSession(label=1))
+    agreeing = FakeSession(label=1)
+    registry.load("same", "same.onnx", lambda: agreeing, shadow_percent=100, background=False)
+    assert registry.shadow.version == "same"
+
+    for _ in range(20):
+        prediction, version = registry.infer(image)
+        assert version == "v1", "shadow predictions are never returned"
+    deadline = time.time() + 5
+    while registry.get("same").mirrored < 20 and time.time() < deadline:
+        time.sleep(0.01)
+    stats = registry.get("same").get_stats()
+    assert stats["shadow"]["mirrored"] == 20 and stats["shadow"]["agreement_rate"] == 1.0
+    assert stats["p50_ms"] is not None and registry.get("v1").get_stats()["requests"] == 20
+
+    registry.load("other", "other.onnx", lambda: FakeSession(label=3), background=False)
+    registry.set_shadow("other", 50)
+    assert registry.get("same").state == "ready" and registry.shadow.version == "other"
+    for _ in range(200):
+        registry.infer(image)
+    deadline = time.time() + 5
+    while registry.get("other").in_flight and time.time() < deadline:
+        time.sleep(0.01)
+    other = registry.get("other").get_stats()["shadow"]
+    assert 50 < other["mirrored"] < 150, "roughly half the requests are mirrored"
+    assert other["agreement_rate"] == 0.0
+
+    # A failing primary still releases the shadow it mirrored to
+    registry.set_shadow("other", 100)
+    failing = registry.get("v1").scheduler
+    original, failing.infer = failing.infer, lambda image: (_ for _ in ()).throw(RuntimeError("primary failed"))
+    try:
+        registry.infer(image)
+        assert False, "the primary's error is raised"
+    except RuntimeError:
+        pass
+    finally:
+        failing.infer = original
+    deadline = time.time() + 5
+    while registry.get("other").in_flight and time.time() < deadline:
+        time.sleep(0.01)
+    assert registry.get("other").in_flight == 0 and registry.get("v1").in_flight == 0
+
+    registry.set_shadow("other", 0)
+    assert registry.shadow is None
+    print("✅ Shadow versions see a share of traffic and report latency and agreement")
+
+
+def _jpeg():
+    # Textured skin tone, so the quality screen lets it through
+    pixels = np.random.RandomState(0).normal((190, 130, 110), 25, (320, 320, 3)).clip(0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def test_models_endpoints_hot_swap_the_served_version():
+    from fastapi.testclient import TestClient
+    from benchmark_pipeline import build_tiny_model
+    import main
+    import skin_detection_model
+
+    registry = ModelRegistry(max_batch_size=2, max_wait_ms=0, warmup_runs=1)
+    saved = (main.model_registry, skin_detection_model.model_registry, main.model_rollout, main.MODEL_DIR,
+             main.MODEL_ADMIN_TOKEN, skin_detection_model.MODEL_PATH, skin_detection_model.model_version)
+    with tempfile.TemporaryDirectory() as directory:
+        directory = os.path.realpath(directory)
+        build_tiny_model(os.path.join(directory, 'first.onnx'), seed=1)
+        build_tiny_model(os.path.join(directory, 'second.onnx'), seed=2)
+        main.model_registry = skin_detection_model.model_registry = registry
+        main.model_rollout = ModelRollout(registry, skin_detection_model.load_model_version)
+        main.MODEL_DIR, main.MODEL_ADMIN_TOKEN = directory, "secret"
+        skin_detection_model.MODEL_PATH = os.path.join(directory, 'first.onnx')
+        skin_detection_model.model_version = None
+        main.detection_cache.clear()
+        try:
+            with TestClient(main.app) as client:
+                upload = {"image": ("skin.jpg", _jpeg(), "image/jpeg")}
+                response = client.post("/analyze?async_analysis=true", files=upload)
+                first_version = response.json()["result"]["model_version"]
+                assert first_version.startswith("first-")
+
+                assert client.post("/models", json={"path": "second.onnx"}).status_code == 403
+                assert client.get("/models").status_code == 403
+                headers = {"X-Admin-Token": "secret"}
+                assert client.post("/models", json={"path": "../etc/passwd"}, headers=headers).status_code == 400
+                response = client.post("/models", json={"path": "second.onnx", "activate": True}, headers=headers)
+                assert response.status_code == 202, response.text
+                second_version = response.json()["version"]
+                deadline = time.time() + 10
+                while client.get("/models", headers=headers).json()["active"] != second_version:
+                    assert time.time() < deadline, client.get("/models", headers=headers).json()
+                    time.sleep(0.05)
+
+                # The version is part of the cache key: the same upload is scored again by the new model
+                response = client.post("/analyze?async_analysis=true", files=upload)
+                assert response.json()["result"]["model_version"] == second_version
+                assert client.get("/ready").json()["model_version"] == second_version
+
+                # Roll back
+                assert client.post(f"/models/{first_version}/promote", headers=headers).status_code == 200
+                assert client.post("/analyze?async_analysis=true", files=upload).json()["result"]["model_version"] == first_version
+                assert client.post("/models/unknown/promote", headers=headers).status_code == 404
+                assert client.delete(f"/models/{first_version}", headers=headers).status_code == 409
+                assert client.delete(f"/models/{second_version}", headers=headers).status_code == 200
+                stats = client.get("/stats").json()["models"]
+                assert stats["active"] == first_version and len(stats["versions"]) == 1
+        finally:
+            (main.model_registry, skin_detection_model.model_registry, main.model_rollout, main.MODEL_DIR,
+             main.MODEL_ADMIN_TOKEN, skin_detection_model.MODEL_PATH, skin_detection_model.model_version) = saved
+            main.detection_cache.clear()
+    print("✅ /models loads, promotes and rolls back model versions without a restart")
+
+
+def test_rollout_reaches_every_worker():
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "rollout.db")
+        sessions = {"v1.onnx": 1, "v2.onnx": 2, "v3.onnx": 3}
+
+        def worker():
+            registry = ModelRegistry(max_batch_size=1, max_wait_ms=0, warmup_runs=1)
+            registry.register("v1", "v1.onnx", FakeSession(label=1))
+
+            def load_version(path, version, activate=False, shadow_percent=None):
+                return registry.load(version, path, lambda: FakeSession(label=sessions[path]), activate=activate,
+                                     shadow_percent=shadow_percent, background=False)
+            rollout = ModelRollout(registry, load_version)
+            rollout.start(path=database, workers=2)
+            rollout.close()  # synced by hand below
+            return registry, rollout
+
+        (first, first_rollout), (second, second_rollout) = worker(), worker()
+        image = np.zeros((256, 256, 3), dtype=np.float32)
+
+        # A change made through one worker is applied by the other on its next sync
+        first_rollout.load("v2", "v2.onnx", activate=True)
+        assert first.infer(image)[1] == "v2" and second.infer(image)[1] == "v1"
+        second_rollout.sync()
+        assert second.infer(image)[1] == "v2" and second_rollout.converged()
+        assert second.get("v1").state == "ready", "the previous version stays as a standby"
+
+        second_rollout.load("v3", "v3.onnx", shadow_percent=50)
+        second_rollout.promote("v1")
+        second_rollout.unload("v2")
+        first_rollout.sync()
+        assert first.infer(image)[1] == "v1"
+        assert first.shadow.version == "v3" and first.shadow_percent == 50
+        assert set(first.states()) == {"v1", "v3"} and first_rollout.converged()
+
+        # Without the shared database, changes are refused while several workers run
+        alone = ModelRollout(first, lambda *args, **kwargs: None, workers=2)
+        try:
+            alone.promote("v3")
+            assert False, "a change must not reach only one of several workers"
+        except ModelStateError:
+            pass
+        assert first.active.version == "v1"
+    print("✅ Model changes made through one worker reach every worker through the shared rollout state")
+
+
+if __name__ == "__main__":
+    test_promote_swaps_without_dropping_in_flight_requests()
+    test_shadow_mirrors_traffic_and_measures_agreement()
+    test_models_endpoints_hot_swap_the_served_version()
+    test_rollout_reaches_every_worker()
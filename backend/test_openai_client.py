@@ -0,0 +1,152 @@
+"""
+Test script for the pooled OpenAI clients against a local stub server
+"""
+import sys
+import os
+import asyncio
+import json
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai_service import OpenAIService
+from stub_llm_server import StubLLMServer, DEFAULT_ANALYSIS
+
+
+def _service_for(stub, client_mode="async", deadline=5.0):
+    service = OpenAIService()
+    service.api_key = "test-key"
+    service.base_url = stub.base_url
+    service.client_mode = client_mode
+    service.request_deadline = deadline
+    # Every call below must reach the stub server
+    service.analysis_cache.max_entries = 0
+    return service
+
+
+def test_async_client_reuses_connections():
+    async def run():
+        with StubLLMServer(delay=0.01) as stub:
+            service = _service_for(stub)
+            service.max_connections = 4
+            try:
+                for index in range(5):
+                    result = await service.agenerate_detailed_analysis("Acne", index / 5, "Benzoyl peroxide")
+                    assert result == DEFAULT_ANALYSIS
+                assert stub.connections == 1
+
+                # Concurrent calls share the bounded pool
+                results = await asyncio.gather(*[
+                    service.agenerate_detailed_analysis(f"Condition {index}", 0.7, "Moisturizers") for index in range(20)
+                ])
+            finally:
+                await service.aclose()
+            return stub.requests, stub.connections, results
+
+    requests_made, connections, results = asyncio.run(run())
+    assert all(result == DEFAULT_ANALYSIS for result in results)
+    assert requests_made == 25
+    assert connections <= 4
+    print(f"✅ Async client served {requests_made} requests over {connections} connections")
+
+
+def test_async_deadline_returns_fallback():
+    async def run():
+        with StubLLMServer(delay=1.0) as stub:
+            service = _service_for(stub, deadline=0.2)
+            try:
+                started = time.perf_counter()
+                result = await service.agenerate_detailed_analysis("Acne", 0.9, "Benzoyl peroxide")
+                return result, time.perf_counter() - started
+            finally:
+                await service.aclose()
+
+    result, elapsed = asyncio.run(run())
+    assert elapsed < 0.9
+    assert "Acne" in result["overview"] and result != DEFAULT_ANALYSIS
+    print(f"✅ Deadline enforced, fallback returned after {elapsed:.2f}s")
+
+
+def test_sync_client_keeps_alive():
+    with StubLLMServer() as stub:
+        service = _service_for(stub, client_mode="sync")
+        for index in range(3):
+            assert service.generate_detailed_analysis("Acne", index / 3, "Benzoyl peroxide") == DEFAULT_ANALYSIS
+        asyncio.run(service.aclose())
+        assert stub.requests == 3
+        assert stub.connections == 1
+    print("✅ Sync client reused one keep-alive connection")
+
+
+def test_streaming_yields_tokens_then_analysis():
+    async def collect(service):
+        return [event async for event in service.astream_detailed_analysis("Acne", 0.9, "Benzoyl peroxide")]
+
+    async def run():
+        with StubLLMServer() as stub:
+            service = _service_for(stub)
+            service.analysis_cache.max_entries = 16
+            try:
+                first = await collect(service)
+                second = await collect(service)
+            finally:
+                await service.aclose()
+            return first, second, stub.payloads
+
+    first, second, payloads = asyncio.run(run())
+    tokens = [value for kind, value in first if kind == "token"]
+    assert len(tokens) > 1 and first[-1] == ("analysis", DEFAULT_ANALYSIS)
+    assert json.loads("".join(tokens)) == DEFAULT_ANALYSIS
+    assert payloads[0]["stream"] is True
+    # The streamed analysis fills the cache, so the repeat needs no request
+    assert second == [("analysis", DEFAULT_ANALYSIS)] and len(payloads) == 1
+    print(f"✅ Streamed {len(tokens)} token events, then the parsed analysis")
+
+
+def test_concurrent_streams_share_one_request():
+    async def collect(service):
+        return [event async for event in service.astream_detailed_analysis("Acne", 0.9, "Benzoyl peroxide")]
+
+    async def run():
+        with StubLLMServer(stream_delay=0.01) as stub:
+            service = _service_for(stub)
+            service.analysis_cache.max_entries = 16
+            try:
+                results = await asyncio.gather(*[collect(service) for _ in range(4)])
+            finally:
+                await service.aclose()
+            return results, len(stub.payloads), service.latency_tracker.get_stats()["samples"]
+
+    results, requests_made, samples = asyncio.run(run())
+    assert requests_made == 1 and samples == 1
+    assert all(events[-1] == ("analysis", DEFAULT_ANALYSIS) for events in results)
+    # Only the stream that made the request has tokens; the others wait for its analysis
+    assert sorted(len(events) == 1 for events in results) == [False, True, True, True]
+    print("✅ Concurrent streams shared one provider request and recorded its latency")
+
+
+def test_malformed_json_is_not_cached():
+    async def run():
+        with StubLLMServer(analysis={"overview": "Only one section"}) as stub:
+            service = _service_for(stub)
+            service.analysis_cache.max_entries = 16
+            try:
+                result = await service.agenerate_detailed_analysis("Acne", 0.9, "Benzoyl peroxide")
+                streamed = [event async for event in service.astream_detailed_analysis("Acne", 0.9, "Benzoyl peroxide")]
+            finally:
+                await service.aclose()
+            fallback = service._get_fallback_response("Acne", "Benzoyl peroxide", 0.9)
+            return result, streamed, fallback, service.analysis_cache.get_stats()["entries"]
+
+    result, streamed, fallback, entries = asyncio.run(run())
+    assert result == fallback and streamed[-1] == ("analysis", fallback)
+    assert entries == 0
+    print("✅ JSON without the analysis sections falls back and is not cached")
+
+
+if __name__ == "__main__":
+    test_async_client_reuses_connections()
+    test_async_deadline_returns_fallback()
+    test_sync_client_keeps_alive()
+    test_streaming_yields_tokens_then_analysis()
+    test_concurrent_streams_share_one_request()
+    test_malformed_json_is_not_cached()
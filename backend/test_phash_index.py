@@ -0,0 +1,187 @@
+"""
+Test script for the perceptual-hash near-duplicate index
+"""
+import sys
+import os
+import random
+import time
+from io import BytesIO
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('MODEL_EAGER_LOAD', 'false')
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from phash_index import NearDuplicateIndex, perceptual_hashes
+from preprocessing import decode_image
+
+
+def _photo(seed, size=(960, 720)):
+    """Skin-toned photo stand-in: smooth large-scale shading plus fine texture"""
+    state = np.random.RandomState(seed)
+    shading = cv2.resize(state.rand(6, 8).astype(np.float32), size, interpolation=cv2.INTER_CUBIC)
+    base = np.array([190, 130, 110], dtype=np.float32) * (0.6 + 0.5 * shading[..., None])
+    texture = state.normal(0, 12, (size[1], size[0], 3))
+    return Image.fromarray((base + texture).clip(0, 255).astype(np.uint8))
+
+
+def _lesion(seed, size=(960, 720)):
+    """Smooth, centred lesion on plain skin: distinct images whose hashes are only a few bits apart"""
+    state = np.random.RandomState(seed)
+    width, height = size
+    rows, columns = np.mgrid[0:height, 0:width]
+    radius = state.uniform(120, 160)
+    centre = (width / 2 + state.uniform(-20, 20), height / 2 + state.uniform(-20, 20))
+    distance = np.hypot(columns - centre[0], rows - centre[1]) / radius
+    mask = np.clip(1.5 - distance, 0, 1)[..., None]
+    lesion = np.array([110, 60, 50], dtype=np.float32) * state.uniform(0.8, 1.0)
+    pixels = np.array([200, 150, 125], dtype=np.float32) * (1 - mask) + lesion * mask
+    return Image.fromarray((pixels + state.normal(0, 3, pixels.shape)).clip(0, 255).astype(np.uint8))
+
+
+def _encode(image, quality=90):
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _distance(a, b):
+    return max(bin(a[0] ^ b[0]).count("1"), bin(a[1] ^ b[1]).count("1"))
+
+
+def test_hashes_survive_reencoding_but_separate_images():
+    photo = _photo(1)
+    original = perceptual_hashes(decode_image(_encode(photo)))
+    width, height = photo.size
+    variants = {
+        "recompressed": _encode(photo, quality=40),
+        "rescaled": _encode(photo.resize((width // 3, height // 3))),
+        "cropped": _encode(photo.crop((width // 50, height // 50, width - width // 50, height - height // 50))),
+    }
+    for name, data in variants.items():
+        distance = _distance(original, perceptual_hashes(decode_image(data)))
+        assert distance <= 8, f"{name} re-upload is {distance} bits away"
+
+    for seed in range(2, 7):
+        distance = _distance(original, perceptual_hashes(decode_image(_encode(_photo(seed)))))
+        assert distance > 8, f"a different photo is only {distance} bits away"
+    print("✅ Perceptual hashes match re-encoded, rescaled and cropped uploads but not other photos")
+
+
+def test_default_distance_has_no_false_matches_on_lesions():
+    index = NearDuplicateIndex()
+    hashes = [perceptual_hashes(decode_image(_encode(_lesion(seed)))) for seed in range(40)]
+    closest = min(_distance(a, b) for number, a in enumerate(hashes) for b in hashes[number + 1:])
+    assert closest > index.max_distance, f"distinct lesions are {closest} bits apart"
+    for number, image_hashes in enumerate(hashes):
+        assert index.find(image_hashes, "v1") is None, f"lesion {number} matched another lesion"
+        index.add(image_hashes, "v1", f"key{number}")
+
+    photo = _photo(1)
+    original = perceptual_hashes(decode_image(_encode(photo)))
+    retry = perceptual_hashes(decode_image(_encode(photo.resize((480, 360)), 60)))
+    assert _distance(original, retry) <= index.max_distance, "a rescaled, recompressed retry still matches"
+    print(f"✅ At the default distance ({index.max_distance} bits) distinct lesions {closest} bits apart never match")
+
+
+def test_index_lookup_distance_version_and_eviction():
+    index = NearDuplicateIndex(max_distance=8, max_entries=4)
+    rng = random.Random(0)
+    stored = [(rng.getrandbits(64), rng.getrandbits(64)) for _ in range(4)]
+    for number, hashes in enumerate(stored):
+        index.add(hashes, "v1", f"key{number}")
+
+    def flipped(value, bits):
+        return value ^ sum(1 << bit for bit in rng.sample(range(64), bits))
+
+    phash, dhash = stored[0]
+    assert index.find((flipped(phash, 8), flipped(dhash, 8)), "v1") == "key0"
+    assert index.find((flipped(phash, 9), dhash), "v1") is None
+    assert index.find((phash, dhash), "v2") is None, "only results of the same model version are reused"
+    assert index.find((phash, dhash), "v1", "p-1") is None, "a patient's upload does not reuse anonymous results"
+
+    # key0 was used most recently, so key1 is evicted first
+    index.add((rng.getrandbits(64), rng.getrandbits(64)), "v1", "key4")
+    assert index.find(stored[1], "v1") is None
+    assert index.find(stored[0], "v1") == "key0"
+    assert index.get_stats()["entries"] == 4 and index.get_stats()["evictions"] == 1
+
+    # The same image indexed for two patients is kept per patient
+    index.add(stored[2], "v1", "key2", patient_id="p-1")
+    index.add(stored[2], "v1", "key2", patient_id="p-2")
+    assert index.find(stored[2], "v1", "p-1") == "key2" and index.find(stored[2], "v1", "p-3") is None
+    print("✅ Index matches within the Hamming distance for the same model and evicts the least recently used")
+
+
+def test_lookup_is_sub_millisecond_when_full():
+    index = NearDuplicateIndex(max_distance=8, max_entries=4096)
+    rng = random.Random(1)
+    for number in range(4096):
+        index.add((rng.getrandbits(64), rng.getrandbits(64)), "v1", f"key{number}")
+    queries = [(rng.getrandbits(64), rng.getrandbits(64)) for _ in range(500)]
+    started = time.perf_counter()
+    for query in queries:
+        index.find(query, "v1")
+    average_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    assert average_ms < 1.0, f"lookup took {average_ms:.3f} ms with 4096 entries"
+    print(f"✅ Lookup takes {average_ms:.3f} ms with 4096 indexed images")
+
+
+def test_near_duplicate_upload_reuses_detection_and_analysis():
+    from fastapi.testclient import TestClient
+    import main
+    import metrics
+    from disease_catalog import disease_catalog
+    from phash_index import near_duplicate_index
+
+    detections = []
+
+    def fake_detector(img_array, image_bytes=None):
+        detections.append(1)
+        result = disease_catalog.get_by_index(0)
+        result.update(probability=0.9, time="0.0", model_version=main.get_model_version())
+        return result
+
+    async def fake_analysis(condition, confidence, basic_advice, budget_seconds=None):
+        return {"overview": "o", "detection_details": "d", "recommendations": "r",
+                "important_notes": "n", "next_steps": "s"}
+
+    saved = (main.skindisease_detector, main.generate_detailed_analysis)
+    main.skindisease_detector, main.generate_detailed_analysis = fake_detector, fake_analysis
+    main.detection_cache.clear()
+    near_duplicate_index.clear()
+    try:
+        with TestClient(main.app) as client:
+            photo = _photo(3)
+            first = client.post("/analyze", files={"image": ("a.jpg", _encode(photo), "image/jpeg")})
+            assert first.status_code == 200, first.text
+            hits = metrics.near_duplicate_lookups_total.value(result="hit")
+
+            retry = client.post("/analyze", files={"image": ("a.jpg", _encode(photo.resize((480, 360)), 60), "image/jpeg")})
+            assert retry.status_code == 200
+            assert len(detections) == 1, "the re-encoded retry reuses the earlier detection"
+            assert retry.json()["result"]["detailed_analysis"] == first.json()["result"]["detailed_analysis"]
+            assert metrics.near_duplicate_lookups_total.value(result="hit") == hits + 1
+
+            other = client.post("/analyze", files={"image": ("b.jpg", _encode(_photo(4)), "image/jpeg")})
+            assert other.status_code == 200 and len(detections) == 2
+
+            # Another patient's retry of the same photo is analyzed for that patient
+            patient = client.post("/analyze", data={"patient_id": "p-9"},
+                                  files={"image": ("a.jpg", _encode(photo.resize((480, 360)), 70), "image/jpeg")})
+            assert patient.status_code == 200 and len(detections) == 3
+    finally:
+        main.skindisease_detector, main.generate_detailed_analysis = saved
+        main.detection_cache.clear()
+        near_duplicate_index.clear()
+    print("✅ A near-duplicate upload reuses the earlier detection and analysis")
+
+
+if __name__ == "__main__":
+    test_hashes_survive_reencoding_but_separate_images()
+    test_default_distance_has_no_false_matches_on_lesions()
+    test_index_lookup_distance_version_and_eviction()
+    test_lookup_is_sub_millisecond_when_full()
+    test_near_duplicate_upload_reuses_detection_and_analysis()
@@ -0,0 +1,124 @@
+"""
+Test script for the image-quality screen and the skipped OpenAI calls it saves
+"""
+import sys
+import os
+import time
+from io import BytesIO
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('MODEL_EAGER_LOAD', 'false')
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from quality_screen import QualityScreen
+
+
+def _skin(size=256, seed=0):
+    """Textured skin-tone image, sharp and well exposed"""
+    return np.random.RandomState(seed).normal((190, 130, 110), 25, (size, size, 3)).clip(0, 255).astype(np.uint8)
+
+
+def _jpeg(pixels):
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def test_checks_find_each_problem():
+    screen = QualityScreen(mode='reject')
+    assert QualityScreen().mode == 'flag', "existing clients keep getting results by default"
+    image = _skin()
+    assert screen.assess(image, (1024, 768))["issues"] == []
+    assert screen.assess(cv2.GaussianBlur(image, (0, 0), 3), (1024, 768))["issues"] == ["blurry"]
+    assert screen.assess((image * 0.1).astype(np.uint8), (1024, 768))["issues"] == ["underexposed"]
+    assert screen.assess(np.clip(image.astype(int) + 120, 0, 255).astype(np.uint8), (1024, 768))["issues"] == ["overexposed"]
+    assert screen.assess(image, (100, 80))["issues"] == ["low_resolution"]
+    sky = np.random.RandomState(1).normal((60, 120, 220), 25, (256, 256, 3)).clip(0, 255).astype(np.uint8)
+    assert screen.assess(sky, (1024, 768))["issues"] == ["no_skin"]
+
+    flagging = QualityScreen(mode='flag', min_sharpness=0)
+    report = flagging.assess(sky, (1024, 768))
+    assert flagging.verdict(report) == "flagged" and screen.verdict(report) == "rejected"
+    assert "no skin" in screen.rejection_message(report)
+    print("✅ Blur, exposure, resolution and skin checks each flag their problem")
+
+
+def test_screen_costs_well_under_a_millisecond():
+    screen = QualityScreen()
+    image = _skin()
+    for _ in range(20):
+        screen.assess(image, (1024, 768))
+    timings = []
+    for _ in range(200):
+        started = time.perf_counter()
+        screen.assess(image, (1024, 768))
+        timings.append(time.perf_counter() - started)
+    median_ms = sorted(timings)[len(timings) // 2] * 1000
+    assert median_ms < 1.0, f"screen took {median_ms:.3f} ms at 256x256"
+    print(f"✅ Quality screen takes {median_ms:.3f} ms per 256x256 image")
+
+
+def test_rejected_and_low_confidence_images_skip_work():
+    from fastapi.testclient import TestClient
+    import main
+    import metrics
+    from disease_catalog import disease_catalog
+    from quality_screen import quality_screen
+
+    llm_calls = []
+    probability = {"value": 0.9}
+
+    def fake_detector(img_array, image_bytes=None):
+        result = disease_catalog.get_by_index(0)
+        result.update(probability=probability["value"], time="0.0", model_version="test-model")
+        return result
+
+    async def fake_analysis(condition, confidence, basic_advice, budget_seconds=None):
+        llm_calls.append(condition)
+        return main.openai_service._get_fallback_response(condition, basic_advice, confidence)
+
+    saved = (main.skindisease_detector, main.generate_detailed_analysis, quality_screen.mode)
+    main.skindisease_detector, main.generate_detailed_analysis = fake_detector, fake_analysis
+    main.detection_cache.clear()
+    try:
+        with TestClient(main.app) as client:
+            def analyze(pixels, seed):
+                # A distinct trailing byte per call keeps the result cache out of the way
+                return client.post("/analyze", files={"image": ("a.jpg", _jpeg(pixels) + bytes([seed]), "image/jpeg")})
+
+            quality_screen.mode = 'reject'
+            skipped_inference = metrics.work_skipped_total.value(stage="inference", reason="quality")
+            blurry = cv2.GaussianBlur(_skin(400), (0, 0), 4)
+            response = analyze(blurry, 1)
+            assert response.status_code == 422 and "out of focus" in response.json()["detail"]
+            assert metrics.work_skipped_total.value(stage="inference", reason="quality") == skipped_inference + 1
+
+            quality_screen.mode = 'flag'
+            response = analyze(blurry, 2)
+            assert response.status_code == 200
+            assert response.json()["result"]["quality"]["issues"] == ["blurry"]
+            assert llm_calls == [], "flagged images get the standard analysis without an OpenAI call"
+
+            skipped_llm = metrics.work_skipped_total.value(stage="llm", reason="low_confidence")
+            probability["value"] = main.LLM_MIN_CONFIDENCE / 2
+            assert analyze(_skin(400), 3).status_code == 200
+            assert llm_calls == []
+            assert metrics.work_skipped_total.value(stage="llm", reason="low_confidence") == skipped_llm + 1
+
+            probability["value"] = 0.9
+            result = analyze(_skin(400), 4).json()["result"]
+            assert len(llm_calls) == 1 and result["quality"]["issues"] == []
+            assert result["timings"]["quality"] is not None
+    finally:
+        main.skindisease_detector, main.generate_detailed_analysis, quality_screen.mode = saved
+        main.detection_cache.clear()
+    print("✅ Rejected images skip inference, and flagged or low-confidence ones skip the OpenAI call")
+
+
+if __name__ == "__main__":
+    test_checks_find_each_problem()
+    test_screen_costs_well_under_a_millisecond()
+    test_rejected_and_low_confidence_images_skip_work()
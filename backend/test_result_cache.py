@@ -0,0 +1,69 @@
+"""
+Test script for the content-addressed detection result cache
+"""
+import sys
+import os
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from result_cache import DetectionCache
+
+SAMPLE_RESULT = {"disease": "Acne", "probability": 0.91, "treatments": ["Benzoyl peroxide"]}
+
+
+def test_key_depends_on_bytes_and_model_version():
+    key = DetectionCache.make_key(b"image-bytes", "model-a")
+    assert key == DetectionCache.make_key(b"image-bytes", "model-a")
+    assert key != DetectionCache.make_key(b"image-bytes", "model-b")
+    assert key != DetectionCache.make_key(b"other-bytes", "model-a")
+    print("✅ Cache key covers upload bytes and model version")
+
+
+def test_memory_tier_is_bounded_lru():
+    cache = DetectionCache(max_entries=2)
+    cache.put("a", SAMPLE_RESULT)
+    cache.put("b", SAMPLE_RESULT)
+    assert cache.get("a") == SAMPLE_RESULT  # "a" becomes most recently used
+    cache.put("c", SAMPLE_RESULT)
+    assert cache.get("b") is None
+    assert cache.get("a") == SAMPLE_RESULT and cache.get("c") == SAMPLE_RESULT
+
+    stats = cache.get_stats()
+    assert stats["entries"] == 2
+    assert stats["memory_hits"] == 3 and stats["misses"] == 1
+    print("✅ Memory tier evicts least recently used entries")
+
+
+def test_disk_tier_survives_restart():
+    with tempfile.TemporaryDirectory() as disk_dir:
+        key = DetectionCache.make_key(b"image-bytes", "model-a")
+        cache = DetectionCache(max_entries=4, disk_dir=disk_dir)
+        cache.put(key, SAMPLE_RESULT)
+        cache.flush()
+
+        restarted = DetectionCache(max_entries=4, disk_dir=disk_dir)
+        assert asyncio.run(restarted.aget(key)) == SAMPLE_RESULT
+        assert restarted.get(key) == SAMPLE_RESULT
+        assert asyncio.run(restarted.aget("missing")) is None
+        stats = restarted.get_stats()
+        assert stats["disk_hits"] == 1 and stats["memory_hits"] == 1 and stats["misses"] == 1
+    print("✅ Disk tier answers after restart and is promoted to memory")
+
+
+def test_disk_tier_is_trimmed():
+    with tempfile.TemporaryDirectory() as disk_dir:
+        cache = DetectionCache(max_entries=0, disk_dir=disk_dir, disk_max_entries=10)
+        for index in range(25):
+            cache.put(f"key-{index}", SAMPLE_RESULT)
+        cache.flush()
+        assert len(os.listdir(disk_dir)) <= 10
+        assert cache.get_stats()["disk_entries"] <= 10
+    print("✅ Disk tier stays within its bound")
+
+
+if __name__ == "__main__":
+    test_key_depends_on_bytes_and_model_version()
+    test_memory_tier_is_bounded_lru()
+    test_disk_tier_survives_restart()
+    test_disk_tier_is_trimmed()
@@ -0,0 +1,58 @@
+"""
+Test script for per-request stage timings and the Server-Timing header
+"""
+import sys
+import os
+import re
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import metrics
+from schemas import StageTimings
+from stage_timer import StageTimer
+
+
+def test_stages_are_recorded_in_order():
+    timer = StageTimer()
+    with timer.stage("decode"):
+        time.sleep(0.01)
+    timer.add("preprocess", 1.5)
+    with timer.stage("inference"):
+        pass
+
+    timings = timer.as_dict()
+    assert list(timings) == ["decode", "preprocess", "inference", "total"]
+    assert timings["decode"] >= 10.0
+    assert timings["preprocess"] == 1.5
+    assert timings["total"] >= timings["decode"]
+    # Fits the response schema; stages that did not run stay empty
+    parsed = StageTimings(**timings)
+    assert parsed.llm is None and parsed.decode == timings["decode"]
+    print("✅ Stage durations are recorded in milliseconds, in order, with a total")
+
+
+def test_server_timing_header_format():
+    timer = StageTimer()
+    timer.add("cache_lookup", 0.25)
+    timer.add("llm", 120.0)
+    header = timer.server_timing()
+    entries = [entry.strip() for entry in header.split(",")]
+    assert entries[0] == "cache_lookup;dur=0.250"
+    assert entries[1] == "llm;dur=120.000"
+    assert re.fullmatch(r"total;dur=\d+\.\d{3}", entries[2])
+    print("✅ Server-Timing header lists each stage and the total")
+
+
+def test_stages_feed_pipeline_histogram():
+    before = metrics.pipeline_stage_duration_seconds.count(stage="upload_read")
+    timer = StageTimer()
+    with timer.stage("upload_read"):
+        pass
+    assert metrics.pipeline_stage_duration_seconds.count(stage="upload_read") == before + 1
+    print("✅ Stage timings are also observed in the /metrics histograms")
+
+
+if __name__ == "__main__":
+    test_stages_are_recorded_in_order()
+    test_server_timing_header_format()
+    test_stages_feed_pipeline_histogram()
@@ -0,0 +1,143 @@
+"""
+Test script for upload size caps, image dimension limits and per-request peak memory
+"""
+import sys
+import os
+import asyncio
+import json
+import struct
+import subprocess
+import tempfile
+import zlib
+from io import BytesIO
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('MODEL_EAGER_LOAD', 'false')
+
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _png_header_only(width, height):
+    """A PNG that declares the given size but carries no pixel data"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b"")
+
+
+def _encode(width, height, image_format):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), (200, 120, 90)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def _decode_in_fresh_process(image_bytes):
+    """(peak RSS growth in MB, rejected) for one decode_image call in a new interpreter"""
+    with tempfile.NamedTemporaryFile(suffix='.img', delete=False) as file:
+        file.write(image_bytes)
+    code = (
+        "import sys, json\n"
+        f"sys.path.insert(0, {BACKEND_DIR!r})\n"
+        "import preprocessing, benchmark_preprocessing as bench\n"
+        f"data = open({file.name!r}, 'rb').read()\n"
+        "before = bench.peak_rss_kb()\n"
+        "try:\n"
+        "    preprocessing.decode_image(data)\n"
+        "    rejected = False\n"
+        "except preprocessing.ImageTooLarge:\n"
+        "    rejected = True\n"
+        "print(json.dumps([(bench.peak_rss_kb() - before) / 1024, rejected]))\n"
+    )
+    try:
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    finally:
+        os.unlink(file.name)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def test_decode_peak_memory_is_bounded():
+    # 24 MP photo: 72 MB as a full RGB decode, decoded at 1/8 scale instead
+    peak_mb, rejected = _decode_in_fresh_process(_encode(6000, 4000, 'JPEG'))
+    assert not rejected
+    assert peak_mb < 16, f"large JPEG decode grew peak RSS by {peak_mb:.1f} MB"
+
+    # Decompression bomb: declares 900 MP (2.7 GB decoded); refused from the header alone
+    peak_mb, rejected = _decode_in_fresh_process(_png_header_only(30000, 30000))
+    assert rejected
+    assert peak_mb < 4, f"bomb check grew peak RSS by {peak_mb:.1f} MB"
+
+    # 25 MP PNG cannot be decoded at reduced scale, so it is over MAX_DECODE_PIXELS
+    peak_mb, rejected = _decode_in_fresh_process(_encode(5000, 5000, 'PNG'))
+    assert rejected
+    assert peak_mb < 4, f"rejected PNG grew peak RSS by {peak_mb:.1f} MB"
+    print("✅ Peak decode memory stays bounded and oversized images are refused from their header")
+
+
+def test_oversized_bodies_are_rejected_before_buffering():
+    import main
+
+    saved = main.MAX_UPLOAD_BYTES
+    main.MAX_UPLOAD_BYTES = 1000
+    try:
+        async def run(headers, chunks):
+            received = []
+            sent = []
+
+            async def receive():
+                received.append(1)
+                body = chunks.pop(0)
+                return {"type": "http.request", "body": body, "more_body": bool(chunks)}
+
+            async def send(message):
+                sent.append(message)
+
+            async def read_everything(scope, receive, send):
+                while (await receive()).get("more_body"):
+                    pass
+                await send({"type": "http.response.start", "status": 200, "headers": []})
+                await send({"type": "http.response.body", "body": b"ok"})
+
+            scope = {"type": "http", "method": "POST", "path": "/analyze", "headers": headers,
+                     "app": main.app, "query_string": b"", "root_path": ""}
+            await main.UploadLimitMiddleware(read_everything)(scope, receive, send)
+            return len(received), sent[0]["status"]
+
+        reads, status = asyncio.run(run([(b"content-length", b"5000000")], [b"x" * 600] * 10))
+        assert (reads, status) == (0, 413), "declared size over the cap: no body read at all"
+
+        reads, status = asyncio.run(run([], [b"x" * 600] * 10))
+        assert (reads, status) == (2, 413), "streamed body is cut off once it passes the cap"
+
+        reads, status = asyncio.run(run([], [b"x" * 400, b"x" * 400]))
+        assert status == 200
+
+        from fastapi.testclient import TestClient
+        with TestClient(main.app) as client:
+            response = client.post("/analyze", files={"image": ("a.jpg", b"x" * 5000, "image/jpeg")})
+            assert response.status_code == 413, response.text
+    finally:
+        main.MAX_UPLOAD_BYTES = saved
+    print("✅ Oversized request bodies get 413 before they are buffered")
+
+
+def test_image_limits_return_413():
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        response = client.post("/analyze", files={"image": ("bomb.png", _png_header_only(30000, 30000), "image/png")})
+        assert response.status_code == 413, response.text
+        assert "pixels" in response.json()["detail"]
+
+        response = client.post("/analyze", files={"image": ("wide.png", _png_header_only(12000, 9000), "image/png")})
+        assert response.status_code == 413
+        assert "12000x9000" in response.json()["detail"]
+    print("✅ Images over the pixel limits are answered with 413")
+
+
+if __name__ == "__main__":
+    test_decode_peak_memory_is_bounded()
+    test_oversized_bodies_are_rejected_before_buffering()
+    test_image_limits_return_413()
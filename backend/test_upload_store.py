@@ -0,0 +1,167 @@
+"""
+Test script for the content-addressed upload store: streaming writes, dedup, sharding and garbage collection
+"""
+import sys
+import os
+import hashlib
+import tempfile
+from io import BytesIO
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('MODEL_EAGER_LOAD', 'false')
+
+import numpy as np
+from PIL import Image
+
+from upload_store import UploadStore, CHUNK_SIZE
+
+
+class ChunkedBody:
+    """File-like body that is generated as it is read and records the largest read"""
+
+    def __init__(self, size, seed):
+        self.remaining = size
+        self.state = np.random.RandomState(seed)
+        self.largest_read = 0
+
+    def read(self, size):
+        self.largest_read = max(self.largest_read, size)
+        size = min(size, self.remaining)
+        self.remaining -= size
+        return self.state.bytes(size)
+
+
+def test_streamed_uploads_are_deduplicated_and_sharded():
+    with tempfile.TemporaryDirectory() as directory:
+        store = UploadStore(directory)
+        body = ChunkedBody(5 * CHUNK_SIZE + 123, seed=1)
+        stored = store.put_file(body)
+        assert stored.new and stored.size == 5 * CHUNK_SIZE + 123
+        assert body.largest_read == CHUNK_SIZE, "the body is never read whole"
+        with open(stored.path, 'rb') as file:
+            content = file.read()
+        assert hashlib.sha256(content).hexdigest() == stored.digest
+        assert os.path.relpath(stored.path, directory) == os.path.join(stored.digest[:2], stored.digest[2:4], stored.digest)
+
+        # Re-submissions only bump counters
+        for _ in range(3):
+            again = store.put_bytes(content)
+            assert not again.new and again.path == stored.path
+        other = store.put_bytes(b"another image")
+        assert store.get(stored.digest) == stored.path and store.get(other.digest) == other.path
+        assert store.get("0" * 64) is None and store.get("../index.db") is None
+        assert os.listdir(os.path.join(directory, "tmp")) == []
+
+        stats = store.get_stats()
+        assert stats["files"] == 2 and stats["uploads"] == 5
+        assert stats["disk_bytes"] == len(content) + len(b"another image")
+        assert abs(stats["dedup_ratio"] - (4 * len(content) + 13) / stats["disk_bytes"]) < 1e-9
+    print(f"✅ Streamed uploads are stored once per content digest (dedup ratio {stats['dedup_ratio']:.2f})")
+
+
+def test_garbage_collection_respects_references_ttl_and_size():
+    with tempfile.TemporaryDirectory() as directory:
+        store = UploadStore(directory, ttl_seconds=3600, max_bytes=2500)
+        pinned = store.put_bytes(b"p" * 1000, owner="p-1")
+        # The same owner holds one reference however often it uploads the file
+        assert store.put_bytes(b"p" * 1000, owner="p-1").digest == pinned.digest
+        assert store.acquire(pinned.digest, "p-2") and not store.acquire("0" * 64, "p-2")
+        old = store.put_bytes(b"o" * 1000)
+        recent = [store.put_bytes(bytes([number]) * 1000) for number in range(2)]
+        index = store._index()
+        index.execute("UPDATE blobs SET last_used = last_used - 7200 WHERE digest IN (?, ?)", (pinned.digest, old.digest))
+        index.execute("UPDATE blobs SET last_used = last_used - 10 WHERE digest = ?", (recent[0].digest,))
+
+        # The expired unreferenced file goes; the pinned one stays however old it is
+        removed = store.collect_garbage()
+        assert removed["removed_files"] == 2, removed
+        assert store.get(old.digest) is None and store.get(pinned.digest) is not None
+        # Then the store is still over max_bytes, so the least recently used file went too
+        assert store.get(recent[0].digest) is None and store.get(recent[1].digest) is not None
+        assert store.get_stats()["disk_bytes"] <= 2500
+
+        # Once every owner has released it, the pinned file expires like any other
+        assert store.release("p-1") == 1 and store.release("p-1") == 0
+        index.execute("UPDATE blobs SET last_used = last_used - 7200 WHERE digest = ?", (pinned.digest,))
+        store.collect_garbage()
+        assert store.get(pinned.digest) is not None, "p-2 still holds it"
+        assert store.release("p-2", pinned.digest) == 1
+        index.execute("UPDATE blobs SET last_used = last_used - 7200 WHERE digest = ?", (pinned.digest,))
+        store.collect_garbage()
+        assert store.get(pinned.digest) is None
+
+        # Content removed by the collector is written again by the next upload
+        assert store.put_bytes(b"o" * 1000).new and store.get(old.digest) is not None
+        assert store.get_stats()["removed_files"] == 3
+    print("✅ Garbage collection removes expired and least recently used files but keeps referenced ones")
+
+
+def _jpeg(seed):
+    pixels = np.random.RandomState(seed).normal((190, 130, 110), 25, (320, 320, 3)).clip(0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def test_analyzed_uploads_are_stored_and_served_by_digest():
+    from fastapi.testclient import TestClient
+    import main
+    from disease_catalog import disease_catalog
+
+    def fake_detector(img_array, image_bytes=None):
+        result = disease_catalog.get_by_index(2)
+        result.update(probability=0.7, time="0.0", model_version=main.get_model_version())
+        return result
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = UploadStore(directory)
+        saved = (main.upload_store, main.skindisease_detector, main.HISTORY_ACCESS_TOKEN)
+        main.upload_store, main.skindisease_detector, main.HISTORY_ACCESS_TOKEN = store, fake_detector, "secret"
+        headers = {"X-History-Token": "secret"}
+        main.detection_cache.clear()
+        try:
+            with TestClient(main.app) as client:
+                image = _jpeg(5)
+                digests = set()
+                for patient_id in (None, "p-1", "p-1"):
+                    data = {"patient_id": patient_id} if patient_id else {}
+                    response = client.post("/analyze?async_analysis=true", data=data,
+                                           files={"image": ("skin.jpg", image, "image/jpeg")})
+                    assert response.status_code == 200, response.text
+                    digests.add(response.json()["result"]["image_digest"])
+                digest = digests.pop()
+                assert not digests and digest == hashlib.sha256(image).hexdigest()
+
+                assert client.get(f"/uploads/{digest}").status_code == 401
+                assert client.get(f"/uploads/{digest}", headers={"X-History-Token": "wrong"}).status_code == 403
+                response = client.get(f"/uploads/{digest}", headers=headers)
+                assert response.status_code == 200 and response.content == image
+                assert response.headers["content-type"] == "image/jpeg"
+                assert client.get(f"/uploads/{'f' * 64}", headers=headers).status_code == 404
+
+                # Collected between the lookup and the open: still a 404, not a 500
+                lookup = store.get
+                store.get = lambda wanted: store.path(wanted)
+                try:
+                    assert client.get(f"/uploads/{'e' * 64}", headers=headers).status_code == 404
+                finally:
+                    store.get = lookup
+
+                stats = client.get("/stats").json()["upload_store"]
+                assert stats["files"] == 1 and stats["uploads"] == 3 and stats["pinned_files"] == 1
+                assert store._index().execute("SELECT refs FROM blobs").fetchone()[0] == 1
+
+                assert client.delete("/uploads", params={"patient_id": "p-1"}).status_code == 401
+                response = client.delete("/uploads", params={"patient_id": "p-1"}, headers=headers)
+                assert response.status_code == 200 and response.json() == {"released": 1}
+                assert client.get("/stats").json()["upload_store"]["pinned_files"] == 0
+        finally:
+            main.upload_store, main.skindisease_detector, main.HISTORY_ACCESS_TOKEN = saved
+            main.detection_cache.clear()
+    print("✅ Analyzed uploads are stored once and served by their image digest")
+
+
+if __name__ == "__main__":
+    test_streamed_uploads_are_deduplicated_and_sharded()
+    test_garbage_collection_respects_references_ttl_and_size()
+    test_analyzed_uploads_are_stored_and_served_by_digest()
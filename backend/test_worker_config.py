@@ -0,0 +1,58 @@
+"""
+Test script for the gunicorn worker plan and the shared preloaded model
+"""
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import onnxruntime as rt
+
+from gunicorn_conf import plan_workers, worker_cpus
+from benchmark_pipeline import build_tiny_model
+import skin_detection_model
+
+
+def test_cores_are_split_between_workers_and_threads():
+    assert plan_workers(8) == (4, 2)
+    assert plan_workers(1) == (1, 1)
+    assert plan_workers(8, workers=8) == (8, 1)
+    assert plan_workers(16, workers=2) == (2, 8)
+    assert plan_workers(8, intra_op_threads=4) == (4, 4), "explicit settings are kept"
+
+    cpus = [0, 1, 2, 3, 4, 5, 6, 7]
+    assert [worker_cpus(cpus, slot, 2) for slot in range(4)] == [[0, 1], [2, 3], [4, 5], [6, 7]]
+    assert worker_cpus(cpus, 4, 2) == [0, 1], "extra workers wrap around"
+    assert worker_cpus([3], 1, 4) == [3]
+    print("✅ Cores are split between workers and ONNX threads without overlap")
+
+
+def test_shared_model_session_matches_regular_session():
+    saved = (skin_detection_model.MODEL_PATH, skin_detection_model.shared_model_bytes, skin_detection_model.model_version)
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = build_tiny_model(os.path.join(directory, 'model.onnx'))
+        try:
+            skin_detection_model.MODEL_PATH = model_path
+            skin_detection_model.model_version = None
+            size = skin_detection_model.preload_shared_model()
+            assert size > 0
+            assert os.path.exists(os.path.join(directory, 'model.extended.optimized.ort'))
+
+            shared = skin_detection_model._create_session(model_path)
+            regular = rt.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+            image = np.random.rand(2, 256, 256, 3).astype(np.float32)
+            input_name = regular.get_inputs()[0].name
+            expected = regular.run(None, {input_name: image})[0]
+            actual = shared.run(None, {input_name: image})[0]
+            assert np.allclose(expected, actual, atol=1e-6)
+            del shared
+        finally:
+            (skin_detection_model.MODEL_PATH, skin_detection_model.shared_model_bytes,
+             skin_detection_model.model_version) = saved
+    print("✅ Sessions on the preloaded ORT-format model give the same predictions")
+
+
+if __name__ == "__main__":
+    test_cores_are_split_between_workers_and_threads()
+    test_shared_model_session_matches_regular_session()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Content-addressed, deduplicated storage for uploaded images.
+
+Each upload is streamed to a temporary file in chunks while its SHA-256 is
+computed, then renamed to a path derived from the digest:
+
+    <root>/ab/cd/abcd1234...   (two levels of 256 shard directories)
+
+An upload whose content is already stored only bumps counters, so disk use
+grows with unique images, not with re-submissions. The path follows from the
+digest, so a lookup is one stat of a small directory, not a scan.
+
+A SQLite index next to the shards (WAL mode, shared by all server processes)
+keeps each file's size, upload count, references and last use. A reference
+belongs to an owner (e.g. the patient an upload is filed under) and each
+owner holds at most one per file, however often it uploads it. Referenced
+files are never collected; once the last owner releases a file it is
+removed TTL_SECONDS after its last use like any other. Unreferenced files
+also go, least recently used first, while the store is over MAX_BYTES.
+
+Usage:
+    python upload_store.py uploads [--root upload_store]   import a flat directory of uploads
+    python upload_store.py --gc [--root upload_store]      run the garbage collector once
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, BinaryIO, Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("upload_store")
+
+CHUNK_SIZE = 1024 * 1024
+DIGEST_LENGTH = 64
+HEX_DIGITS = frozenset("0123456789abcdef")
+# Temporary files left behind by a crash mid-write are removed after this long
+STALE_TEMP_SECONDS = 3600
+# Most files removed in one write transaction by the garbage collector
+GC_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    uploads INTEGER NOT NULL,
+    refs INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_collectable ON blobs (refs, last_used);
+CREATE TABLE IF NOT EXISTS refs (
+    owner TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (owner, digest)
+);
+CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest);
+"""
+
+UPSERT = """
+INSERT INTO blobs (digest, size, uploads, refs, created_at, last_used) VALUES (?, ?, 1, ?, ?, ?)
+ON CONFLICT (digest) DO UPDATE SET uploads = uploads + 1, refs = refs + excluded.refs, last_used = excluded.last_used
+"""
+
+RELEASE = "UPDATE blobs SET refs = MAX(refs - 1, 0), last_used = ? WHERE digest = ?"
+
+
+def is_digest(value: str) -> bool:
+    return len(value) == DIGEST_LENGTH and set(value) <= HEX_DIGITS
+
+
+class StoredUpload:
+    __slots__ = ("digest", "size", "path", "new")
+
+    def __init__(self, digest: str, size: int, path: str, new: bool):
+        self.digest = digest
+        self.size = size
+        self.path = path
+        self.new = new  # False when the content was already stored
+
+
+class UploadStore:
+    def __init__(self, root: Optional[str] = None, ttl_seconds: float = 30 * 86400, max_bytes: int = 10 * 1024 ** 3,
+                 gc_interval_seconds: float = 600.0, busy_timeout_ms: int = 5000):
+        self.root = os.path.realpath(root) if root else None
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max(0, max_bytes)
+        self.gc_interval_seconds = max(1.0, gc_interval_seconds)
+        self.busy_timeout_ms = max(0, busy_timeout_ms)
+        self._connections = threading.local()
+        self._gc_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.gc_runs = 0
+        self.removed_files = 0
+        self.removed_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def _index(self) -> sqlite3.Connection:
+        """One index connection per thread"""
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+            connection = sqlite3.connect(os.path.join(self.root, "index.db"), timeout=self.busy_timeout_ms / 1000.0,
+                                         isolation_level=None)
+            connection.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self._connections.connection = connection
+        return connection
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def get(self, digest: str) -> Optional[str]:
+        """Path of the stored file with this digest, or None"""
+        if not self.enabled or not is_digest(digest):
+            return None
+        path = self.path(digest)
+        return path if os.path.isfile(path) else None
+
+    def put_stream(self, chunks: Iterable[bytes], owner: Optional[str] = None) -> StoredUpload:
+        """
+        Store the content of `chunks`, hashing it as it is written; only one chunk is in memory
+        at a time. With an owner, it holds a reference to the file until release().
+        """
+        index = self._index()
+        fd, temp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+            digest = hasher.hexdigest()
+            path = self.path(digest)
+
+            # The index row is written first: once its last_used is fresh, the collector leaves
+            # the file alone, and a collection in progress finishes before this write goes through
+            now = time.time()
+            index.execute("BEGIN IMMEDIATE")
+            try:
+                referenced = owner is not None and index.execute(
+                    "INSERT OR IGNORE INTO refs (owner, digest) VALUES (?, ?)", (owner, digest)).rowcount == 1
+                index.execute(UPSERT, (digest, size, int(referenced), now, now))
+                index.execute("COMMIT")
+            except BaseException:
+                index.execute("ROLLBACK")
+                raise
+            new = not os.path.exists(path)
+            if new:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                temp_path = None
+            return StoredUpload(digest, size, path, new)
+        finally:
+            if temp_path is not None:
+                os.unlink(temp_path)
+
+    def put_bytes(self, data: bytes, owner: Optional[str] = None) -> StoredUpload:
+        view = memoryview(data)
+        return self.put_stream((view[start:start + CHUNK_SIZE] for start in range(0, len(view), CHUNK_SIZE)), owner)
+
+    def put_file(self, file: BinaryIO, owner: Optional[str] = None) -> StoredUpload:
+        return self.put_stream(iter(lambda: file.read(CHUNK_SIZE), b''), owner)
+
+    def acquire(self, digest: str, owner: str) -> bool:
+        """Take owner's reference to a stored file so it is never collected; False if it is not stored"""
+        index = self._index()
+        index.execute("BEGIN IMMEDIATE")
+        try:
+            stored = index.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is not None
+            if stored and index.execute("INSERT OR IGNORE INTO refs (owner, digest) VALUES (?, ?)",
+                                        (owner, digest)).rowcount == 1:
+                index.execute("UPDATE blobs SET refs = refs + 1, last_used = ? WHERE digest = ?", (time.time(), digest))
+            index.execute("COMMIT")
+        except BaseException:
+            index.execute("ROLLBACK")
+            raise
+        return stored
+
+    def release(self, owner: str, digest: Optional[str] = None) -> int:
+        """
+        Drop owner's reference to one file, or to all its files without a digest; returns how many
+        were dropped. A file expires TTL_SECONDS after its last reference goes.
+        """
+        index = self._index()
+        index.execute("BEGIN IMMEDIATE")
+        try:
+            if digest is None:
+                digests = [row[0] for row in index.execute("SELECT digest FROM refs WHERE owner = ?", (owner,))]
+            else:
+                digests = [digest]
+            released = []
+            for candidate in digests:
+                if index.execute("DELETE FROM refs WHERE owner = ? AND digest = ?", (owner, candidate)).rowcount:
+                    released.append((time.time(), candidate))
+            index.executemany(RELEASE, released)
+            index.execute("COMMIT")
+        except BaseException:
+            index.execute("ROLLBACK")
+            raise
+        return len(released)
+
+    def collect_garbage(self) -> Dict[str, int]:
+        """Remove expired unreferenced files, then the least recently used ones while over max_bytes"""
+        index = self._index()
+        removed_files = removed_bytes = 0
+        cutoff = time.time() - self.ttl_seconds
+        while True:
+            # Files are unlinked inside the write transaction, so a concurrent put of the same
+            # content waits for it and then finds the file gone and writes it again
+            index.execute("BEGIN IMMEDIATE")
+            try:
+                rows = index.execute(
+                    "SELECT digest, size FROM blobs WHERE refs = 0 AND last_used < ? LIMIT ?", (cutoff, GC_BATCH)
+                ).fetchall()
+                if not rows and self.max_bytes:
+                    total = index.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+                    if total > self.max_bytes:
+                        rows = []
+                        for digest, size in index.execute(
+                            "SELECT digest, size FROM blobs WHERE refs = 0 ORDER BY last_used LIMIT ?", (GC_BATCH,)
+                        ):
+                            if total <= self.max_bytes:
+                                break
+                            rows.append((digest, size))
+                            total -= size
+                for digest, size in rows:
+                    index.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                    try:
+                        os.unlink(self.path(digest))
+                    except FileNotFoundError:
+                        pass
+                    removed_files += 1
+                    removed_bytes += size
+                index.execute("COMMIT")
+            except BaseException:
+                index.execute("ROLLBACK")
+                raise
+            if not rows:
+                break
+
+        temp_directory = os.path.join(self.root, "tmp")
+        for entry in os.scandir(temp_directory):
+            try:
+                if entry.stat().st_mtime < time.time() - STALE_TEMP_SECONDS:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+        self.gc_runs += 1
+        self.removed_files += removed_files
+        self.removed_bytes += removed_bytes
+        return {"removed_files": removed_files, "removed_bytes": removed_bytes}
+
+    def start(self):
+        """Start the periodic garbage collector thread; a no-op when disabled or already running"""
+        if not self.enabled or (self._gc_thread is not None and self._gc_thread.is_alive()):
+            return
+        self._stop.clear()
+        self._gc_thread = threading.Thread(target=self._collect_periodically, name="upload-gc", daemon=True)
+        self._gc_thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._gc_thread is not None:
+            self._gc_thread.join(timeout=5)
+            self._gc_thread = None
+
+    def _collect_periodically(self):
+        while not self._stop.wait(self.gc_interval_seconds):
+            try:
+                removed = self.collect_garbage()
+                if removed["removed_files"]:
+                    logger.info(f"Upload store removed {removed['removed_files']} files ({removed['removed_bytes']} bytes)")
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"Upload garbage collection failed: {type(e).__name__}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        files, disk_bytes, uploaded_bytes, uploads, pinned = self._index().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size * uploads), 0), "
+            "COALESCE(SUM(uploads), 0), COALESCE(SUM(refs > 0), 0) FROM blobs"
+        ).fetchone()
+        return {
+            "enabled": True,
+            "files": files,
+            "pinned_files": pinned,
+            "uploads": uploads,
+            "disk_bytes": disk_bytes,
+            "uploaded_bytes": uploaded_bytes,
+            # Bytes uploaded per byte stored
+            "dedup_ratio": uploaded_bytes / disk_bytes if disk_bytes else 1.0,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "gc_runs": self.gc_runs,
+            "removed_files": self.removed_files,
+            "removed_bytes": self.removed_bytes,
+        }
+
+
+upload_store = UploadStore(
+    root=os.getenv('UPLOAD_STORE_DIR') or None,
+    ttl_seconds=float(os.getenv('UPLOAD_STORE_TTL_SECONDS', str(30 * 86400))),
+    max_bytes=int(os.getenv('UPLOAD_STORE_MAX_BYTES', str(10 * 1024 ** 3))),
+    gc_interval_seconds=float(os.getenv('UPLOAD_STORE_GC_INTERVAL_SECONDS', '600')),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import uploads into the content-addressed store, or collect garbage")
+    parser.add_argument('source', nargs='?', help="Directory of uploaded files to import (e.g. uploads)")
+    parser.add_argument('--root', default=upload_store.root or 'upload_store', help="Store directory (default: UPLOAD_STORE_DIR)")
+    parser.add_argument('--gc', action='store_true', help="Run the garbage collector")
+    args = parser.parse_args()
+    if not args.source and not args.gc:
+        parser.error("give a directory to import and/or --gc")
+
+    store = UploadStore(args.root, ttl_seconds=upload_store.ttl_seconds, max_bytes=upload_store.max_bytes)
+    if args.source:
+        for directory, _, filenames in os.walk(args.source):
+            for filename in sorted(filenames):
+                with open(os.path.join(directory, filename), 'rb') as file:
+                    stored = store.put_file(file)
+                print(f"{'stored   ' if stored.new else 'duplicate'} {filename} -> {stored.digest}")
+    if args.gc:
+        removed = store.collect_garbage()
+        print(f"Removed {removed['removed_files']} files ({removed['removed_bytes']} bytes)")
+    stats = store.get_stats()
+    print(f"{stats['files']} files, {stats['disk_bytes']} bytes on disk for {stats['uploads']} uploads "
+          f"({stats['uploaded_bytes']} bytes), dedup ratio {stats['dedup_ratio']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
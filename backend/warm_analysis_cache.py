@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Offline warm-up for the detailed analysis cache.
+
+Generates an OpenAI analysis for every condition in skindisease.json and every
+confidence band, and writes them to the file the server loads at startup
+(ANALYSIS_CACHE_FILE, default precomputed_analyses.json). With that file in
+place the server answers detailed analyses without any network call.
+
+Usage:
+    python warm_analysis_cache.py [--output FILE] [--concurrency 4] [--resume]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analysis_cache import AnalysisCache, is_valid_analysis
+from disease_catalog import disease_catalog
+from openai_service import openai_service
+
+
+def load_conditions():
+    """Condition names and their basic advice, as built by the /analyze endpoint"""
+    return [(name, disease_catalog.basic_advice(index)) for index, name in enumerate(disease_catalog.names())]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate detailed analyses for every condition and confidence band")
+    parser.add_argument('--output', default=openai_service.analysis_cache.precomputed_path,
+                        help="File to write (default: ANALYSIS_CACHE_FILE)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Parallel OpenAI requests")
+    parser.add_argument('--resume', action='store_true', help="Keep entries already present in the output file")
+    args = parser.parse_args()
+
+    if not openai_service._is_configured():
+        print("❌ OPENAI_API_KEY is not configured; nothing to generate")
+        sys.exit(1)
+
+    cache = openai_service.analysis_cache
+    model = openai_service.model
+
+    entries = {}
+    if args.resume and os.path.exists(args.output):
+        with open(args.output, 'r') as file:
+            existing = json.load(file)
+        if existing.get('bucket_width') == cache.bucket_width:
+            # Malformed entries are dropped so they are generated again
+            entries = {key: value for key, value in existing.get('entries', {}).items() if is_valid_analysis(value)}
+            print(f"Resuming with {len(entries)} existing entries")
+
+    # One job per (condition, band), using each band's midpoint confidence
+    jobs = []
+    for condition, basic_advice in load_conditions():
+        for bucket in range(cache.bucket_count):
+            confidence = (bucket + 0.5) * cache.bucket_width
+            key = cache.make_key(condition, confidence, model)
+            if key not in entries:
+                jobs.append((key, condition, cache.bucket_confidence(confidence), basic_advice))
+
+    print(f"🔧 Generating {len(jobs)} analyses with {model} (concurrency {args.concurrency})")
+    started = time.time()
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = {
+            pool.submit(openai_service._request_analysis, condition, confidence, basic_advice): key
+            for key, condition, confidence, basic_advice in jobs
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            analysis = future.result()
+            if not is_valid_analysis(analysis):
+                failed += 1
+            else:
+                entries[futures[future]] = analysis
+            if done % 20 == 0 or done == len(futures):
+                print(f"  {done}/{len(futures)} done")
+                # Save progress so an interrupted run can be resumed
+                AnalysisCache.save_precomputed(args.output, entries, cache.bucket_width, model)
+
+    AnalysisCache.save_precomputed(args.output, entries, cache.bucket_width, model)
+    print(f"✅ Wrote {len(entries)} analyses to {args.output} in {time.time() - started:.1f}s")
+    if failed:
+        print(f"⚠️  {failed} analyses failed; re-run with --resume to retry them")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()